@@ -0,0 +1,79 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.StandardLocation;
+import javax.tools.ToolProvider;
+
+/**
+ * Resident javac driven by utils/daemon.py. One command per line on stdin, one answer per line on stdout:
+ * <pre>
+ *   COMPILE \t classpath \t output dir \t diagnostics file \t source [\t source ...]   ->   DONE \t exit code
+ *   QUIT
+ * </pre>
+ * The file manager, and with it the opened classpath jars, is reused for as long as the classpath does not change.
+ * Diagnostics are written in the same format as the javac command line prints them.
+ */
+public class CompileServer {
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        StandardJavaFileManager fileManager = compiler.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+        String currentClasspath = null;
+        BufferedReader commands = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("READY");
+
+        String line;
+        while ((line = commands.readLine()) != null) {
+            String[] fields = line.split("\t", -1);
+            if (fields[0].equals("QUIT")) {
+                break;
+            }
+            if (!fields[0].equals("COMPILE") || fields.length < 5) {
+                protocol.println("ERROR\tmalformed command: " + fields[0]);
+                continue;
+            }
+            try (Writer diagnostics = new OutputStreamWriter(new FileOutputStream(fields[3]), StandardCharsets.UTF_8)) {
+                if (!fields[1].equals(currentClasspath)) {
+                    fileManager.setLocation(StandardLocation.CLASS_PATH, toFiles(fields[1]));
+                    currentClasspath = fields[1];
+                }
+                List<File> sources = new ArrayList<>();
+                for (int i = 4; i < fields.length; i++) {
+                    sources.add(new File(fields[i]));
+                }
+                Iterable<? extends JavaFileObject> units = fileManager.getJavaFileObjectsFromFiles(sources);
+                boolean success = compiler.getTask(diagnostics, fileManager, null,
+                        Arrays.asList("-d", fields[2]), null, units).call();
+                protocol.println("DONE\t" + (success ? 0 : 1));
+            } catch (Throwable t) {
+                currentClasspath = null;
+                protocol.println("ERROR\t" + String.valueOf(t).replace('\n', ' ').replace('\t', ' '));
+            }
+        }
+    }
+
+    private static List<File> toFiles(String classpath) {
+        List<File> files = new ArrayList<>();
+        for (String entry : classpath.split(File.pathSeparator)) {
+            File file = new File(entry);
+            if (!entry.isEmpty() && file.exists()) {
+                files.add(file);
+            }
+        }
+        return files;
+    }
+}
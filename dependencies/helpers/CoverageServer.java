@@ -0,0 +1,108 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.stream.Stream;
+
+import org.jacoco.core.analysis.Analyzer;
+import org.jacoco.core.analysis.CoverageBuilder;
+import org.jacoco.core.analysis.IClassCoverage;
+import org.jacoco.core.analysis.IMethodCoverage;
+import org.jacoco.core.tools.ExecFileLoader;
+
+/**
+ * Resident coverage analyzer driven by utils/daemon.py. Started with the build dirs of a project-under-test as
+ * arguments, it loads their class files once. One command per line on stdin, one answer per line on stdout:
+ * <pre>
+ *   COVER \t exec files \t class   ->   DONE (\t name \t desc \t inst missed \t inst covered \t br missed \t br covered)*
+ *   RELOAD                         ->   DONE \t number of classes
+ *   QUIT
+ * </pre>
+ * Exec files are separated by the path separator and merged. The class is given by its vm name, e.g. org/a/Foo.
+ */
+public class CoverageServer {
+
+    private static final Map<String, byte[]> classes = new HashMap<>();
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        loadClasses(args);
+        BufferedReader commands = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("READY");
+
+        String line;
+        while ((line = commands.readLine()) != null) {
+            String[] fields = line.split("\t", -1);
+            try {
+                if (fields[0].equals("QUIT")) {
+                    break;
+                } else if (fields[0].equals("RELOAD")) {
+                    loadClasses(args);
+                    protocol.println("DONE\t" + classes.size());
+                } else if (fields[0].equals("COVER") && fields.length == 3) {
+                    protocol.println(cover(fields[1], fields[2]));
+                } else {
+                    protocol.println("ERROR\tmalformed command: " + fields[0]);
+                }
+            } catch (Throwable t) {
+                protocol.println("ERROR\t" + String.valueOf(t).replace('\n', ' ').replace('\t', ' '));
+            }
+        }
+    }
+
+    private static void loadClasses(String[] buildDirs) throws IOException {
+        classes.clear();
+        for (String buildDir : buildDirs) {
+            Path root = Paths.get(buildDir);
+            if (!Files.isDirectory(root)) {
+                continue;
+            }
+            try (Stream<Path> paths = Files.walk(root)) {
+                for (Path path : (Iterable<Path>) paths::iterator) {
+                    String name = root.relativize(path).toString().replace(File.separatorChar, '/');
+                    if (name.endsWith(".class")) {
+                        // the first build dir wins, like on the classpath
+                        classes.putIfAbsent(name.substring(0, name.length() - ".class".length()),
+                                Files.readAllBytes(path));
+                    }
+                }
+            }
+        }
+    }
+
+    private static String cover(String execFiles, String className) throws IOException {
+        byte[] bytes = classes.get(className);
+        if (bytes == null) {
+            throw new IllegalArgumentException("class not found: " + className);
+        }
+        ExecFileLoader loader = new ExecFileLoader();
+        for (String execFile : execFiles.split(File.pathSeparator)) {
+            if (!execFile.isEmpty()) {
+                loader.load(new File(execFile));
+            }
+        }
+        CoverageBuilder builder = new CoverageBuilder();
+        new Analyzer(loader.getExecutionDataStore(), builder).analyzeClass(bytes, className);
+        StringBuilder reply = new StringBuilder("DONE");
+        for (IClassCoverage coverage : builder.getClasses()) {
+            for (IMethodCoverage method : coverage.getMethods()) {
+                reply.append('\t').append(method.getName())
+                        .append('\t').append(method.getDesc())
+                        .append('\t').append(method.getInstructionCounter().getMissedCount())
+                        .append('\t').append(method.getInstructionCounter().getCoveredCount())
+                        .append('\t').append(method.getBranchCounter().getMissedCount())
+                        .append('\t').append(method.getBranchCounter().getCoveredCount());
+            }
+        }
+        return reply.toString();
+    }
+}
@@ -0,0 +1,263 @@
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.UncheckedIOException;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.Optional;
+import java.util.Set;
+
+import org.jacoco.agent.rt.IAgent;
+import org.jacoco.agent.rt.RT;
+import org.junit.platform.engine.DiscoverySelector;
+import org.junit.platform.engine.TestExecutionResult;
+import org.junit.platform.engine.TestSource;
+import org.junit.platform.engine.support.descriptor.ClassSource;
+import org.junit.platform.launcher.Launcher;
+import org.junit.platform.launcher.TestExecutionListener;
+import org.junit.platform.launcher.TestIdentifier;
+import org.junit.platform.launcher.TestPlan;
+import org.junit.platform.launcher.core.LauncherDiscoveryRequestBuilder;
+import org.junit.platform.launcher.core.LauncherFactory;
+import org.junit.platform.launcher.listeners.SummaryGeneratingListener;
+import org.junit.platform.launcher.listeners.TestExecutionSummary;
+
+import static org.junit.platform.engine.discovery.DiscoverySelectors.selectClass;
+
+/**
+ * One-shot test runner driven by utils/daemon.py: runs many test classes in one JVM and one JUnit launch, instead
+ * of paying the JVM startup for each of them. The manifest file given as the only argument has a line per class:
+ * <pre>
+ *   test class \t classpath \t exec file \t output file
+ * </pre>
+ * Every test class is loaded by a class loader of its own, as in TestDaemon. The JaCoCo agent is reset when a class
+ * starts and its data is appended to the exec file of the class when the class finishes, so each exec file has the
+ * coverage of its own class only. Classes of the same name go to separate launches. On stdout:
+ * <pre>
+ *   READY
+ *   START \t index               a test class (by its line in the manifest) started
+ *   DONE \t index \t exit code   and finished
+ *   END
+ * </pre>
+ * Exit codes follow the ConsoleLauncher: 0 success, 1 test failures, 2 no tests found.
+ */
+public class MultiTestLauncher {
+
+    private static final int MAX_STACKTRACE_LINES = 50;
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream discard = new PrintStream(OutputStream.nullOutputStream());
+        System.setOut(discard);
+        System.setErr(discard);
+        protocol.println("READY");
+
+        List<String[]> tests = new ArrayList<>();
+        for (String line : Files.readAllLines(Paths.get(args[0]), StandardCharsets.UTF_8)) {
+            if (!line.isEmpty()) {
+                tests.add(line.split("\t", -1));
+            }
+        }
+        // test classes of the same name can not share a launch, JUnit identifies classes by their names
+        List<Map<String, Integer>> rounds = new ArrayList<>();
+        for (int index = 0; index < tests.size(); index++) {
+            Map<String, Integer> free = null;
+            for (Map<String, Integer> round : rounds) {
+                if (!round.containsKey(tests.get(index)[0])) {
+                    free = round;
+                    break;
+                }
+            }
+            if (free == null) {
+                free = new LinkedHashMap<>();
+                rounds.add(free);
+            }
+            free.put(tests.get(index)[0], index);
+        }
+
+        IAgent agent = RT.getAgent();
+        Launcher launcher = LauncherFactory.create();
+        for (Map<String, Integer> round : rounds) {
+            Map<Integer, URLClassLoader> loaders = new HashMap<>();
+            List<DiscoverySelector> selectors = new ArrayList<>();
+            PerClassListener listener = new PerClassListener(tests, round, loaders, agent, protocol, discard);
+            for (int index : round.values()) {
+                String[] test = tests.get(index);
+                try {
+                    URLClassLoader loader = TestDaemon.classLoader(test[1]);
+                    loaders.put(index, loader);
+                    selectors.add(selectClass(Class.forName(test[0], false, loader)));
+                } catch (IOException | ClassNotFoundException | LinkageError e) {
+                    listener.begin(index);
+                    e.printStackTrace(System.out);
+                    listener.end(1);
+                }
+            }
+            if (!selectors.isEmpty()) {
+                launcher.execute(LauncherDiscoveryRequestBuilder.request().selectors(selectors).build(), listener);
+            }
+            // classes without tests are not in the test plan, disabled ones are skipped without starting
+            for (int index : round.values()) {
+                if (!listener.done.contains(index)) {
+                    listener.begin(index);
+                    if (!listener.skipped.contains(index)) {
+                        System.out.println("No tests found");
+                    }
+                    listener.end(listener.skipped.contains(index) ? 0 : 2);
+                }
+            }
+            for (URLClassLoader loader : loaders.values()) {
+                loader.close();
+            }
+        }
+        protocol.println("END");
+        System.exit(0);  // like the ConsoleLauncher, threads left by the tests must not keep the JVM alive
+    }
+
+    /**
+     * Tracks the test class running, the classes run one after another. Forwards the events of its tests to a
+     * summary of its own and resets and dumps the JaCoCo agent around it
+     */
+    private static class PerClassListener implements TestExecutionListener {
+
+        final Set<Integer> done = new HashSet<>();
+        final Set<Integer> skipped = new HashSet<>();
+        private final List<String[]> tests;
+        private final Map<String, Integer> round;
+        private final Map<Integer, URLClassLoader> loaders;
+        private final IAgent agent;
+        private final PrintStream protocol;
+        private final PrintStream discard;
+        private TestPlan plan;
+        private int current = -1;
+        private PrintStream output;
+        private SummaryGeneratingListener summary;
+        private ClassLoader previous;
+
+        PerClassListener(List<String[]> tests, Map<String, Integer> round, Map<Integer, URLClassLoader> loaders,
+                         IAgent agent, PrintStream protocol, PrintStream discard) {
+            this.tests = tests;
+            this.round = round;
+            this.loaders = loaders;
+            this.agent = agent;
+            this.protocol = protocol;
+            this.discard = discard;
+        }
+
+        private Integer classIndex(TestIdentifier identifier) {
+            Optional<TestSource> source = identifier.getSource();
+            if (identifier.isContainer() && source.isPresent() && source.get() instanceof ClassSource) {
+                // nested classes are not in the round
+                return round.get(((ClassSource) source.get()).getClassName());
+            }
+            return null;
+        }
+
+        void begin(int index) {
+            current = index;
+            try {
+                output = new PrintStream(new FileOutputStream(tests.get(index)[3]), true, "UTF-8");
+            } catch (IOException e) {
+                throw new UncheckedIOException(e);
+            }
+            System.setOut(output);
+            System.setErr(output);
+            previous = Thread.currentThread().getContextClassLoader();
+            if (loaders.containsKey(index)) {
+                Thread.currentThread().setContextClassLoader(loaders.get(index));
+            }
+            agent.reset();
+            summary = new SummaryGeneratingListener();
+            if (plan != null) {
+                summary.testPlanExecutionStarted(plan);
+            }
+            protocol.println("START\t" + index);
+        }
+
+        void end(int exitCode) {
+            System.setOut(discard);
+            System.setErr(discard);
+            Thread.currentThread().setContextClassLoader(previous);
+            // append like the agent's destfile does
+            try (OutputStream exec = new FileOutputStream(tests.get(current)[2], true)) {
+                exec.write(agent.getExecutionData(true));
+            } catch (IOException e) {
+                exitCode = 1;
+                e.printStackTrace(output);
+            }
+            output.close();
+            done.add(current);
+            protocol.println("DONE\t" + current + "\t" + exitCode);
+            current = -1;
+            summary = null;
+        }
+
+        private int finishSummary() {
+            summary.testPlanExecutionFinished(plan);
+            TestExecutionSummary result = summary.getSummary();
+            if (result.getTotalFailureCount() > 0) {
+                PrintWriter writer = new PrintWriter(output);
+                result.printFailuresTo(writer, MAX_STACKTRACE_LINES);
+                writer.flush();
+                return 1;
+            }
+            return result.getTestsStartedCount() + result.getTestsSkippedCount() == 0 ? 2 : 0;
+        }
+
+        @Override
+        public void testPlanExecutionStarted(TestPlan testPlan) {
+            plan = testPlan;
+        }
+
+        @Override
+        public void executionStarted(TestIdentifier identifier) {
+            Integer index = classIndex(identifier);
+            if (index != null && current == -1) {
+                begin(index);
+            }
+            if (summary != null) {
+                summary.executionStarted(identifier);
+            }
+        }
+
+        @Override
+        public void executionFinished(TestIdentifier identifier, TestExecutionResult result) {
+            if (summary != null) {
+                summary.executionFinished(identifier, result);
+            }
+            Integer index = classIndex(identifier);
+            if (index != null && index == current) {
+                end(finishSummary());
+            }
+        }
+
+        @Override
+        public void executionSkipped(TestIdentifier identifier, String reason) {
+            if (summary != null) {
+                summary.executionSkipped(identifier, reason);
+            }
+            Integer index = classIndex(identifier);
+            if (index != null && index != current) {
+                skipped.add(index);
+            }
+        }
+
+        @Override
+        public void dynamicTestRegistered(TestIdentifier identifier) {
+            if (summary != null) {
+                summary.dynamicTestRegistered(identifier);
+            }
+        }
+    }
+}
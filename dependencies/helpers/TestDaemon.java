@@ -0,0 +1,129 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.net.MalformedURLException;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.List;
+
+import org.jacoco.agent.rt.IAgent;
+import org.jacoco.agent.rt.RT;
+import org.junit.platform.launcher.Launcher;
+import org.junit.platform.launcher.LauncherDiscoveryRequest;
+import org.junit.platform.launcher.core.LauncherDiscoveryRequestBuilder;
+import org.junit.platform.launcher.core.LauncherFactory;
+import org.junit.platform.launcher.listeners.SummaryGeneratingListener;
+import org.junit.platform.launcher.listeners.TestExecutionSummary;
+
+import static org.junit.platform.engine.discovery.DiscoverySelectors.selectClass;
+
+/**
+ * Long-lived test worker driven by utils/daemon.py. One command per line on stdin, one answer per line on stdout:
+ * <pre>
+ *   RUN \t test class \t classpath \t exec file \t output file   ->   DONE \t exit code
+ *   QUIT
+ * </pre>
+ * Every test class is loaded by a fresh class loader, so static state of the project-under-test does not leak
+ * between tests, while the JVM, JUnit, Mockito and the JaCoCo agent stay warm.
+ * Exit codes follow the ConsoleLauncher: 0 success, 1 test failures, 2 no tests found.
+ */
+public class TestDaemon {
+
+    private static final int MAX_STACKTRACE_LINES = 50;
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream discard = new PrintStream(OutputStream.nullOutputStream());
+        System.setOut(discard);
+        System.setErr(discard);
+
+        IAgent agent = RT.getAgent();
+        Launcher launcher = LauncherFactory.create();
+        BufferedReader commands = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("READY");
+
+        String line;
+        while ((line = commands.readLine()) != null) {
+            String[] fields = line.split("\t", -1);
+            if (fields[0].equals("QUIT")) {
+                break;
+            }
+            if (!fields[0].equals("RUN") || fields.length != 5) {
+                protocol.println("ERROR\tmalformed command: " + fields[0]);
+                continue;
+            }
+            int exitCode;
+            try (PrintStream output = new PrintStream(new FileOutputStream(fields[4]), true, "UTF-8")) {
+                agent.reset();
+                System.setOut(output);
+                System.setErr(output);
+                try {
+                    exitCode = runTest(launcher, fields[1], fields[2], output);
+                } finally {
+                    System.setOut(discard);
+                    System.setErr(discard);
+                    // append like the agent's destfile does
+                    try (OutputStream exec = new FileOutputStream(fields[3], true)) {
+                        exec.write(agent.getExecutionData(true));
+                    }
+                }
+            } catch (Throwable t) {
+                protocol.println("ERROR\t" + String.valueOf(t).replace('\n', ' ').replace('\t', ' '));
+                continue;
+            }
+            protocol.println("DONE\t" + exitCode);
+        }
+    }
+
+    private static int runTest(Launcher launcher, String testClass, String classpath, PrintStream output)
+            throws Exception {
+        Thread current = Thread.currentThread();
+        ClassLoader previous = current.getContextClassLoader();
+        try (URLClassLoader loader = classLoader(classpath)) {
+            current.setContextClassLoader(loader);
+            Class<?> cls;
+            try {
+                cls = Class.forName(testClass, false, loader);
+            } catch (ClassNotFoundException | LinkageError e) {
+                e.printStackTrace(output);
+                return 1;
+            }
+            LauncherDiscoveryRequest request = LauncherDiscoveryRequestBuilder.request()
+                    .selectors(selectClass(cls))
+                    .build();
+            SummaryGeneratingListener listener = new SummaryGeneratingListener();
+            launcher.execute(request, listener);
+            TestExecutionSummary summary = listener.getSummary();
+            if (summary.getTotalFailureCount() > 0) {
+                PrintWriter writer = new PrintWriter(output);
+                summary.printFailuresTo(writer, MAX_STACKTRACE_LINES);
+                writer.flush();
+                return 1;
+            }
+            return summary.getTestsFoundCount() == 0 ? 2 : 0;
+        } finally {
+            current.setContextClassLoader(previous);
+        }
+    }
+
+    /**
+     * A fresh class loader over the classpath, on top of the one of JUnit, Mockito and the JaCoCo agent
+     */
+    static URLClassLoader classLoader(String classpath) throws MalformedURLException {
+        List<URL> urls = new ArrayList<>();
+        for (String entry : classpath.split(File.pathSeparator)) {
+            if (!entry.isEmpty()) {
+                urls.add(Paths.get(entry).toUri().toURL());
+            }
+        }
+        return new URLClassLoader(urls.toArray(new URL[0]), TestDaemon.class.getClassLoader());
+    }
+}
@@ -13,6 +13,8 @@ Features:
 - Makes requests concurrently, to maximize throughput
 - Throttles request and token usage, to stay under rate limits
 - Retries failed requests up to {max_attempts} times, to avoid missing data
+- Writes results through a single buffered writer, flushed every {flush_every} results or {flush_interval} seconds
+- Resumes an interrupted run, skipping the requests whose metadata already has a successful result
 - Logs errors, to diagnose problems with requests
 
 Example command to call script:
@@ -29,8 +31,8 @@ python examples/api_request_parallel_processor.py \
 ```
 
 Inputs:
-- requests_list : List[str]
-    - A list of JSON Strings. Each String is the 'data' json object to be sent to OpenAI with an additional 'meta'
+- requests_list : Iterable[str] or AsyncIterable[str]
+    - JSON Strings, read lazily. Each String is the 'data' json object to be sent to OpenAI with an additional 'meta'
 - save_filepath : str, optional
     - path to the file where the results will be saved
     - file will be a jsonl file, where each line is an array with the original request plus the API response
@@ -64,28 +66,37 @@ Inputs:
     - 20 = INFO; will log when requests start and the status at finish
     - 10 = DEBUG; will log various things as the loop runs to see when they occur
     - if omitted, will default to 20 (INFO).
+- resume : bool, optional
+    - read the existing results file and skip the requests whose metadata already has a successful result
+    - requests without metadata are always sent
+    - if omitted, will default to False
+- flush_every / flush_interval / fsync : optional
+    - results are flushed to the file every flush_every results or flush_interval seconds, whichever comes first
+    - with fsync, every flush is also forced to disk, so a crash of the machine loses no flushed result
 
 The script is structured as follows:
     - Imports
     - Define main()
         - Initialize things
         - In main loop:
-            - Get next request if one is not already waiting for capacity
-            - Update available token & request capacity
-            - If enough capacity available, call API
-            - The loop pauses if a rate limit error is hit
+            - Get the next request: a retry if one is due, else a new one not completed yet, else wait for a retry
+              or the end
+            - Wait for a free in-flight slot, then sleep until the buckets have refilled enough
+            - Call API in a task; throttled requests are put back after their backoff
             - The loop breaks when no tasks remain
     - Define dataclasses
         - StatusTracker (stores script metadata counters; only one instance is created)
         - APIRequest (stores API inputs, outputs, metadata; one method to call API)
+    - Define ResultWriter (the only writer of the results file)
     - Define functions
         - api_endpoint_from_url (extracts API endpoint from request URL)
-        - append_to_jsonl (writes to results file)
+        - metadata_key (identifies a request across runs)
+        - completed_metadata_keys (reads the results of a previous run)
         - num_tokens_consumed_from_request (bigger function to infer token usage from request)
         - task_id_generator_function (yields 1, 2, 3, ...)
     - Run main()
 """
-from typing import List
+from typing import AsyncIterable, Iterable, List, Optional, Set, Union
 
 # imports
 import aiohttp  # for making API calls concurrently
@@ -93,12 +104,16 @@ import aiohttp  # for making API calls concurrently
 import asyncio  # for running API calls concurrently
 import json  # for saving results to a jsonl file
 import logging  # for logging rate limit warnings and other messages
+import os  # for syncing and repairing the results file
 
 import re  # for matching endpoint from request URL
-import tiktoken  # for counting tokens
+from generator.openlimit.utilities import count_tokens  # for counting tokens, memoized
 import time  # for sleeping after rate limit is hit
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
+
+from generator.openlimit import ChatRateLimiter, KeyPool
+from generator.openlimit.rate_limiters import RateLimiter
 from dataclasses import (
     dataclass,
     field,
@@ -106,7 +121,7 @@ from dataclasses import (
 
 
 async def process_api_requests(
-        requests_list: List[str],
+        requests_list: Union[Iterable[str], AsyncIterable[str]],
         save_filepath: str,
         request_url: str,
         api_key: str,
@@ -115,155 +130,165 @@ async def process_api_requests(
         token_encoding_name: str,
         max_attempts: int,
         logging_level: int,
+        rate_limiter: Optional[Union[RateLimiter, KeyPool]] = None,
+        max_in_flight: int = 256,
+        resume: bool = False,
+        flush_every: int = 64,
+        flush_interval: float = 1.0,
+        fsync: bool = False,
 ):
-    """Processes API requests_iter in parallel, throttling to stay under the rate limits."""
-    # constants
-    seconds_to_pause_after_rate_limit_error = 15
-    seconds_to_sleep_each_loop = (
-        0.001  # 1 ms limits max throughput to 1,000 requests_iter per second
-    )
-
+    """Processes API requests_iter in parallel, throttling to stay under the rate limits.
+    The limits are adapted to the x-ratelimit-* headers of the responses. Throttled requests are retried after a
+    jittered exponential backoff or the Retry-After of the server, per api key and model.
+    requests_list: any iterable or async iterator of request json strings, read lazily
+    rate_limiter: share the limits with other users of the api key. By default, one is created from the max_* values.
+        A KeyPool sends every request with the key of most headroom, api_key is then ignored
+    max_in_flight: the maximal number of requests waiting for a response
+    resume: skip the requests whose metadata already has a successful result in save_filepath
+    flush_every, flush_interval, fsync: flush policy of the results file, see ResultWriter
+    """
     # initialize logging
     logging.basicConfig(level=logging_level)
-    logging.debug(f"Logging initialized at level {logging_level}")
+    logging.debug("Logging initialized at level %s", logging_level)
 
     # infer API endpoint and construct request header
     api_endpoint = api_endpoint_from_url(request_url)
-    request_header = {"Authorization": f"Bearer {api_key}", 'Content-Type': 'application/json', }
-    # use api-key header for Azure deployments
-    if '/deployments' in request_url:
-        request_header = {"api-key": f"{api_key}"}
+
+    def request_header_of(key):
+        # use api-key header for Azure deployments
+        if '/deployments' in request_url:
+            return {"api-key": f"{key}"}
+        return {"Authorization": f"Bearer {key}", 'Content-Type': 'application/json', }
 
     # initialize trackers
-    queue_of_requests_to_retry = asyncio.Queue()
+    queue_of_requests_to_retry = asyncio.Queue()  # also receives None once everything is done
+    in_flight = asyncio.Semaphore(max_in_flight)
     task_id_generator = (
         task_id_generator_function()
     )  # generates integer IDs of 1, 2, 3, ...
     status_tracker = (
         StatusTracker()
     )  # single instance to track a collection of variables
-    next_request = None  # variable to hold the next request to call
-
-    # initialize available capacity counts
-    available_request_capacity = max_requests_per_minute
-    available_token_capacity = max_tokens_per_minute
-    last_update_time = time.time()
-
-    # initialize flags
-    work_not_finished = True  # after file is empty, we'll skip reading it
-    logging.debug(f"Initialization complete.")
+    pending_tasks = set()  # keep references, the event loop only holds weak ones
+    completed = completed_metadata_keys(save_filepath) if resume else set()
+    if resume:
+        logging.info("Resuming: %s requests already completed in %s", len(completed), save_filepath)
+    num_skipped = 0
+
+    # initialize available capacity counts, a bucket of one minute starts full
+    if rate_limiter is None:
+        rate_limiter = ChatRateLimiter(max_requests_per_minute, max_tokens_per_minute, bucket_size_in_seconds=60)
+
+    # `requests_iter` will provide requests one at a time, from a plain or an async iterable
+    if isinstance(requests_list, AsyncIterable):
+        requests_iter = requests_list.__aiter__()
+    else:
+        requests_iter = iter(requests_list)
+    source_exhausted = False
 
-    # `requests_iter` will provide requests_iter one at a time
-    requests_iter = requests_list.__iter__()  # a line
-    logging.debug(f"Entering main loop. Counted {len(requests_list)} requests")
-    with tqdm(total=len(requests_list)) as pbar:
+    async def next_from_source() -> Optional[str]:
+        try:
+            if isinstance(requests_list, AsyncIterable):
+                return await requests_iter.__anext__()
+            return next(requests_iter)
+        except (StopIteration, StopAsyncIteration):
+            return None
+
+    def check_finished():
+        if source_exhausted and status_tracker.num_tasks_in_progress == 0:
+            queue_of_requests_to_retry.put_nowait(None)
+
+    async def next_request() -> Optional[APIRequest]:
+        """Retries first, then new requests. None when all requests are done"""
+        nonlocal source_exhausted, num_skipped
+        if not queue_of_requests_to_retry.empty():
+            return queue_of_requests_to_retry.get_nowait()
+        while not source_exhausted:
+            request_str = await next_from_source()
+            if request_str is not None:
+                request_json = json.loads(request_str)
+                meta_data = request_json.pop("metadata", None)
+                if meta_data is not None and metadata_key(meta_data) in completed:
+                    num_skipped += 1
+                    pbar.update(1)
+                    continue
+                status_tracker.num_tasks_started += 1
+                status_tracker.num_tasks_in_progress += 1
+                return APIRequest(
+                    task_id=next(task_id_generator),
+                    request_json=request_json,
+                    token_consumption=num_tokens_consumed_from_request(
+                        request_json, api_endpoint, token_encoding_name
+                    ),
+                    attempts_left=max_attempts,
+                    metadata=meta_data,
+                )  # a simple data class for a request
+            logging.debug("Request list exhausted")
+            source_exhausted = True
+            check_finished()
+        # wait for a retry or for the end
+        return await queue_of_requests_to_retry.get()
+
+    async def wait_for_capacity(request: APIRequest, model) -> str:
+        """Sleep until the server allows a key again and its buckets have refilled enough. Returns the key"""
+        while True:
+            if isinstance(rate_limiter, KeyPool):
+                wait, key = rate_limiter.try_acquire(request.token_consumption, model)
+                if key is not None:
+                    return key
+            else:
+                wait = rate_limiter.backoff.wait_time((api_key, model))
+                if wait == 0:
+                    wait = rate_limiter.try_acquire(request.token_consumption)
+                    if wait == 0:
+                        return api_key
+            await asyncio.sleep(wait)
+
+    total = len(requests_list) if hasattr(requests_list, "__len__") else None
+    logging.debug("Entering main loop. Counted %s requests", total)
+    with tqdm(total=total) as pbar:
         with logging_redirect_tqdm():
-            async with aiohttp.ClientSession() as session:  # Initialize ClientSession here
-                tqdm_last_time = 0
+            async with aiohttp.ClientSession() as session, \
+                    ResultWriter(save_filepath, flush_every, flush_interval, fsync) as result_writer:
+                async def run(_request: APIRequest, _key, _model):
+                    try:
+                        await _request.call_api(
+                            session=session,
+                            request_url=request_url,
+                            request_header=request_header_of(_key),
+                            retry_queue=queue_of_requests_to_retry,
+                            result_writer=result_writer,
+                            status_tracker=status_tracker,
+                            rate_limiter=(rate_limiter.limiters[_key] if isinstance(rate_limiter, KeyPool)
+                                          else rate_limiter),
+                            backoff_key=(_key, _model),
+                        )
+                    finally:
+                        in_flight.release()
+                        if _request.done:
+                            pbar.update(1)
+                        check_finished()
+
                 while True:
-                    # get next request (if one is not already waiting for capacity)
-                    if next_request is None:
-                        if not queue_of_requests_to_retry.empty():  # quests left inside the queue
-                            next_request = queue_of_requests_to_retry.get_nowait()
-                            logging.debug(
-                                f"Retrying request {next_request.task_id}: {next_request}"
-                            )
-                        elif work_not_finished:
-                            try:
-                                # get new request
-                                request_json = json.loads(next(requests_iter))
-                                meta_data = request_json.pop("metadata", None)
-                                next_request = APIRequest(
-                                    task_id=next(task_id_generator),
-                                    request_json=request_json,
-                                    token_consumption=num_tokens_consumed_from_request(
-                                        request_json, api_endpoint, token_encoding_name
-                                    ),
-                                    attempts_left=max_attempts,
-                                    metadata=meta_data,
-                                )  # a simple data class for a request
-                                status_tracker.num_tasks_started += 1
-                                status_tracker.num_tasks_in_progress += 1
-                                logging.debug(
-                                    f"Reading request {next_request.task_id}: {next_request}"
-                                )
-                            except StopIteration:
-                                # if file runs out, set flag to stop reading it
-                                logging.debug("Request list exhausted")
-                                work_not_finished = False
-
-                    # update available capacity
-                    current_time = time.time()
-                    seconds_since_update = current_time - last_update_time
-                    available_request_capacity = min(
-                        available_request_capacity
-                        + max_requests_per_minute * seconds_since_update / 60.0,
-                        max_requests_per_minute,
-                    )
-                    available_token_capacity = min(
-                        available_token_capacity
-                        + max_tokens_per_minute * seconds_since_update / 60.0,
-                        max_tokens_per_minute,
-                    )
-                    last_update_time = current_time
-
-                    # if enough capacity available, call API
-                    if next_request:
-                        next_request_tokens = next_request.token_consumption
-                        if (
-                                available_request_capacity >= 1
-                                and available_token_capacity >= next_request_tokens
-                        ):
-                            # update counters
-                            available_request_capacity -= 1
-                            available_token_capacity -= next_request_tokens
-                            next_request.attempts_left -= 1
-
-                            # call API
-                            asyncio.create_task(
-                                next_request.call_api(
-                                    session=session,
-                                    request_url=request_url,
-                                    request_header=request_header,
-                                    retry_queue=queue_of_requests_to_retry,
-                                    save_filepath=save_filepath,
-                                    status_tracker=status_tracker,
-                                )
-                            )
-                            next_request = None  # reset next_request to empty
-
-                    # if all tasks are finished, break
-                    if status_tracker.num_tasks_in_progress == 0:
+                    request = await next_request()
+                    if request is None:
                         break
-
-                    # main loop sleeps briefly so concurrent tasks can run
-                    await asyncio.sleep(seconds_to_sleep_each_loop)
-
-                    # if a rate limit error was hit recently, pause to cool down
-                    seconds_since_rate_limit_error = (
-                            time.time() - status_tracker.time_of_last_rate_limit_error
-                    )
-                    if (
-                            seconds_since_rate_limit_error
-                            < seconds_to_pause_after_rate_limit_error
-                    ):
-                        remaining_seconds_to_pause = (
-                                seconds_to_pause_after_rate_limit_error
-                                - seconds_since_rate_limit_error
-                        )
-                        await asyncio.sleep(remaining_seconds_to_pause)
-                        # ^e.g., if pause is 15 seconds and final limit was hit 5 seconds ago
-                        logging.warning(
-                            f"Pausing to cool down until {time.ctime(status_tracker.time_of_last_rate_limit_error + seconds_to_pause_after_rate_limit_error)}"
-                        )
-                    pbar_update = status_tracker.num_tasks_started - status_tracker.num_tasks_in_progress - tqdm_last_time
-                    pbar.update(pbar_update)
-                    tqdm_last_time += pbar_update
+                    if logging.getLogger().isEnabledFor(logging.DEBUG):
+                        logging.debug("Dispatching request %s: %s", request.task_id, request)
+                    model = request.request_json.get("model")
+                    await in_flight.acquire()
+                    key = await wait_for_capacity(request, model)
+                    request.attempts_left -= 1
+                    task = asyncio.create_task(run(request, key, model))
+                    pending_tasks.add(task)
+                    task.add_done_callback(pending_tasks.discard)
 
     # after finishing, log final status
     logging.info(
         f"""Parallel processing complete. Results saved to {save_filepath}"""
     )
+    if num_skipped > 0:
+        logging.info(f"{num_skipped} requests skipped, they were completed by a previous run")
     if status_tracker.num_tasks_failed > 0:
         logging.warning(
             f"{status_tracker.num_tasks_failed} / {status_tracker.num_tasks_started} requests_iter failed. Errors logged to {save_filepath}."
@@ -301,6 +326,7 @@ class APIRequest:
     attempts_left: int
     metadata: dict
     result: list = field(default_factory=list)
+    done: bool = False  # saved, successfully or after all attempts
 
     async def call_api(
             self,
@@ -308,24 +334,31 @@ class APIRequest:
             request_url: str,
             request_header: dict,
             retry_queue: asyncio.Queue,
-            save_filepath: str,
+            result_writer: "ResultWriter",
             status_tracker: StatusTracker,
+            rate_limiter: RateLimiter,
+            backoff_key,
     ):
         """Calls the OpenAI API and saves results."""
-        logging.info(f"Starting request #{self.task_id}")
+        logging.info("Starting request #%s", self.task_id)
         error = None
+        retry_after = None
         try:
             async with session.post(
                     url=request_url, headers=request_header, json=self.request_json
             ) as response:
-                response = await response.json()
+                rate_limit_info = rate_limiter.update_from_headers(response.headers)
+                retry_after = rate_limit_info.retry_after
+                status = response.status
+                rate_limiter.health.record(status)
+                response = await response.json(content_type=None)
             if "error" in response:
                 logging.warning(
                     f"Request {self.task_id} failed with error {response['error']}"
                 )
                 status_tracker.num_api_errors += 1
                 error = response
-                if "Rate limit" in response["error"].get("message", ""):
+                if status == 429 or "Rate limit" in response["error"].get("message", ""):
                     status_tracker.time_of_last_rate_limit_error = time.time()
                     status_tracker.num_rate_limit_errors += 1
                     status_tracker.num_api_errors -= (
@@ -337,11 +370,16 @@ class APIRequest:
         ) as e:  # catching naked exceptions is bad practice, but in this case we'll log & save them
             logging.warning(f"Request {self.task_id} failed with Exception {e}")
             status_tracker.num_other_errors += 1
+            rate_limiter.health.record(None)
             error = e
         if error:
             self.result.append(error)
+            rate_limiter.settle(self.token_consumption, 0, 0, tag=backoff_key[1])  # rejected, nothing used
             if self.attempts_left:
-                retry_queue.put_nowait(self)
+                # only this request waits, others keep going unless the server asked the key to wait
+                asyncio.get_running_loop().call_later(
+                    rate_limiter.backoff.failure(backoff_key, retry_after), retry_queue.put_nowait, self
+                )
             else:
                 logging.error(
                     f"Request {self.request_json} failed after all attempts. Saving errors: {self.result}"
@@ -351,19 +389,122 @@ class APIRequest:
                     if self.metadata
                     else [self.request_json, [str(e) for e in self.result]]
                 )
-                append_to_jsonl(data, save_filepath)
+                result_writer.write(data)
+                self.done = True
                 status_tracker.num_tasks_in_progress -= 1
                 status_tracker.num_tasks_failed += 1
         else:
+            rate_limiter.backoff.success(backoff_key)
+            usage = response.get("usage", None)
+            if usage is not None:
+                rate_limiter.settle(self.token_consumption, usage.get("prompt_tokens", 0),
+                                    usage.get("completion_tokens", 0), tag=backoff_key[1])
             data = (
                 [self.request_json, response, self.metadata]
                 if self.metadata
                 else [self.request_json, response]
             )
-            append_to_jsonl(data, save_filepath)
+            result_writer.write(data)
+            self.done = True
             status_tracker.num_tasks_in_progress -= 1
             status_tracker.num_tasks_succeeded += 1
-            logging.debug(f"Request {self.task_id} saved to {save_filepath}")
+            logging.debug("Request %s queued for %s", self.task_id, result_writer.filename)
+
+
+_FLUSH = object()  # queued by the flush timer of ResultWriter
+
+
+class ResultWriter:
+    """The only writer of the results file. Results are queued by the requests and written in batches by one task,
+    so the file is opened once and lines are never interleaved."""
+
+    def __init__(self, filename: str, flush_every: int = 64, flush_interval: float = 1.0, fsync: bool = False):
+        """
+        filename: the jsonl file, appended to
+        flush_every: flush once that many results are written since the last flush
+        flush_interval: seconds a written result may wait for a flush
+        fsync: force every flush to disk
+        """
+        self.filename = filename
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._queue = asyncio.Queue()
+        self._file = None
+        self._task = None
+
+    async def __aenter__(self):
+        self._repair_tail()
+        self._file = open(self.filename, "a")
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._queue.put_nowait(None)
+        try:
+            await self._task
+        finally:
+            self._file.close()
+
+    def write(self, data) -> None:
+        """Queue a json payload, written as one line."""
+        self._queue.put_nowait(json.dumps(data) + "\n")
+
+    def _repair_tail(self):
+        """Cut the partial last line left by a crash, so the next line is not glued to it."""
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            position = size
+            end = 0  # keep everything before end
+            while position > 0:
+                position = max(position - 4096, 0)
+                f.seek(position)
+                idx = f.read(size - position).rfind(b"\n")
+                if idx >= 0:
+                    end = position + idx + 1
+                    break
+            f.truncate(end)
+        logging.warning(f"Removed a partial line at the end of {self.filename}")
+
+    def _flush(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        unflushed = 0
+        timer = None
+        closing = False
+        while not closing:
+            # take everything queued and write it in one go
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            lines = [item for item in batch if isinstance(item, str)]
+            closing = None in batch
+            if _FLUSH in batch:
+                timer = None
+            self._file.write("".join(lines))
+            unflushed += len(lines)
+            if unflushed == 0:
+                continue
+            if closing or _FLUSH in batch or unflushed >= self.flush_every:
+                if timer is not None:
+                    timer.cancel()
+                    timer = None
+                # off the event loop, fsync may take a while
+                await loop.run_in_executor(None, self._flush)
+                unflushed = 0
+            elif timer is None:
+                timer = loop.call_later(self.flush_interval, self._queue.put_nowait, _FLUSH)
 
 
 # functions
@@ -371,18 +512,32 @@ class APIRequest:
 
 def api_endpoint_from_url(request_url):
     """Extract the API endpoint from the request URL."""
-    match = re.search("^https://[^/]+/v\\d+/(.+)$", request_url)
+    match = re.search("^https?://[^/]+/v\\d+/(.+)$", request_url)
     if match is None:
         # for Azure OpenAI deployment urls
         match = re.search(r"^https://[^/]+/openai/deployments/[^/]+/(.+?)(\?|$)", request_url)
     return match[1]
 
 
-def append_to_jsonl(data, filename: str) -> None:
-    """Append a json payload to the end of a jsonl file."""
-    json_string = json.dumps(data)
-    with open(filename, "a") as f:
-        f.write(json_string + "\n")
+def metadata_key(metadata) -> str:
+    """The identity of a request across runs, its metadata in canonical form."""
+    return json.dumps(metadata, sort_keys=True)
+
+
+def completed_metadata_keys(filename: str) -> Set[str]:
+    """Keys of the requests with a successful result in a results file. Failed results are not completed."""
+    completed = set()
+    if not os.path.exists(filename):
+        return completed
+    with open(filename, "r") as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except ValueError:  # torn last line of a crashed run
+                continue
+            if len(data) == 3 and isinstance(data[1], dict) and "error" not in data[1]:
+                completed.add(metadata_key(data[2]))
+    return completed
 
 
 def num_tokens_consumed_from_request(
@@ -391,7 +546,6 @@ def num_tokens_consumed_from_request(
         token_encoding_name: str,
 ):
     """Count the number of tokens in the request. Only supports completion and embedding requests."""
-    encoding = tiktoken.get_encoding(token_encoding_name)
     # if completions request, tokens = prompt + n * max_tokens
     if api_endpoint.endswith("completions"):
         max_tokens = request_json.get("max_tokens", 15)
@@ -404,7 +558,7 @@ def num_tokens_consumed_from_request(
             for message in request_json["messages"]:
                 num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
                 for key, value in message.items():
-                    num_tokens += len(encoding.encode(value))
+                    num_tokens += count_tokens(value, token_encoding_name)
                     if key == "name":  # if there's a name, the role is omitted
                         num_tokens -= 1  # role is always required and always 1 token
             num_tokens += 2  # every reply is primed with <im_start>assistant
@@ -413,11 +567,11 @@ def num_tokens_consumed_from_request(
         else:
             prompt = request_json["prompt"]
             if isinstance(prompt, str):  # single prompt
-                prompt_tokens = len(encoding.encode(prompt))
+                prompt_tokens = count_tokens(prompt, token_encoding_name)
                 num_tokens = prompt_tokens + completion_tokens
                 return num_tokens
             elif isinstance(prompt, list):  # multiple prompts
-                prompt_tokens = sum([len(encoding.encode(p)) for p in prompt])
+                prompt_tokens = sum([count_tokens(p, token_encoding_name) for p in prompt])
                 num_tokens = prompt_tokens + completion_tokens * len(prompt)
                 return num_tokens
             else:
@@ -428,10 +582,10 @@ def num_tokens_consumed_from_request(
     elif api_endpoint == "embeddings":
         input_ = request_json["input"]
         if isinstance(input_, str):  # single input
-            num_tokens = len(encoding.encode(input_))
+            num_tokens = count_tokens(input_, token_encoding_name)
             return num_tokens
         elif isinstance(input_, list):  # multiple inputs
-            num_tokens = sum([len(encoding.encode(i)) for i in input_])
+            num_tokens = sum([count_tokens(i, token_encoding_name) for i in input_])
             return num_tokens
         else:
             raise TypeError(
@@ -1,38 +1,85 @@
 import asyncio
 import json
 import logging
+import threading
 from time import sleep
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 from urllib3.exceptions import SSLError, MaxRetryError
+from urllib3.util.retry import Retry
 
-from generator.openlimit import ChatRateLimiter
+from generator.openlimit import ChatRateLimiter, KeyPool, DeadlineExceeded
+from generator.openlimit.utilities import Backoff, parse_retry_after
 from requests import ReadTimeout
 
 from generator import api_process_parallel
+from generator.response_cache import ResponseCache, get_response_cache, request_key
+from utils.config import http_pool_size, http_max_retries, http_connect_timeout, response_cache_dir, \
+    response_cache_max_mb, response_cache_mode, result_flush_every, result_flush_interval, result_fsync
+
+_sessions_lock = threading.Lock()
+_sessions: Dict[Tuple, requests.Session] = dict({})
+
+
+def get_session(pool_size=http_pool_size, max_retries=http_max_retries) -> requests.Session:
+    """
+    The keep-alive session of the process for the given settings, shared by all generators and threads, so each
+    connection pays the TCP and TLS handshakes once.
+    :param pool_size: connections kept alive per host
+    :param max_retries: retries of requests that failed to connect. Requests that reached the server are not
+    retried here, OpenGenerator.generate handles their status codes
+    """
+    key = (pool_size, max_retries)
+    with _sessions_lock:
+        if key not in _sessions:
+            retry = Retry(total=max_retries, connect=max_retries, read=0, status=0, redirect=0,
+                          allowed_methods=None, backoff_factor=0.5, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
 
 
 class OpenGenerator:
     def __init__(self, key,
                  request_url,
                  model='gpt-3.5-turbo-1106',
-                 monitor: Optional[ChatRateLimiter] = None):
+                 monitor: Optional[Union[ChatRateLimiter, KeyPool]] = None,
+                 tag=None,
+                 priority=None,
+                 session: Optional[requests.Session] = None,
+                 cache: Optional[ResponseCache] = None):
         """
-        monitor: monitor the token usage in multi-thread use
+        key: the api key. Of a list, only the first key is used unless the monitor is a KeyPool
+        monitor: monitor the token usage in multi-thread use. A KeyPool also picks the api key of every request
+        tag: the default entry of the monitor's usage ledger for the requests of this generator, e.g. the method
+        priority: the default priority class of the requests of this generator, e.g. PRIORITY_REPAIR
+        session: the http session. By default, the keep-alive session shared in the process, see get_session
+        cache: the response cache of generate. By default, the one configured by response_cache_* in config.ini
         """
-        self.key = key
-        self.headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {key}',
-            'Connection': 'close'
-        }
+        self.key = key[0] if isinstance(key, (list, tuple)) else key
+        self.headers = self._headers(self.key)
+        self.session = session if session is not None else get_session()
         self.request_url = request_url
         self.model = model
         self.monitor = monitor
+        # share the backoff state of the key with all users of the monitor
+        self.backoff = monitor.backoff if monitor is not None else Backoff()
+        self.backoff_key = (self.key, model)
+        # a pool routes around blocked keys, a request only waits when all keys are blocked
+        self.pooled = isinstance(monitor, KeyPool)
+        self.tag = tag
+        self.priority = priority
+        if cache is None:
+            cache = get_response_cache(response_cache_dir, response_cache_max_mb * (1 << 20), response_cache_mode)
+        self.cache = cache
 
     def generate_async(self, prompts, metas, save_filepath, temperature=0.2, gen_count=1, top_p=1, max_tokens=4096,
-                       history: Optional[List[List]] = None):
+                       history: Optional[List[List]] = None, resume=False):
         """
         Generate in async way calling OpenAI Codebook (modified version). Only support gpt-3.5-turbo
         :param save_filepath: file for saving the LLM's response
@@ -43,6 +90,7 @@ class OpenGenerator:
         :param temperature: float, the temperature
         :param gen_count: the num of samples
         :param history: List of lists. Each sublist is a history. If len == 1, all history will be prepended to prompts
+        :param resume: keep the results already in save_filepath and only send the prompts whose meta has none
         :return: None
         """
         assert len(prompts) == len(metas)
@@ -88,15 +136,27 @@ class OpenGenerator:
                                                       max_tokens_per_minute=160000 * 0.9,
                                                       token_encoding_name='cl100k_base',
                                                       max_attempts=5,
-                                                      logging_level=logging.INFO)
+                                                      logging_level=logging.INFO,
+                                                      rate_limiter=self.monitor,
+                                                      resume=resume,
+                                                      flush_every=result_flush_every,
+                                                      flush_interval=result_flush_interval,
+                                                      fsync=result_fsync)
         )
 
     def generate(self, prompt, system: Optional[str] = None, temperature=0.2, gen_count=1, top_p=1.0, history=None,
-                 timeout=600):
+                 timeout=600, tag=None, sample_index=0, priority=None, deadline=None):
         """
         Generate given prompt following the temperature and gen_count set
         :param top_p:
         :param timeout:
+        :param tag: the entry of the monitor's usage ledger. By default, the tag of the generator
+        :param sample_index: the number of the same request sent before, e.g. the trial number of a retry loop.
+        Part of the cache key, so a retry is not answered with the response it retries
+        :param priority: the priority class of the request for the monitor. By default, the one of the generator
+        :param deadline: seconds the request may wait for the monitor. If exceeded, the status is "deadline"
+        The status is "timeout" if the response is not read in timeout seconds and "network_error" if the server
+        can not be reached in 5 trials
         :param gen_count:
         :param temperature:
         :param prompt: a string, the user information
@@ -122,37 +182,86 @@ class OpenGenerator:
                 "temperature": temperature,
                 "n": gen_count,
                 "top_p": top_p}
-        data = json.dumps(data)
+        priority = priority if priority is not None else self.priority
+        if self.cache is None:
+            return self._post(json.dumps(data), timeout, tag, priority, deadline)
+        key = request_key(self.model, messages, temperature, top_p, gen_count, sample_index)
+        return self.cache.fetch(key, lambda: self._post(json.dumps(data), timeout, tag, priority, deadline),
+                                request=data)
+
+    @staticmethod
+    def _headers(key):
+        return {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {key}'
+        }
 
+    def _post(self, data: str, timeout, tag, priority=None, deadline=None):
+        """
+        Send a chat request, retrying on throttling and network errors
+        """
         try:
             trial_cnt = 0
             while trial_cnt < 5:
+                reservation = None
+                key, limiter, backoff_key = self.key, self.monitor, self.backoff_key
                 try:
+                    if not self.pooled:
+                        sleep(self.backoff.wait_time(backoff_key))
                     if self.monitor is not None:
-                        with self.monitor.limit(data):
-                            response = requests.post(self.request_url,
+                        with self.monitor.limit(data, tag=tag if tag is not None else self.tag, priority=priority,
+                                                deadline=deadline) as reservation:
+                            if reservation.key is not None:
+                                key, limiter = reservation.key, reservation.rate_limiter
+                                backoff_key = (key, self.model)
+                            response = self.session.post(self.request_url,
+                                                         headers=self._headers(key),
+                                                         data=data,
+                                                         timeout=(http_connect_timeout, timeout))
+                    else:
+                        response = self.session.post(self.request_url,
                                                      headers=self.headers,
                                                      data=data,
-                                                     timeout=timeout)
-                    else:
-                        response = requests.post(self.request_url,
-                                                 headers=self.headers,
-                                                 data=data,
-                                                 timeout=timeout)
+                                                     timeout=(http_connect_timeout, timeout))
 
+                    if limiter is not None:
+                        limiter.update_from_headers(response.headers)
+                        limiter.health.record(response.status_code)
                     if response.status_code == 200:
-                        outputs = [choice['message']['content'] for choice in response.json()['choices']]
-                        token_count = {"prompt_tokens": response.json()['usage']['prompt_tokens'],
-                                       "completion_tokens": response.json()['usage']['completion_tokens']}
+                        self.backoff.success(backoff_key)
+                        body = response.json()
+                        outputs = [choice['message']['content'] for choice in body['choices']]
+                        token_count = {"prompt_tokens": body['usage']['prompt_tokens'],
+                                       "completion_tokens": body['usage']['completion_tokens']}
+                        if reservation is not None:
+                            reservation.settle(token_count['prompt_tokens'], token_count['completion_tokens'])
                         return response.status_code, outputs, token_count
                     else:
-                        logging.warning(f"Network error happen: status code {response.status_code}. Sleep 10s to rest")
+                        if reservation is not None:
+                            reservation.settle()  # rejected, nothing used
+                        retry_after = parse_retry_after(response.headers)
+                        delay = self.backoff.failure(backoff_key, retry_after)
+                        logging.warning(f"Network error happen: status code {response.status_code}. "
+                                        f"Sleep {delay:.1f}s to rest")
                         logging.warning(f"The message is {response.content}")
-                        sleep(10)
-                except (SSLError, MaxRetryError) as e:
-                    logging.warning(f"Network {e} happened. Sleep 10s to rest")
+                        # the key is blocked for retry_after, a pool sends the retry with another key meanwhile
+                        if not (self.pooled and retry_after is not None):
+                            sleep(delay)
+                except ReadTimeout:
+                    if reservation is not None:
+                        reservation.settle()  # the usage of an abandoned request is unknown
+                    return "timeout", None, None
+                except (SSLError, MaxRetryError, requests.exceptions.ConnectionError) as e:
+                    if reservation is not None:
+                        reservation.settle()
+                    if limiter is not None:
+                        limiter.health.record(None)
+                    delay = self.backoff.failure(backoff_key)
+                    logging.warning(f"Network {e} happened. Sleep {delay:.1f}s to rest")
                     trial_cnt += 1
-                    sleep(10)
-            return response.status_code, None, None
-        except ReadTimeout:
-            return "timeout", None, None
+                    sleep(delay)
+            # every trial failed to reach the server
+            return "network_error", None, None
+        except DeadlineExceeded as e:
+            logging.warning(f"{e}")
+            return "deadline", None, None
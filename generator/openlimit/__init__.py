@@ -1 +1,3 @@
 from generator.openlimit.rate_limiters import ChatRateLimiter, CompletionRateLimiter, EmbeddingRateLimiter
+from generator.openlimit.key_pool import KeyPool
+from generator.openlimit.utilities.admission import DeadlineExceeded, PRIORITY_REPAIR, PRIORITY_SLICE, PRIORITY_GENERATION, PRIORITY_DEFAULT
@@ -1,5 +1,4 @@
 # Standard library
-import asyncio
 import time
 import typing
 
@@ -9,33 +8,79 @@ import typing
 
 
 class Bucket(object):
+    """
+    Token bucket. Not thread-safe on its own, Buckets serializes the access.
+    """
+
     def __init__(self, rate_limit, bucket_size_in_seconds: float = 1):
         # Per-second rate limit
         self._rate_per_sec = rate_limit / 60
 
-        # Capacity of the bucket
-        self._capacity = rate_limit / 60 * bucket_size_in_seconds
+        # Maximum capacity of the bucket
+        self._max_capacity = rate_limit / 60 * bucket_size_in_seconds
+
+        # Capacity of the bucket. Negative after an amount larger than the maximum was taken
+        self._capacity = self._max_capacity
 
         # The integration time of the bucket
         self._bucket_size_in_seconds = bucket_size_in_seconds
 
         # Last time the bucket capacity was checked
-        self._last_checked = time.time()
+        self._last_checked = time.monotonic()
 
     def get_capacity(self, current_time: typing.Optional[float] = None):
 
         if current_time is None:
-            current_time = time.time()
+            current_time = time.monotonic()
 
         time_passed = current_time - self._last_checked
 
         new_capacity = min(
-            self._rate_per_sec * self._bucket_size_in_seconds,
+            self._max_capacity,
             self._capacity + time_passed * self._rate_per_sec,
         )
 
         return new_capacity
 
+    def time_until(self, amount: float, capacity: float):
+        """
+        Seconds until the bucket refills from capacity to amount. An amount larger than the bucket can hold is
+        granted once the bucket is full.
+        """
+        missing = min(amount, self._max_capacity) - capacity
+        if missing <= 0:
+            return 0.0
+        return missing / self._rate_per_sec
+
+    def observe(
+        self,
+        current_time: float,
+        limit: typing.Optional[float] = None,
+        remaining: typing.Optional[float] = None,
+        reset: typing.Optional[float] = None,
+        headroom: float = 1.0,
+        window: float = 60,
+    ):
+        """
+        Align the bucket with the state reported by the server, whose limits are shared with other clients.
+        :param limit: the limit per window of the server. The bucket is resized to limit * headroom
+        :param remaining: what is left of the limit in the current window
+        :param reset: seconds until the server refills completely
+        """
+        capacity = self.get_capacity(current_time=current_time)
+        if limit is not None and limit > 0:
+            rate_per_sec = limit * headroom / window
+            if abs(rate_per_sec - self._rate_per_sec) > 1e-9:
+                self._rate_per_sec = rate_per_sec
+                self._max_capacity = rate_per_sec * self._bucket_size_in_seconds
+                capacity = min(capacity, self._max_capacity)
+            # the server may be fuller or emptier than the bucket, only trust it when it is emptier
+            if remaining is not None:
+                capacity = min(capacity, self._max_capacity * remaining / limit)
+        if reset is not None:
+            capacity = min(capacity, self._max_capacity * max(0.0, 1 - reset / window))
+        self._set_capacity(capacity, current_time=current_time)
+
     def _set_capacity(
         self, new_capacity: float, current_time: typing.Optional[float] = None
     ):
@@ -1,5 +1,6 @@
 # Standard library
 import asyncio
+import threading
 import time
 from typing import Optional
 
@@ -11,9 +12,16 @@ from generator.openlimit.buckets.bucket import Bucket
 
 
 class Buckets(object):
+    """
+    Several buckets drained together, e.g. one for requests and one for tokens. Safe to share between threads and
+    event loops: capacities are only read and updated under a lock, and waiters sleep until the time their amounts
+    are refilled instead of polling.
+    """
+
     def __init__(self, buckets: list[Bucket]) -> None:
         self.buckets = buckets
         self.verbose = False
+        self._lock = threading.Lock()
 
     def _get_capacities(
         self,
@@ -21,7 +29,7 @@ class Buckets(object):
     ):
 
         if current_time is None:
-            current_time = time.time()
+            current_time = time.monotonic()
 
         new_capacities = [
             bucket.get_capacity(current_time=current_time) for bucket in self.buckets
@@ -36,7 +44,7 @@ class Buckets(object):
     ):
 
         if current_time is None:
-            current_time = time.time()
+            current_time = time.monotonic()
 
         for new_capacity, bucket in zip(new_capacities, self.buckets):
 
@@ -45,47 +53,77 @@ class Buckets(object):
                 current_time=current_time,
             )
 
-    def _has_capacity(self, amounts: list[float]):
-
-        # Create the current time
-        current_time = time.time()
-
-        # Get the new capacities
-        new_capacities = self._get_capacities(current_time=current_time)
-
-        # Determine if we have sufficient capacity
-        has_capacity = min(
-            [
-                amount <= new_capacity
-                for amount, new_capacity in zip(amounts, new_capacities)
-            ]
-        )
+    def _try_acquire(self, amounts: list[float]) -> float:
+        """
+        Take the amounts if all buckets have them.
+        :return: 0 if taken, otherwise the seconds until all buckets will have refilled enough
+        """
+        with self._lock:
+            current_time = time.monotonic()
+            new_capacities = self._get_capacities(current_time=current_time)
+            wait = max(
+                bucket.time_until(amount, new_capacity)
+                for bucket, amount, new_capacity in zip(self.buckets, amounts, new_capacities)
+            )
+            if wait > 0:
+                if self.verbose:
+                    print(f"Capacity Not Enough: amount are {amounts}, remain_capacity are {new_capacities}")
+                return wait
 
-        # If there is enough capacity, remove the amount
-        if has_capacity:
-            new_capacities = [
-                new_capacity - amount
-                for new_capacity, amount in zip(new_capacities, amounts)
-            ]
-        else:
-            if self.verbose:
-                print(f"Capacity Not Enough: amount are {amounts}, remain_capacity are {new_capacities}")
+            self._set_capacities(
+                [new_capacity - amount for new_capacity, amount in zip(new_capacities, amounts)],
+                current_time=current_time,
+            )
+            return 0.0
+
+    def refund(self, amounts: list[float]):
+        """
+        Put amounts back, e.g. reserved but unused. Negative amounts take more
+        """
+        with self._lock:
+            current_time = time.monotonic()
+            self._set_capacities(
+                [
+                    min(bucket._max_capacity, new_capacity + amount)
+                    for bucket, new_capacity, amount in zip(
+                        self.buckets, self._get_capacities(current_time=current_time), amounts
+                    )
+                ],
+                current_time=current_time,
+            )
 
-        # Set the new capacities
-        self._set_capacities(new_capacities, current_time=current_time)
+    def observe(self, observations: list[dict], headroom: float = 1.0):
+        """
+        :param observations: per bucket, the keyword arguments of Bucket.observe
+        """
+        with self._lock:
+            current_time = time.monotonic()
+            for bucket, observation in zip(self.buckets, observations):
+                bucket.observe(current_time, headroom=headroom, **observation)
+
+    def free_share(self) -> float:
+        """
+        The smallest ratio of capacity to maximal capacity over the buckets, negative while in debt
+        """
+        with self._lock:
+            current_time = time.monotonic()
+            return min(
+                new_capacity / bucket._max_capacity if bucket._max_capacity > 0 else 0.0
+                for bucket, new_capacity in zip(self.buckets, self._get_capacities(current_time=current_time))
+            )
 
-        return has_capacity
+    def _has_capacity(self, amounts: list[float]):
+        return self._try_acquire(amounts) == 0
 
     def wait_for_capacity_sync(
-        self, amounts: list[float], sleep_interval: float = 1e-1
+        self, amounts: list[float], sleep_interval: Optional[float] = None
     ):
-
-        while not self._has_capacity(amounts):
-            time.sleep(sleep_interval)
+        # sleep_interval is kept for compatibility, the wait is computed from the refill rate
+        while (wait := self._try_acquire(amounts)) > 0:
+            time.sleep(wait)
 
     async def wait_for_capacity(
-        self, amounts: list[float], sleep_interval: float = 1e-1
+        self, amounts: list[float], sleep_interval: Optional[float] = None
     ):
-
-        while not self._has_capacity(amounts):
-            await asyncio.sleep(sleep_interval)
+        while (wait := self._try_acquire(amounts)) > 0:
+            await asyncio.sleep(wait)
@@ -0,0 +1,138 @@
+# Standard library
+import asyncio
+import itertools
+import json
+import typing
+
+# Local
+import generator.openlimit.utilities as utils
+from generator.openlimit.rate_limiters import ChatRateLimiter
+
+######
+# MAIN
+######
+
+
+class KeyPool(object):
+    """
+    Several api keys of the same provider, each with its own rate limit buckets and health. Every request goes to
+    the key in rotation with the most headroom, i.e. the largest free share of its fullest bucket. Keys blocked by a
+    Retry-After of the server or cooling down after failures are skipped. The keys share one backoff and one usage
+    ledger, so a KeyPool is used like a ChatRateLimiter.
+    """
+
+    def __init__(
+        self,
+        keys,
+        request_limit=3500,
+        token_limit=90000,
+        bucket_size_in_seconds: float = 1,
+        approximate_tokens=False,
+        priority_weights=None,
+    ):
+        """
+        :param keys: an api key or a list of them
+        :param request_limit: requests per minute of each key
+        :param token_limit: tokens per minute of each key
+        :param priority_weights: see PriorityGate
+        """
+        keys = [keys] if isinstance(keys, str) else list(dict.fromkeys(keys))
+        if len(keys) == 0:
+            raise ValueError("KeyPool needs at least one api key")
+        self.keys = keys
+        self.backoff = utils.Backoff()
+        self.ledger = utils.UsageLedger()
+        self.gate = utils.PriorityGate(priority_weights)
+        self.limiters: typing.Dict[str, ChatRateLimiter] = dict({})
+        for key in keys:
+            limiter = ChatRateLimiter(request_limit, token_limit, bucket_size_in_seconds, approximate_tokens)
+            limiter.backoff = self.backoff
+            limiter.ledger = self.ledger
+            self.limiters[key] = limiter
+        self.token_counter = self.limiters[keys[0]].token_counter
+        # spreads ties, e.g. all keys full at start, over the keys
+        self._rotation = itertools.count()
+
+    def _unavailable_for(self, key, model) -> float:
+        return max(self.limiters[key].health.wait_time(), self.backoff.wait_time((key, model)))
+
+    def try_acquire(self, num_tokens, model=None) -> typing.Tuple[float, typing.Optional[str]]:
+        """
+        Take the capacity for one request from the best key without waiting
+        :param model: the model of the request, the server may block a key for one model only
+        :return: (0, key) if taken, otherwise (the seconds until a key may have the capacity, None)
+        """
+        start = next(self._rotation) % len(self.keys)
+        rotated = self.keys[start:] + self.keys[:start]
+        waits = list([])
+        candidates = list([])
+        for key in rotated:
+            wait = self._unavailable_for(key, model)
+            if wait > 0:
+                waits.append(wait)
+            else:
+                candidates.append(key)
+        # sort is stable, keys with the same headroom keep the rotated order
+        candidates.sort(key=lambda candidate: self.limiters[candidate].free_share(), reverse=True)
+        for key in candidates:
+            wait = self.limiters[key].try_acquire(num_tokens)
+            if wait == 0:
+                return 0.0, key
+            waits.append(wait)
+        return min(waits), None
+
+    def wait_for_capacity_sync(self, num_tokens, model=None, priority=None, deadline=None) -> str:
+        """
+        Wait for the turn of the request among the waiting ones, then for a key with the capacity
+        :raise DeadlineExceeded: not admitted within deadline seconds
+        """
+        return self.gate.wait_sync(lambda: self.try_acquire(num_tokens, model), priority, num_tokens, deadline)
+
+    async def wait_for_capacity(self, num_tokens, model=None) -> str:
+        while True:
+            wait, key = self.try_acquire(num_tokens, model)
+            if key is not None:
+                return key
+            await asyncio.sleep(wait)
+
+    def limit(self, json_data: str, tag=None, priority=None, deadline=None):
+        """
+        with pool.limit(data, tag=method, priority=PRIORITY_REPAIR) as reservation:
+            response = post(data, key=reservation.key)
+        reservation.rate_limiter.update_from_headers(response.headers)
+        reservation.settle(usage["prompt_tokens"], usage["completion_tokens"])
+        """
+        json_data = json.loads(json_data)
+        num_tokens = self.token_counter(**json_data)
+        return PoolContextManager(num_tokens, self, tag, json_data.get("model"), priority, deadline)
+
+
+class PoolContextManager(object):
+    """
+    Context manager of a KeyPool. Entering it picks a key and returns the Reservation taken from that key
+    """
+
+    def __init__(self, num_tokens, pool: KeyPool, tag=None, model=None, priority=None, deadline=None):
+        self.num_tokens = num_tokens
+        self.pool = pool
+        self.tag = tag
+        self.model = model
+        self.priority = priority
+        self.deadline = deadline
+        self.reservation = None
+
+    def __enter__(self):
+        key = self.pool.wait_for_capacity_sync(self.num_tokens, self.model, self.priority, self.deadline)
+        self.reservation = utils.Reservation(self.num_tokens, self.pool.limiters[key], self.tag, key=key)
+        return self.reservation
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        key = await self.pool.wait_for_capacity(self.num_tokens, self.model)
+        self.reservation = utils.Reservation(self.num_tokens, self.pool.limiters[key], self.tag, key=key)
+        return self.reservation
+
+    async def __aexit__(self, *exc):
+        return False
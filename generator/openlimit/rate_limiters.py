@@ -1,5 +1,6 @@
 # Standard library
 import asyncio
+import functools
 import json
 
 # Local
@@ -18,6 +19,8 @@ class RateLimiter(object):
         token_limit,
         token_counter,
         bucket_size_in_seconds: float = 1,
+        headroom: float = 0.95,
+        priority_weights=None,
     ):
         # Rate limits
         self.request_limit = request_limit
@@ -30,6 +33,21 @@ class RateLimiter(object):
         # Bucket size in seconds
         self._bucket_size_in_seconds = bucket_size_in_seconds
 
+        # Share of the limits reported by the server that is used
+        self.headroom = headroom
+
+        # Backoff after throttled or failed requests, per (api key, model)
+        self.backoff = utils.Backoff()
+
+        # Reserved and used tokens, per tag
+        self.ledger = utils.UsageLedger()
+
+        # Health of the api key, recorded by the callers
+        self.health = utils.KeyHealth()
+
+        # Admission order of the synchronous callers by priority class and deadline
+        self.gate = utils.PriorityGate(priority_weights)
+
         # Buckets
         self._buckets = Buckets(
             buckets=[
@@ -43,15 +61,57 @@ class RateLimiter(object):
             amounts=[1, num_tokens], sleep_interval=self.sleep_interval
         )
 
-    def wait_for_capacity_sync(self, num_tokens):
-        self._buckets.wait_for_capacity_sync(
-            amounts=[1, num_tokens], sleep_interval=self.sleep_interval
+    def wait_for_capacity_sync(self, num_tokens, priority=None, deadline=None):
+        """
+        Wait for the turn of the request among the waiting ones, then for the capacity
+        :raise DeadlineExceeded: not admitted within deadline seconds
+        """
+        self.gate.wait_sync(lambda: (self.try_acquire(num_tokens), None), priority, num_tokens, deadline)
+
+    def try_acquire(self, num_tokens) -> float:
+        """
+        Take the capacity for one request of num_tokens without waiting
+        :return: 0 if taken, otherwise the seconds until it will be available
+        """
+        return self._buckets._try_acquire([1, num_tokens])
+
+    def free_share(self) -> float:
+        """
+        The free share of the fullest bucket, 1 when nothing is used
+        """
+        return self._buckets.free_share()
+
+    def update_from_headers(self, headers):
+        """
+        Resize and refill the buckets according to the x-ratelimit-* headers of a response
+        :return: the parsed RateLimitInfo
+        """
+        info = utils.parse_rate_limit_headers(headers)
+        self._buckets.observe(
+            [
+                dict(limit=info.limit_requests, remaining=info.remaining_requests, reset=info.reset_requests),
+                dict(limit=info.limit_tokens, remaining=info.remaining_tokens, reset=info.reset_tokens),
+            ],
+            headroom=self.headroom,
         )
-
-    def limit(self, json_data: str):
+        return info
+
+    def settle(self, reserved_tokens, prompt_tokens, completion_tokens, tag=None):
+        """
+        Return the reserved but unused tokens of a request to the token bucket and record the usage under tag
+        """
+        self._buckets.refund([0, reserved_tokens - prompt_tokens - completion_tokens])
+        self.ledger.record(tag, reserved_tokens, prompt_tokens, completion_tokens)
+
+    def limit(self, json_data: str, tag=None, priority=None, deadline=None):
+        """
+        with limiter.limit(data, tag=method, priority=PRIORITY_REPAIR) as reservation:
+            response = post(data)
+        reservation.settle(usage["prompt_tokens"], usage["completion_tokens"])
+        """
         json_data = json.loads(json_data)
         num_tokens = self.token_counter(**json_data)
-        return utils.ContextManager(num_tokens, self)
+        return utils.ContextManager(num_tokens, self, tag, priority, deadline)
 
     def is_limited(self):
         return utils.FunctionDecorator(self)
@@ -64,12 +124,16 @@ class RateLimiter(object):
 
 class ChatRateLimiter(RateLimiter):
     def __init__(
-        self, request_limit=3500, token_limit=90000, bucket_size_in_seconds: float = 1
+        self, request_limit=3500, token_limit=90000, bucket_size_in_seconds: float = 1, approximate_tokens=False
     ):
+        # Approximate counts skip tokenizing for admission, the reservation is settled with the actual usage anyway
+        token_counter = utils.num_tokens_consumed_by_chat_request
+        if approximate_tokens:
+            token_counter = functools.partial(token_counter, approximate=True)
         super(ChatRateLimiter, self).__init__(
             request_limit=request_limit,
             token_limit=token_limit,
-            token_counter=utils.num_tokens_consumed_by_chat_request,
+            token_counter=token_counter,
             bucket_size_in_seconds=bucket_size_in_seconds,
         )
 
@@ -1,2 +1,8 @@
-from generator.openlimit.utilities.context_decorators import FunctionDecorator, ContextManager
+from generator.openlimit.utilities.admission import PriorityGate, DeadlineExceeded, DEFAULT_WEIGHTS, PRIORITY_REPAIR, PRIORITY_SLICE, PRIORITY_GENERATION, PRIORITY_DEFAULT
+from generator.openlimit.utilities.backoff import Backoff
+from generator.openlimit.utilities.context_decorators import FunctionDecorator, ContextManager, Reservation
+from generator.openlimit.utilities.health import KeyHealth
+from generator.openlimit.utilities.ledger import UsageLedger
+from generator.openlimit.utilities.rate_limit_headers import RateLimitInfo, parse_rate_limit_headers, parse_retry_after
 from generator.openlimit.utilities.token_counters import num_tokens_consumed_by_chat_request, num_tokens_consumed_by_completion_request, num_tokens_consumed_by_embedding_request
+from generator.openlimit.utilities.token_counters import get_encoder, encoder_for_model, count_tokens, approximate_tokens, TokenCountMemo
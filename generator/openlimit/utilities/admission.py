@@ -0,0 +1,145 @@
+# Standard library
+import itertools
+import threading
+import time
+import typing
+
+# Priority classes of the requests
+PRIORITY_REPAIR = "repair"  # repair of a failing test, few tokens and often decisive
+PRIORITY_SLICE = "slice"
+PRIORITY_GENERATION = "generation"  # bulk generation of the initial tests
+PRIORITY_DEFAULT = "default"
+
+# Share of the capacity each class gets while all of them are waiting
+DEFAULT_WEIGHTS = {PRIORITY_REPAIR: 4, PRIORITY_SLICE: 2, PRIORITY_GENERATION: 1, PRIORITY_DEFAULT: 1}
+
+######
+# MAIN
+######
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    The request was not admitted before its deadline
+    """
+    pass
+
+
+class _Ticket(object):
+    def __init__(self, priority, start_tag, seq, deadline, enqueued):
+        self.priority = priority
+        self.start_tag = start_tag
+        self.seq = seq
+        self.deadline = deadline
+        self.enqueued = enqueued
+
+
+class PriorityGate(object):
+    """
+    Orders the requests waiting for the capacity of a rate limiter. Classes share the capacity in proportion to
+    their weights (start-time fair queueing over the tokens of the requests), so bulk generation cannot starve
+    repairs and a class with a small weight still moves. A request whose deadline is within `urgency` seconds goes
+    first, the earliest deadline first; a request not admitted by its deadline raises DeadlineExceeded.
+    Only the head request waits for the buckets, the others wait behind it. Thread-safe.
+    """
+
+    def __init__(self, weights: typing.Optional[typing.Dict[str, float]] = None, urgency: float = 5):
+        """
+        :param weights: weight of every priority class. Unknown classes get the weight of PRIORITY_DEFAULT
+        :param urgency: seconds before its deadline from which a request is served first
+        """
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self.urgency = urgency
+        self._cond = threading.Condition()
+        self._waiting: typing.List[_Ticket] = list([])
+        self._virtual_time = 0.0
+        self._last_finish: typing.Dict[str, float] = dict({})
+        self._seq = itertools.count()
+        self._stats: typing.Dict[str, typing.Dict[str, float]] = dict({})
+
+    def _stat(self, priority):
+        if priority not in self._stats:
+            self._stats[priority] = {"admitted": 0, "expired": 0, "total_wait": 0.0, "max_wait": 0.0}
+        return self._stats[priority]
+
+    def _enqueue(self, priority, cost, deadline) -> _Ticket:
+        weight = self.weights.get(priority, self.weights.get(PRIORITY_DEFAULT, 1))
+        start_tag = max(self._virtual_time, self._last_finish.get(priority, 0.0))
+        self._last_finish[priority] = start_tag + max(cost, 1) / weight
+        now = time.monotonic()
+        ticket = _Ticket(priority, start_tag, next(self._seq), None if deadline is None else now + deadline, now)
+        self._waiting.append(ticket)
+        return ticket
+
+    def _head(self, now) -> _Ticket:
+        def order(ticket):
+            if ticket.deadline is not None and ticket.deadline - now <= self.urgency:
+                return 0, ticket.deadline, ticket.seq
+            return 1, ticket.start_tag, ticket.seq
+
+        return min(self._waiting, key=order)
+
+    def _leave(self, ticket, now, admitted):
+        self._waiting.remove(ticket)
+        stat = self._stat(ticket.priority)
+        if admitted:
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            waited = now - ticket.enqueued
+            stat["admitted"] += 1
+            stat["total_wait"] += waited
+            stat["max_wait"] = max(stat["max_wait"], waited)
+        else:
+            stat["expired"] += 1
+        self._cond.notify_all()
+
+    def wait_sync(self, try_acquire: typing.Callable[[], typing.Tuple[float, typing.Any]], priority=None, cost=1,
+                  deadline: typing.Optional[float] = None):
+        """
+        Wait for the turn of the request, then for the capacity.
+        :param try_acquire: takes the capacity, returns (0, result) if taken, otherwise (seconds to wait, None)
+        :param priority: the class of the request, PRIORITY_DEFAULT if None
+        :param cost: the tokens of the request
+        :param deadline: seconds the request may wait
+        :return: the result of try_acquire
+        :raise DeadlineExceeded: not admitted in time
+        """
+        priority = PRIORITY_DEFAULT if priority is None else priority
+        with self._cond:
+            ticket = self._enqueue(priority, cost, deadline)
+            while True:
+                now = time.monotonic()
+                if ticket.deadline is not None and now >= ticket.deadline:
+                    self._leave(ticket, now, admitted=False)
+                    raise DeadlineExceeded(f"Request of class {priority} not admitted in {deadline}s")
+                timeout = None if ticket.deadline is None else ticket.deadline - now
+                if self._head(now) is ticket:
+                    wait, result = try_acquire()
+                    if wait == 0:
+                        self._leave(ticket, now, admitted=True)
+                        return result
+                    timeout = wait if timeout is None else min(wait, timeout)
+                elif timeout is None and any(waiting.deadline is not None for waiting in self._waiting):
+                    # wake up when another request becomes urgent and may move ahead of the head
+                    timeout = self.urgency
+                self._cond.wait(timeout)
+
+    def metrics(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """
+        Per class: requests waiting now and the longest current wait, admitted and expired requests, and the mean
+        and maximal wait of the admitted ones in seconds
+        """
+        with self._cond:
+            now = time.monotonic()
+            metrics = dict({})
+            for priority in set(self._stats) | set(ticket.priority for ticket in self._waiting):
+                stat = self._stat(priority)
+                waiting = [now - ticket.enqueued for ticket in self._waiting if ticket.priority == priority]
+                metrics[priority] = {
+                    "waiting": len(waiting),
+                    "oldest_wait": max(waiting, default=0.0),
+                    "admitted": stat["admitted"],
+                    "expired": stat["expired"],
+                    "mean_wait": stat["total_wait"] / stat["admitted"] if stat["admitted"] > 0 else 0.0,
+                    "max_wait": stat["max_wait"],
+                }
+            return metrics
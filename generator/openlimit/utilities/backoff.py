@@ -0,0 +1,56 @@
+# Standard library
+import random
+import threading
+import time
+import typing
+
+######
+# MAIN
+######
+
+
+class Backoff(object):
+    """
+    Jittered exponential backoff, tracked separately for every key, e.g. (api key, model). Thread-safe.
+    A delay requested by the server through Retry-After holds back every request of the key until it passed,
+    other keys are not affected.
+    """
+
+    def __init__(self, base: float = 1, cap: float = 60):
+        """
+        :param base: the delay in seconds after the first failure, before jitter
+        :param cap: the maximal delay in seconds, before jitter
+        """
+        self.base = base
+        self.cap = cap
+        self._attempts: typing.Dict[typing.Hashable, int] = dict({})
+        self._blocked_until: typing.Dict[typing.Hashable, float] = dict({})
+        self._lock = threading.Lock()
+
+    def failure(self, key, retry_after: typing.Optional[float] = None) -> float:
+        """
+        Record a throttled or failed request.
+        :return: the seconds to wait before retrying it
+        """
+        with self._lock:
+            attempts = self._attempts.get(key, 0)
+            self._attempts[key] = attempts + 1
+            if retry_after is not None:
+                # the server knows best, only spread the retries a little
+                delay = retry_after + random.uniform(0, min(1.0, self.base))
+                self._blocked_until[key] = max(self._blocked_until.get(key, 0), time.monotonic() + delay)
+            else:
+                # full jitter
+                delay = random.uniform(0, min(self.cap, self.base * 2 ** attempts))
+            return delay
+
+    def success(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def wait_time(self, key) -> float:
+        """
+        Seconds until requests of key may be sent again
+        """
+        with self._lock:
+            return max(0.0, self._blocked_until.get(key, 0) - time.monotonic())
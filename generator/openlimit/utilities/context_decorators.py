@@ -31,23 +31,54 @@ class FunctionDecorator(object):
         return async_wrapper if iscoroutinefunction(func) else wrapper
 
 
+class Reservation(object):
+    """
+    The tokens taken from a rate limiter for one request. Settle it with the usage reported in the response, so
+    the tokens reserved but not used flow back into the bucket.
+    """
+
+    def __init__(self, num_tokens, rate_limiter, tag=None, key=None):
+        """
+        :param key: the api key to send the request with, if the rate limiter picked one
+        """
+        self.num_tokens = num_tokens
+        self.rate_limiter = rate_limiter
+        self.tag = tag
+        self.key = key
+        self.settled = False
+
+    def settle(self, prompt_tokens=0, completion_tokens=0):
+        """
+        Only the first call counts. Settle a rejected request with no usage to get all its tokens back.
+        """
+        if self.settled:
+            return
+        self.settled = True
+        self.rate_limiter.settle(self.num_tokens, prompt_tokens, completion_tokens, tag=self.tag)
+
+
 class ContextManager(object):
     """
-    Converts rate limiter into context manager.
+    Converts rate limiter into context manager. Entering it returns the Reservation of the request.
     """
 
-    def __init__(self, num_tokens, rate_limiter):
+    def __init__(self, num_tokens, rate_limiter, tag=None, priority=None, deadline=None):
         self.num_tokens = num_tokens
         self.rate_limiter = rate_limiter
+        self.priority = priority
+        self.deadline = deadline
+        self.reservation = Reservation(num_tokens, rate_limiter, tag)
 
     def __enter__(self):
-        self.rate_limiter.wait_for_capacity_sync(self.num_tokens)
+        self.rate_limiter.wait_for_capacity_sync(self.num_tokens, self.priority, self.deadline)
+        return self.reservation
 
     def __exit__(self, *exc):
         return False
 
     async def __aenter__(self):
         await self.rate_limiter.wait_for_capacity(self.num_tokens)
+        return self.reservation
 
     async def __aexit__(self, *exc):
         return False
@@ -0,0 +1,69 @@
+# Standard library
+import logging
+import threading
+import time
+import typing
+
+######
+# MAIN
+######
+
+
+class KeyHealth(object):
+    """
+    Health of an api key. After failure_threshold consecutive failures, or one rejection of the key itself, the key
+    is out of rotation for a cooldown that doubles with every trip, up to max_cooldown. Throttling (429) and
+    malformed requests (other 4xx) say nothing about the key and are ignored. Thread-safe.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30, max_cooldown: float = 600):
+        """
+        :param failure_threshold: consecutive server or network errors that take the key out of rotation
+        :param cooldown: seconds out of rotation after the first trip
+        :param max_cooldown: the maximal seconds out of rotation
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._failures = 0
+        self._trips = 0
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, status: typing.Optional[int]):
+        """
+        Record the outcome of a request
+        :param status: the http status code, None if the request did not get a response
+        """
+        if status == 200:
+            self.success()
+        elif status in (401, 403):  # revoked key or exhausted quota
+            self.failure(fatal=True)
+        elif status is None or status >= 500:
+            self.failure()
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._trips = 0
+
+    def failure(self, fatal: bool = False):
+        with self._lock:
+            self._failures += 1
+            if not fatal and self._failures < self.failure_threshold:
+                return
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** self._trips)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + cooldown)
+            self._trips += 1
+            self._failures = 0
+        logging.warning(f"Api key out of rotation for {cooldown:.0f}s")
+
+    def wait_time(self) -> float:
+        """
+        Seconds until the key is back in rotation
+        """
+        with self._lock:
+            return max(0.0, self._cooldown_until - time.monotonic())
+
+    def available(self) -> bool:
+        return self.wait_time() == 0
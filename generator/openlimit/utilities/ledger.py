@@ -0,0 +1,36 @@
+# Standard library
+import threading
+import typing
+from collections import defaultdict
+
+######
+# MAIN
+######
+
+
+class UsageLedger(object):
+    """
+    Tokens reserved and actually used, per tag, e.g. per method-to-test. Thread-safe.
+    """
+
+    def __init__(self):
+        self._entries: typing.Dict[typing.Hashable, typing.Dict[str, int]] = defaultdict(
+            lambda: {"requests": 0, "reserved_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        )
+        self._lock = threading.Lock()
+
+    def record(self, tag, reserved_tokens, prompt_tokens, completion_tokens):
+        with self._lock:
+            entry = self._entries[tag]
+            entry["requests"] += 1
+            entry["reserved_tokens"] += reserved_tokens
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+
+    def get(self, tag) -> typing.Dict[str, int]:
+        with self._lock:
+            return dict(self._entries[tag]) if tag in self._entries else dict(self._entries.default_factory())
+
+    def summary(self) -> typing.Dict[typing.Hashable, typing.Dict[str, int]]:
+        with self._lock:
+            return {tag: dict(entry) for tag, entry in self._entries.items()}
@@ -0,0 +1,97 @@
+# Standard library
+import re
+import time
+import typing
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+######
+# MAIN
+######
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+@dataclass
+class RateLimitInfo:
+    """
+    The rate limit state reported by the server. Limits are per minute, resets and retry_after in seconds.
+    None if the header is absent.
+    """
+
+    limit_requests: typing.Optional[float] = None
+    limit_tokens: typing.Optional[float] = None
+    remaining_requests: typing.Optional[float] = None
+    remaining_tokens: typing.Optional[float] = None
+    reset_requests: typing.Optional[float] = None
+    reset_tokens: typing.Optional[float] = None
+    retry_after: typing.Optional[float] = None
+
+
+def parse_duration(value: str) -> typing.Optional[float]:
+    """
+    Seconds of an OpenAI duration such as '1s', '6m0s', '20ms' or a bare number of seconds
+    """
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if len(parts) == 0:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers) -> typing.Optional[float]:
+    """
+    Seconds to wait according to retry-after-ms or Retry-After, which is either seconds or an HTTP date
+    """
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _duration(headers, name):
+    value = headers.get(name)
+    return parse_duration(value) if value is not None else None
+
+
+def parse_rate_limit_headers(headers) -> RateLimitInfo:
+    """
+    :param headers: case-insensitive response headers, e.g. of requests or aiohttp
+    """
+    return RateLimitInfo(
+        limit_requests=_number(headers, "x-ratelimit-limit-requests"),
+        limit_tokens=_number(headers, "x-ratelimit-limit-tokens"),
+        remaining_requests=_number(headers, "x-ratelimit-remaining-requests"),
+        remaining_tokens=_number(headers, "x-ratelimit-remaining-tokens"),
+        reset_requests=_duration(headers, "x-ratelimit-reset-requests"),
+        reset_tokens=_duration(headers, "x-ratelimit-reset-tokens"),
+        retry_after=parse_retry_after(headers),
+    )
@@ -1,9 +1,90 @@
+# Standard library
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
 # Third party
 import tiktoken
 
 # Tokenizer
-CL100K_ENCODER = tiktoken.get_encoding("cl100k_base")
-P50K_ENCODER = tiktoken.get_encoding("p50k_base")
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+# Characters per token assumed by the approximate counter. Source code tokenizes at about 3.5, so this overestimates
+# slightly; the difference is refunded when the request is settled with the actual usage
+APPROX_CHARS_PER_TOKEN = 3
+
+# Strings shorter than this are encoded directly, hashing them costs about as much
+MEMO_MIN_LENGTH = 256
+
+
+def get_encoder(encoding_name="cl100k_base"):
+    """
+    The process-wide encoder of an encoding, loaded on first use
+    """
+    encoder = _encoders.get(encoding_name)
+    if encoder is None:
+        with _encoders_lock:
+            encoder = _encoders.get(encoding_name)
+            if encoder is None:
+                encoder = tiktoken.get_encoding(encoding_name)
+                _encoders[encoding_name] = encoder
+    return encoder
+
+
+def encoder_for_model(model):
+    return get_encoder(tiktoken.encoding_for_model(model).name)
+
+
+class TokenCountMemo(object):
+    """
+    Bounded LRU memo of token counts keyed by the hash of the content. Prompts repeat the same system prompt and
+    class context across every step and repair trial of a method, so most of them are counted once.
+    """
+
+    def __init__(self, max_entries=8192):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text, encoding_name="cl100k_base"):
+        if len(text) < MEMO_MIN_LENGTH:
+            return len(get_encoder(encoding_name).encode(text))
+        key = (encoding_name, hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest())
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        # encode outside the lock, a concurrent miss on the same text only costs a second encoding
+        count = len(get_encoder(encoding_name).encode(text))
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+
+TOKEN_COUNT_MEMO = TokenCountMemo()
+
+
+def count_tokens(text, encoding_name="cl100k_base"):
+    """
+    Exact token count of text, memoized
+    """
+    return TOKEN_COUNT_MEMO.count(text, encoding_name)
+
+
+def approximate_tokens(text):
+    """
+    Upper estimate of the token count of text without tokenizing it, for admission only
+    """
+    return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
 
 
 ######
@@ -11,14 +92,14 @@ P50K_ENCODER = tiktoken.get_encoding("p50k_base")
 ######
 
 
-def num_tokens_consumed_by_chat_request(messages, max_tokens=1024, n=1, **kwargs):
+def num_tokens_consumed_by_chat_request(messages, max_tokens=1024, n=1, approximate=False, **kwargs):
     num_tokens = n * max_tokens
     for message in messages:
         num_tokens += (
             4  # Every message follows <im_start>{role/name}\n{content}<im_end>\n
         )
         for key, value in message.items():
-            num_tokens += len(CL100K_ENCODER.encode(value))
+            num_tokens += approximate_tokens(value) if approximate else count_tokens(value, "cl100k_base")
 
             if key == "name":  # If there's a name, the role is omitted
                 num_tokens -= 1  # Role is always required and always 1 token
@@ -31,10 +112,10 @@ def num_tokens_consumed_by_chat_request(messages, max_tokens=1024, n=1, **kwargs
 def num_tokens_consumed_by_completion_request(prompt, max_tokens=15, n=1, **kwargs):
     num_tokens = n * max_tokens
     if isinstance(prompt, str):  # Single prompt
-        num_tokens += len(P50K_ENCODER.encode(prompt))
+        num_tokens += count_tokens(prompt, "p50k_base")
     elif isinstance(prompt, list):  # Multiple prompts
         num_tokens *= len(prompt)
-        num_tokens += sum([len(P50K_ENCODER.encode(p)) for p in prompt])
+        num_tokens += sum([count_tokens(p, "p50k_base") for p in prompt])
     else:
         raise TypeError(
             "Either a string or list of strings expected for 'prompt' field in completion request."
@@ -45,9 +126,9 @@ def num_tokens_consumed_by_completion_request(prompt, max_tokens=15, n=1, **kwar
 
 def num_tokens_consumed_by_embedding_request(input, **kwargs):
     if isinstance(input, str):  # Single input
-        return len(P50K_ENCODER.encode(input))
+        return count_tokens(input, "p50k_base")
     elif isinstance(input, list):  # Multiple inputs
-        return sum([len(P50K_ENCODER.encode(i)) for i in input])
+        return sum([count_tokens(i, "p50k_base") for i in input])
 
     raise TypeError(
         "Either a string or list of strings expected for 'input' field in embedding request."
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+
+READ_THROUGH = "read_through"  # answer from the cache, call the API and store on a miss
+WRITE_ONLY = "write_only"  # always call the API, store the response
+BYPASS = "bypass"  # no cache
+MODES = (READ_THROUGH, WRITE_ONLY, BYPASS)
+
+_caches_lock = threading.Lock()
+_caches: Dict[Tuple, "ResponseCache"] = dict({})
+
+
+def request_key(model, messages, temperature, top_p, n, sample_index=0):
+    """
+    Content address of a chat request. sample_index tells apart repeated requests that are expected to get
+    different samples, e.g. the retries of a generation with the same prompt and temperature
+    """
+    canonical = json.dumps({"model": model, "messages": messages, "temperature": temperature, "top_p": top_p,
+                            "n": n, "sample_index": sample_index}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk store of successful LLM responses, one json file per request in {root}/{key[:2]}/{key}.json.
+    The mtime of a file is its last use; the least recently used files are evicted once the store grows beyond
+    max_bytes. Identical requests in flight at the same time are sent once, the others wait for its response.
+    Safe to share between threads. Processes may share the dir, their eviction is only approximate.
+    """
+
+    def __init__(self, root, max_bytes=1 << 30, mode=READ_THROUGH):
+        """
+        :param root: the cache dir
+        :param max_bytes: size limit of the cached files
+        :param mode: READ_THROUGH, WRITE_ONLY or BYPASS
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode}, should be one of {MODES}")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = dict({})
+        self._size = None  # computed on first write
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """
+        The cached response of key, None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return entry["response"]
+
+    def put(self, key, response, request=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = json.dumps({"request": request, "response": response}, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(content.encode("utf-8"))
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    yield os.path.join(dirpath, filename)
+
+    def _scan_size(self):
+        size = 0
+        for path in self._files():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _evict(self):
+        """
+        Remove the least recently used files until the store is at 90% of max_bytes. Call with the lock held
+        """
+        entries = list([])
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, file_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+            evicted += 1
+        self._size = size
+        logging.debug(f"Evicted {evicted} cached responses from {self.root}")
+
+    def fetch(self, key, call: Callable[[], Tuple], request=None) -> Tuple:
+        """
+        Return the response of a request through the cache.
+        :param key: see request_key
+        :param call: sends the request. Returns (status code, outputs, token count), like OpenGenerator.generate
+        :param request: stored with the response, for inspection only
+        """
+        if self.mode == BYPASS:
+            return call()
+        if self.mode == READ_THROUGH:
+            cached = self.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                return 200, cached["outputs"], cached["token_count"]
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = call()
+            if result[0] == 200 and result[1] is not None:
+                self.put(key, {"outputs": result[1], "token_count": result[2]}, request)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+def get_response_cache(root, max_bytes, mode) -> Optional[ResponseCache]:
+    """
+    The cache of the process for root, None if mode is BYPASS
+    """
+    if mode == BYPASS:
+        return None
+    key = (os.path.abspath(root), max_bytes, mode)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ResponseCache(root, max_bytes, mode)
+        return _caches[key]
@@ -5,21 +5,29 @@ from typing import Dict
 import jinja2
 import logging
 
-import tiktoken
+from generator.openlimit.utilities import encoder_for_model, count_tokens
+from utils.config import generation_candidates
 
 from utils.post_process import extract_code
 
 
-def generate_code(chatter, user_prompt, system_prompt, init_temperature, cls_name, prev_code=None):
+def generate_code(chatter, user_prompt, system_prompt, init_temperature, cls_name, prev_code=None, priority=None,
+                  candidates=None, sample_index=0):
     """
     Generate code with the given chatter, user_prompt, system_prompt and init temperature.
-    cls_name is for validate the generation.
-    The generation has 6 chances. After 6 chances, if no valid code get, runtime error raises
+    cls_name is for validate the generation. priority is the priority class of the requests, see OpenGenerator.
+    The generation has 6 chances. At a positive temperature, up to `candidates` chances (generation_candidates in
+    config.ini by default) are taken in one request and the first valid choice wins.
+    sample_index numbers generations of the same prompt run side by side, e.g. speculative repair candidates, so
+    their requests are not taken for repeats of each other, see OpenGenerator.generate.
+    After 6 chances, if no valid code get, runtime error raises
     """
+    candidates = generation_candidates if candidates is None else candidates
     extracted_code = None
     result = None
     original_user_prompt = user_prompt
-    for generate_trial in range(6):
+    generate_trial = 0
+    while generate_trial < 6 and extracted_code is None:
         if generate_trial == 0:
             temperature = init_temperature
         elif init_temperature < 0.2:
@@ -28,26 +36,29 @@ def generate_code(chatter, user_prompt, system_prompt, init_temperature, cls_nam
             temperature = init_temperature
         if generate_trial > 0:
             temperature += 0.1 * (generate_trial - 1)
+        # greedy choices are all the same, only sample several at a positive temperature
+        gen_count = 1 if temperature == 0 else max(1, min(candidates, 6 - generate_trial))
 
-        r = chatter.generate(user_prompt, system_prompt, temperature=temperature)
-        if r[1] is not None:
-            result = r[1][0]
-        else:
-            result = "a;dfkjasd;fjkla"
-        has_code, extracted_code, has_syntactic_error = extract_code(result)
-        if has_code and not has_syntactic_error and cls_name in extracted_code:
-            if prev_code is not None and prev_code == extracted_code:
-                extracted_code = None
-                error_message = "In previous round of generation, you output is the same as the code to fix. Fix it!"
-                user_prompt = original_user_prompt + '\n' + error_message
-            else:
-                break
-        else:
-            extracted_code = None
-            error_message = ("In previous generation, found syntax error! The brackets must be CLOSED! "
-                             "The brackets must be BALANCED!")
-            if has_syntactic_error:
-                user_prompt = original_user_prompt + '\n' + error_message
+        r = chatter.generate(user_prompt, system_prompt, temperature=temperature, gen_count=gen_count,
+                             sample_index=6 * sample_index + generate_trial, priority=priority)
+        # a failed request, e.g. "timeout", costs one chance whatever it asked for
+        generate_trial += gen_count if r[1] is not None else 1
+        error_message = None
+        for result in (r[1] if r[1] is not None else ["a;dfkjasd;fjkla"]):
+            has_code, code, has_syntactic_error = extract_code(result)
+            if has_code and not has_syntactic_error and cls_name in code:
+                if prev_code is not None and prev_code == code:
+                    if error_message is None:
+                        error_message = ("In previous round of generation, you output is the same as the code to "
+                                         "fix. Fix it!")
+                else:
+                    extracted_code = code
+                    break
+            elif has_syntactic_error and error_message is None:
+                error_message = ("In previous generation, found syntax error! The brackets must be CLOSED! "
+                                 "The brackets must be BALANCED!")
+        if extracted_code is None and error_message is not None:
+            user_prompt = original_user_prompt + '\n' + error_message
 
     if extracted_code is None:
         raise RuntimeError(f"Failed to generate good code.")
@@ -73,10 +84,7 @@ class BasicProcedure:
         self.logger.info(f"{procedure_name} generator started. "
                          f"Template loaded from {os.path.join(prompt_root, user_template_file_name)}")
 
-        self.enc = tiktoken.get_encoding("cl100k_base")
-        self.encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        self.encoding = encoder_for_model("gpt-3.5-turbo")
 
     def count_tokens(self, strings):
-        tokens = self.encoding.encode(strings)
-        cnt = len(tokens)
-        return cnt
\ No newline at end of file
+        return count_tokens(strings, self.encoding.name)
\ No newline at end of file
@@ -1,22 +1,32 @@
 import glob
+import logging
 import os.path
 import shutil
+import subprocess
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+
+from typing import Optional
 
 from pymongo.collection import Collection
 
 from generator.open_generator import OpenGenerator
+from generator.openlimit import PRIORITY_REPAIR
 from procedures.basic_procedure import BasicProcedure, generate_code
 from utils import test_runner
 from utils.code_editor import remove_assertion
 from utils.config import *
-from utils.report import jacoco_analysis
+from utils.daemon import DaemonError, method_coverage_in_server
+from utils.project_context import ProjectContext
+from utils.report import jacoco_analysis, jacoco_xml_analysis
 
 
-def remove_assertion_retest(step_workspace, put_path) -> bool:
+def remove_assertion_retest(step_workspace, put_path, cancel: Optional[threading.Event] = None) -> bool:
     """
     If the test case's failure is due to assertion error, try to remove that assertion statement and retest
     :param step_workspace: the fir for 'temp' and 'runtemp', the workspace of a unit test CU
     :param put_path, the path of the project-under-test
+    :param cancel: see TestRunner
     :return: bool, indicating the test result
     """
     runtime_error_path = os.path.join(step_workspace, "temp", "runtime_error.txt")
@@ -49,25 +59,41 @@ def remove_assertion_retest(step_workspace, put_path) -> bool:
             task = test_runner.TestRunner(step_workspace,
                                           put_path,
                                           step_workspace,
-                                          "jacoco")
+                                          "jacoco", lean_report=True, cancel=cancel)
             test_fixed = task.start_single_test()
             return test_fixed
     return False
 
 
-def coverage_check(slice_work_space, signature, package, class_name):
+def coverage_check(slice_work_space, signature, package, class_name, put_path=None):
     """
     structure of slice_work_space
     - slice_work_space
         - runtemp: dir for the test src's .class file
         - temp: dir for test src and execution report
-        - cov_check_dir: exists if execution success
+        - cov_check_dir: exists if execution success. Holds coverage.xml for lean reports, else the html report
+    If USE_COVERAGE_SERVER and put_path is given, the coverage is computed from runtemp/jacoco.exec by the resident
+    analyzer. The report is only generated if the analyzer fails.
     """
     # first check exec record
-    assert os.path.exists(os.path.join(slice_work_space, 'runtemp', 'jacoco.exec'))
+    exec_file = os.path.join(slice_work_space, 'runtemp', 'jacoco.exec')
+    assert os.path.exists(exec_file)
     if not os.path.exists(os.path.join(slice_work_space, "cov_check_dir")):
         return None
 
+    if USE_COVERAGE_SERVER and put_path is not None:
+        try:
+            context = ProjectContext.get(put_path)
+            return method_coverage_in_server(context.build_dir, [exec_file], package, class_name, signature,
+                                             timeout=TIMEOUT)
+        except (DaemonError, subprocess.TimeoutExpired) as e:
+            logging.warning(f"Coverage server failed for {slice_work_space}: {e}. Fall back to jacococli")
+            task = test_runner.TestRunner(slice_work_space, put_path, slice_work_space, "jacoco", lean_report=True)
+            task.report(os.path.dirname(exec_file), os.path.join(slice_work_space, "cov_check_dir"))
+
+    xml_report = os.path.join(slice_work_space, "cov_check_dir", "coverage.xml")
+    if os.path.exists(xml_report):
+        return jacoco_xml_analysis(xml_report, package, class_name, signature)
     coverage_result = jacoco_analysis(os.path.join(slice_work_space, "cov_check_dir"),
                                       package,
                                       class_name,
@@ -75,19 +101,79 @@ def coverage_check(slice_work_space, signature, package, class_name):
     return coverage_result
 
 
-def advanced_run_check(slice_workspace, put_path, signature, package, class_name):
+def batch_compile(workspaces, put_path, output_path):
+    """
+    Compile the unit tests of many workspaces with batched javac calls, see TestRunner.compile_batch.
+    Run them with advanced_run_check(..., precompiled=True) afterwards
+    :param workspaces: dirs containing 'temp' with the test src. Classes go to 'runtemp'
+    :param put_path: the path of the project-under-test
+    :param output_path: output path of the TestRunner
+    """
+    tasks = list([])
+    for workspace in workspaces:
+        test_file = glob.glob(os.path.join(workspace, "temp", "*.java"))[0]
+        tasks.append((test_file, os.path.join(workspace, "runtemp"), os.path.join(workspace, "temp", "compile_error")))
+    if len(tasks) == 0:
+        return
+    task = test_runner.TestRunner(output_path, put_path, output_path, "jacoco")
+    task.compile_batch(tasks)
+
+
+def batch_run(workspaces, put_path, output_path):
+    """
+    Run the compiled unit tests of many workspaces in one JVM, see TestRunner.run_batch. Workspaces whose test did
+    not compile are skipped. Check them with advanced_run_check(..., executed=True) afterwards
+    :param workspaces: dirs containing 'temp' with the test src and 'runtemp' with its classes
+    :param put_path: the path of the project-under-test
+    :param output_path: output path of the TestRunner
+    """
+    tasks = list([])
+    for workspace in workspaces:
+        if os.path.exists(os.path.join(workspace, "temp", "compile_error.txt")):
+            continue
+        test_file = glob.glob(os.path.join(workspace, "temp", "*.java"))[0]
+        tasks.append((test_file, os.path.join(workspace, "runtemp"), os.path.join(workspace, "temp", "runtime_error")))
+    if len(tasks) == 0:
+        return
+    task = test_runner.TestRunner(output_path, put_path, output_path, "jacoco")
+    task.run_batch(tasks)
+
+
+def write_trial(trial_workspace, unitest_failed, code, system_prompt, generate_prompt, response):
+    """
+    Put down a generated unit test and its prompts in {trial_workspace}/temp
+    """
+    os.makedirs(os.path.join(trial_workspace, "temp"), exist_ok=True)
+    with (open(os.path.join(trial_workspace, "temp", unitest_failed + ".java"), "w") as file):
+        file.write(code)
+    with (open(os.path.join(trial_workspace, "temp", "system_prompt.txt"), "w") as file):
+        file.write(system_prompt)
+    with (open(os.path.join(trial_workspace, "temp", "generate_prompt.txt"), "w") as file):
+        file.write(generate_prompt)
+    with (open(os.path.join(trial_workspace, "temp", "response.txt"), "w") as file):
+        file.write(response)
+
+
+def advanced_run_check(slice_workspace, put_path, signature, package, class_name, precompiled=False,
+                       cancel: Optional[threading.Event] = None, executed=False):
+    """
+    :param cancel: once set, the test is stopped and counted as failed, see TestRunner
+    :param executed: the test has already run by batch_run, see TestRunner.start_single_test
+    """
     task = test_runner.TestRunner(slice_workspace,
                                   put_path,
                                   slice_workspace,
-                                  "jacoco")
-    test_passed = task.start_single_test()
+                                  "jacoco", lean_report=True, cancel=cancel)
+    test_passed = task.start_single_test(precompiled=precompiled, executed=executed)
+    if cancel is not None and cancel.is_set():
+        return False
     if not test_passed:
         # remove assertion trial
-        test_passed = remove_assertion_retest(slice_workspace, put_path)
+        test_passed = remove_assertion_retest(slice_workspace, put_path, cancel)
 
     if test_passed:
         coverage_analysis = coverage_check(slice_workspace,
-                                           signature, package, class_name)
+                                           signature, package, class_name, put_path)
         if coverage_analysis is None:
             test_passed = False
             with open(os.path.join(slice_workspace, "temp", "run_check_fail.txt"), "w") as file:
@@ -106,13 +192,15 @@ class TestFixer(BasicProcedure):
     def __init__(self, prompt_root, system_template_file_name, fixer_template_file_name):
         super(TestFixer, self).__init__(prompt_root, system_template_file_name, fixer_template_file_name, "fixer")
 
-    def init_test(self, log_dir, put_path, collection: Collection, fixing=False):
+    def init_test(self, log_dir, put_path, collection: Collection, fixing=False, executor: Optional[Executor] = None):
         """
-        init test for code generated in the first round
+        init test for code generated in the first round. Each test case runs in its own workspace
+        {log_dir}/fixing/{test_case}/0 on the executor
         :param collection:
         :param log_dir:
         :param put_path:
         :param fixing: if this is a following fixing step.
+        :param executor: the pool running the test cases, the project-wide test_runner.test_executor() by default
         :return:
         """
         code_dir = "steps" if not fixing else "slice_fixing"
@@ -126,6 +214,7 @@ class TestFixer(BasicProcedure):
         test_cases = [os.path.basename(path)
                       for path in glob.glob(os.path.join(log_dir, code_dir, "*.java"), recursive=False)]
         failed_test_cases = []
+        workspaces = list([])
         for test_case in test_cases:
             target_dir = os.path.join(log_dir, "fixing", test_case[:-len(".java")], "0", "temp")
             if os.path.exists(os.path.dirname(target_dir)):
@@ -136,10 +225,20 @@ class TestFixer(BasicProcedure):
             if os.path.exists(os.path.join(log_dir, code_dir, test_case.replace(".java", ".condition.txt"))):
                 shutil.copy(os.path.join(log_dir, code_dir, test_case.replace(".java", ".condition.txt")),
                             os.path.dirname(os.path.dirname(target_dir)))
-            test_passed = advanced_run_check(os.path.dirname(target_dir), put_path, raw_info['parameters'],
-                                             raw_info['package'].replace("package ", "").replace(";", ""),
-                                             raw_info['class_name'])
-            if not test_passed:
+            workspaces.append((test_case, os.path.dirname(target_dir)))
+
+        batch_compile([workspace for _, workspace in workspaces], put_path, os.path.join(log_dir, "fixing"))
+        executor = test_runner.test_executor() if executor is None else executor
+        if USE_BATCH_LAUNCH:
+            # one JVM for all test cases of the method, then only their coverage is checked in parallel
+            executor.submit(batch_run, [workspace for _, workspace in workspaces], put_path,
+                            os.path.join(log_dir, "fixing")).result()
+        package = raw_info['package'].replace("package ", "").replace(";", "")
+        futures = [executor.submit(advanced_run_check, workspace, put_path, raw_info['parameters'], package,
+                                   raw_info['class_name'], precompiled=True, executed=USE_BATCH_LAUNCH)
+                   for _, workspace in workspaces]
+        for (test_case, _), future in zip(workspaces, futures):
+            if not future.result():
                 failed_test_cases.append(test_case)
 
         if len(failed_test_cases) > 0:
@@ -154,7 +253,7 @@ class TestFixer(BasicProcedure):
         return failed_test_cases
 
     def single_unitest_fix(self, log_dir, collection: Collection, unitest_failed, put_path,
-                           chatter: OpenGenerator) -> bool:
+                           chatter: OpenGenerator, speculative_k=None, repair_budget=None) -> bool:
         """
         Fix single unitest in path {method_experiment_root}/fixing/{unitest_failed}
         :param collection:
@@ -162,18 +261,23 @@ class TestFixer(BasicProcedure):
         :param put_path:
         :param log_dir: literal meaning
         :param unitest_failed: see the intro
+        :param speculative_k: repair candidates generated and tested concurrently per trial, see speculative_trial.
+        By default, SPECULATIVE_REPAIR_K in config.ini. 1 is the sequential repair
+        :param repair_budget: the maximal candidates tested for the unit test, REPAIR_BUDGET in config.ini by default
         :return: whether the unit test is fixed
         """
+        speculative_k = SPECULATIVE_REPAIR_K if speculative_k is None else speculative_k
+        repair_budget = REPAIR_BUDGET if repair_budget is None else repair_budget
         unitest_root = os.path.join(log_dir, "fixing", unitest_failed)
         assert os.path.exists(unitest_root)
+        # spec_* dirs are the candidates of an interrupted speculative trial
         existing_trials = [int(trial_id) for trial_id in os.listdir(unitest_root.__str__())
-                           if os.path.isdir(os.path.join(unitest_root.__str__(), trial_id))]
+                           if trial_id.isdigit() and os.path.isdir(os.path.join(unitest_root.__str__(), trial_id))]
         start_trial_to_fix = max(existing_trials)
         start_error = glob.glob(os.path.join(unitest_root.__str__(), str(start_trial_to_fix), "temp", "*error.txt"))
         if len(start_error) == 0:
             return True
 
-        max_trial = 10
         # load method info
         raw_info = raw_data = collection.find_one({"table_name": "raw_data"})
         dir_3 = collection.find_one({"table_name": "direction_3"})
@@ -191,8 +295,11 @@ class TestFixer(BasicProcedure):
         else:
             block = ""
 
+        package = raw_info['package'].replace("package ", "").replace(";", "")
+        used = start_trial_to_fix  # candidates tested before, one per trial as far as we know
         src_trial = start_trial_to_fix
-        for tgt_trial in range(start_trial_to_fix + 1, max_trial + 1):
+        tgt_trial = start_trial_to_fix + 1
+        while used < repair_budget:
             src_trial_workspace = os.path.join(unitest_root.__str__(), str(src_trial))
             tgt_trial_workspace = os.path.join(unitest_root.__str__(), str(tgt_trial))
 
@@ -233,33 +340,35 @@ class TestFixer(BasicProcedure):
             error_info['block'] = block
             if 'example' in dir_3:
                 error_info['example'] = dir_3['example']
-
-            extracted_code = unitest_to_fix.strip()
-            response = "Failed to generate any new code"
-
-            try:
-                extracted_code, response = generate_code(chatter, self.generate_template.render(error_info),
-                                                         self.system_template.render(dir_3),
-                                                         init_temperature=init_temperature, cls_name=unitest_failed,
-                                                         prev_code=unitest_to_fix.strip())
-            except RuntimeError as e:
-                print(e)
-
-            # put down the new generated code
-            os.makedirs(os.path.join(tgt_trial_workspace, "temp"), exist_ok=True)
-            with (open(os.path.join(tgt_trial_workspace, "temp", unitest_failed + ".java"), "w") as file):
-                file.write(extracted_code)
-            with (open(os.path.join(tgt_trial_workspace, "temp", "system_prompt.txt"), "w") as file):
-                file.write(self.system_template.render(dir_3))
-            with (open(os.path.join(tgt_trial_workspace, "temp", "generate_prompt.txt"), "w") as file):
-                file.write(self.generate_template.render(error_info))
-            with (open(os.path.join(tgt_trial_workspace, "temp", "response.txt"), "w") as file):
-                file.write(response)
-
-            # test
-            test_fixed = advanced_run_check(tgt_trial_workspace, put_path, raw_info['parameters'],
-                                            raw_info['package'].replace("package ", "").replace(";", ""),
-                                            raw_info['class_name'])
+            system_prompt = self.system_template.render(dir_3)
+            generate_prompt = self.generate_template.render(error_info)
+
+            k = max(1, min(speculative_k, repair_budget - used))
+            used += k
+            if k > 1:
+                test_fixed, extracted_code = self.speculative_trial(unitest_root, unitest_failed, tgt_trial, k, chatter,
+                                                                    system_prompt, generate_prompt, unitest_to_fix,
+                                                                    init_temperature, put_path, raw_info)
+            else:
+                extracted_code = unitest_to_fix.strip()
+                response = "Failed to generate any new code"
+
+                try:
+                    extracted_code, response = generate_code(chatter, generate_prompt, system_prompt,
+                                                             init_temperature=init_temperature,
+                                                             cls_name=unitest_failed,
+                                                             prev_code=unitest_to_fix.strip(),
+                                                             priority=PRIORITY_REPAIR)
+                except RuntimeError as e:
+                    print(e)
+
+                # put down the new generated code
+                write_trial(tgt_trial_workspace, unitest_failed, extracted_code, system_prompt, generate_prompt,
+                            response)
+
+                # test
+                test_fixed = advanced_run_check(tgt_trial_workspace, put_path, raw_info['parameters'], package,
+                                                raw_info['class_name'])
 
             if test_fixed:
                 break
@@ -269,5 +378,68 @@ class TestFixer(BasicProcedure):
             else:
                 init_temperature = 0.0
             src_trial = tgt_trial
+            tgt_trial += 1
 
         return test_fixed
+
+    def speculative_trial(self, unitest_root, unitest_failed, tgt_trial, k, chatter: OpenGenerator, system_prompt,
+                          generate_prompt, unitest_to_fix, init_temperature, put_path, raw_info):
+        """
+        Generate k repairs concurrently, one at init_temperature and samples at rising temperatures, each at a
+        temperature of its own, and test them concurrently in {unitest_root}/spec_{tgt_trial}_{idx}. The first to pass the coverage check wins and the
+        tests of the others are killed. The winner, or else a candidate that compiles, becomes trial tgt_trial.
+        :return: (whether a candidate passed, the code of the kept candidate)
+        """
+        # init_temperature is 0.4 after an unchanged trial, do not sample it twice
+        samples = [round(0.4 + 0.2 * idx, 1) for idx in range(k)]
+        temperatures = [init_temperature] + [t for t in samples if t != init_temperature][:k - 1]
+
+        def _generate(sample_index):
+            try:
+                return generate_code(chatter, generate_prompt, system_prompt,
+                                     init_temperature=temperatures[sample_index], cls_name=unitest_failed,
+                                     prev_code=unitest_to_fix.strip(), priority=PRIORITY_REPAIR, candidates=1,
+                                     sample_index=sample_index)
+            except RuntimeError as e:
+                print(e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=k) as executor:
+            generated = list(executor.map(_generate, range(k)))
+        candidates = list([])
+        for result in generated:
+            if result is not None and result[0] not in [code for code, _ in candidates]:
+                candidates.append(result)
+        if len(candidates) == 0:
+            candidates.append((unitest_to_fix.strip(), "Failed to generate any new code"))
+
+        workspaces = [os.path.join(unitest_root, f"spec_{tgt_trial}_{idx}") for idx in range(len(candidates))]
+        for workspace, (code, response) in zip(workspaces, candidates):
+            shutil.rmtree(workspace, ignore_errors=True)  # left over by an interrupted run
+            write_trial(workspace, unitest_failed, code, system_prompt, generate_prompt, response)
+
+        package = raw_info['package'].replace("package ", "").replace(";", "")
+        cancel = threading.Event()
+        winner = None
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            futures = {executor.submit(advanced_run_check, workspace, put_path, raw_info['parameters'], package,
+                                       raw_info['class_name'], cancel=cancel): idx
+                       for idx, workspace in enumerate(workspaces)}
+            for future in as_completed(futures):
+                if future.result() and winner is None:
+                    winner = futures[future]
+                    cancel.set()
+
+        if winner is not None:
+            keep = winner
+        else:
+            # a compiling candidate is the better start of the next round
+            keep = next((idx for idx, workspace in enumerate(workspaces)
+                         if not os.path.exists(os.path.join(workspace, "temp", "compile_error.txt"))), 0)
+        os.rename(workspaces[keep], os.path.join(unitest_root, str(tgt_trial)))
+        for idx, workspace in enumerate(workspaces):
+            if idx != keep:
+                shutil.rmtree(workspace, ignore_errors=True)
+        self.logger.info(f"Trial {tgt_trial} of {unitest_failed}: {len(candidates)} candidates, "
+                         f"{'candidate ' + str(winner) + ' passed' if winner is not None else 'none passed'}")
+        return winner is not None, candidates[keep][0]
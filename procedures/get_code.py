@@ -6,8 +6,10 @@ from typing import Optional, List, Dict
 from pymongo.collection import Collection
 
 from generator.open_generator import OpenGenerator
+from generator.openlimit import PRIORITY_GENERATION
 from procedures.basic_procedure import BasicProcedure
 from utils.code_editor import CodeEditor
+from utils.config import generation_candidates
 from utils.post_process import extract_code
 
 
@@ -17,7 +19,7 @@ class InitialCodeGenerator(BasicProcedure):
                                                    init_code_generate_template_file_name, "init_code_generator")
         self.code_editor = CodeEditor()
 
-    def generate_code(self, direction_3, step_id, chatter, log_dir, init_temp=0.0, capacity=-1):
+    def generate_code(self, direction_3, step_id, chatter, log_dir, init_temp=0.0, capacity=-1, candidates=None):
         """
         :param direction_3: the dict containing all info filling the template
         :param step_id: str, an int if normal slice or 'fixing_x' for fixing. x is number, e.g., fixing_1
@@ -25,8 +27,11 @@ class InitialCodeGenerator(BasicProcedure):
         :param log_dir: dir to save the log
         :param init_temp
         :param capacity: how much capacity for  this round of generation. if -1, no limit.
+        :param candidates: choices per request at a positive temperature, the first usable one wins.
+        By default, generation_candidates in config.ini
         :return:
         """
+        candidates = generation_candidates if candidates is None else candidates
         # cls_name = "_".join([direction_3['simple_class_name'], direction_3['simple_method_name'], str(i), 'Test'])
         logger_name = log_dir.replace('.', '/') + f".{step_id}"
         logger = logging.getLogger(name=logger_name)
@@ -39,36 +44,45 @@ class InitialCodeGenerator(BasicProcedure):
         response = ""
         tests_by_condition = list([])
 
-        for generate_trial in range(5):
+        generate_trial = 0
+        found = False
+        while generate_trial < 5 and not found:
             temperature = init_temp if generate_trial == 0 else 0.5
+            # greedy choices are all the same, only sample several at a positive temperature
+            gen_count = 1 if temperature == 0 else max(1, min(candidates, 5 - generate_trial))
             response_0 = chatter.generate(self.generate_template.render(direction_3),
                                           self.system_template.render(),
-                                          temperature=temperature)
+                                          temperature=temperature, gen_count=gen_count, sample_index=generate_trial,
+                                          priority=PRIORITY_GENERATION)
+            trials = range(generate_trial, generate_trial + gen_count)
             if response_0[0] != 200:
                 logger.error(f"Error when communicate with GPT. Error code: {response_0[0]}")
+                generate_trial += 1  # a failed request costs one chance whatever it asked for
                 continue
-            else:
-                response = response_0[1][0]
-            has_code, extracted_code, has_syntactic_error = extract_code(response)
-            # print(cls_name)
-            # print(extracted_code)
-            if has_code and not has_syntactic_error:
-                tests_by_condition = self.code_editor.split_test_cases(extracted_code, direction_3['simple_class_name'])
-                if tests_by_condition is None:
-                    tests_by_condition = []
-                    logger.warning(f"For task {log_dir},"
-                                   f"solution step {step_id}, in trial {generate_trial}, no valid public class found")
+            generate_trial += gen_count
+            for trial, response in zip(trials, response_0[1]):
+                has_code, extracted_code, has_syntactic_error = extract_code(response)
+                # print(cls_name)
+                # print(extracted_code)
+                if has_code and not has_syntactic_error:
+                    tests_by_condition = self.code_editor.split_test_cases(extracted_code,
+                                                                           direction_3['simple_class_name'])
+                    if tests_by_condition is None:
+                        tests_by_condition = []
+                        logger.warning(f"For task {log_dir},"
+                                       f"solution step {step_id}, in trial {trial}, no valid public class found")
+                    else:
+                        found = True
+                        break
                 else:
-                    break
-            else:
-                if not has_code:
-                    logger.warning(f"For task {log_dir},"
-                                   f"solution step {step_id}, in trial {generate_trial}, no code found in response")
-                if has_syntactic_error:
-                    logger.warning(f"For task {log_dir},"
-                                   f"solution step {step_id}, in trial {generate_trial}, syntactic error")
-                logger.info(f"The response is \n{response}")
-                tests_by_condition = list([])
+                    if not has_code:
+                        logger.warning(f"For task {log_dir},"
+                                       f"solution step {step_id}, in trial {trial}, no code found in response")
+                    if has_syntactic_error:
+                        logger.warning(f"For task {log_dir},"
+                                       f"solution step {step_id}, in trial {trial}, syntactic error")
+                    logger.info(f"The response is \n{response}")
+                    tests_by_condition = list([])
 
         if step_id is int:
             step_id = str(step_id)
@@ -7,6 +7,7 @@ from typing import Optional, Dict
 from pymongo.collection import Collection
 
 from generator.open_generator import OpenGenerator
+from generator.openlimit import PRIORITY_SLICE
 from procedures.basic_procedure import BasicProcedure
 
 
@@ -42,7 +43,7 @@ class SliceInfoGenerator(BasicProcedure):
                                     f"Failed reason: {failed_reason}")
             temperature = 0.0 if i == 1 else 0.4
             result = chatter.generate(self.generate_template.render(direction_3), self.system_template.render(),
-                                      temperature=temperature)[1][0]
+                                      temperature=temperature, sample_index=i, priority=PRIORITY_SLICE)[1][0]
             matches = re.findall(pattern_1, result)
             target_str = [match.strip() for match in matches]
             if len(target_str) == 0:
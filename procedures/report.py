@@ -7,34 +7,23 @@ from typing import Optional, Dict
 
 from pymongo.collection import Collection
 
-from utils import test_runner
+from utils.config import TIMEOUT
+from utils.daemon import DaemonError, method_coverage_in_server
+from utils.jacoco_exec import ExecFormatError, merge_exec_files
+from utils.project_context import parse_root_pom
 from utils.report import jacoco_analysis
 
 
-def single_method_report(method_experiment_root, collection: Collection, put_path, jacoco_cli_path,
-                         build_dir="target/classes", src_dir="src/main/java"):
+def collect_exec_paths(method_experiment_root):
     """
-    Report the coverage data of a
-    :param method_experiment_root:
-    :param collection
-    :param put_path: root dir for the target PUT
-    :param jacoco_cli_path:
-    :param build_dir: default build dir suffix. Generally, for each module, find classes in {module}/{build_dir}
-    :param src_dir: default src dir suffix.
-    :return:
+    The exec file of the last passing trial of every unit test in {method_experiment_root}/fixing
     """
-    assert os.path.exists(jacoco_cli_path)
-    assert os.path.exists(method_experiment_root)
-    assert os.path.exists(os.path.join(method_experiment_root, "fixing"))
     fixing_root = os.path.join(method_experiment_root, "fixing")
-    output_root = os.path.join(method_experiment_root, 'full_report')
-    os.makedirs(output_root, exist_ok=True)
     slices = list([])
     for _dir in os.listdir(fixing_root):
         if os.path.isdir(os.path.join(fixing_root, _dir)):
             slices.append(os.path.join(fixing_root, _dir))
 
-    # aggregate the report
     exec_paths = list([])
     for _slice in slices:
         trials = [_dir for _dir in os.listdir(_slice) if re.match(r"\d+", _dir)]
@@ -48,14 +37,44 @@ def single_method_report(method_experiment_root, collection: Collection, put_pat
             if os.path.exists(exec_path) and not os.path.exists(runtime_error) and not os.path.exists(compile_error):
                 exec_paths.append(exec_path)
                 break
+    return exec_paths
+
+
+def find_target_class_paths(module_poms, build_dir="target/classes"):
+    """
+    The existing {module}/{build_dir} dirs of the modules
+    """
+    target_class_paths = [os.path.join(os.path.dirname(module_pom), build_dir) for module_pom in module_poms]
+    return [path for path in target_class_paths if os.path.exists(path)]
+
+
+def single_method_report(method_experiment_root, collection: Collection, put_path, jacoco_cli_path,
+                         build_dir="target/classes", src_dir="src/main/java"):
+    """
+    Report the coverage data of a
+    :param method_experiment_root:
+    :param collection
+    :param put_path: root dir for the target PUT
+    :param jacoco_cli_path:
+    :param build_dir: default build dir suffix. Generally, for each module, find classes in {module}/{build_dir}
+    :param src_dir: default src dir suffix.
+    :return:
+    """
+    assert os.path.exists(jacoco_cli_path)
+    assert os.path.exists(method_experiment_root)
+    assert os.path.exists(os.path.join(method_experiment_root, "fixing"))
+    output_root = os.path.join(method_experiment_root, 'full_report')
+    os.makedirs(output_root, exist_ok=True)
+
+    # aggregate the report
+    exec_paths = collect_exec_paths(method_experiment_root)
     if len(exec_paths) == 0:
         logging.warning(f"Found no exec file in experiment {method_experiment_root}")
         return None
 
-    # get target class paths
-    module_poms = test_runner.parse_root_pom(put_path)
-    target_class_paths = [os.path.join(os.path.dirname(module_pom), build_dir) for module_pom in module_poms]
-    target_class_paths = [path for path in target_class_paths if os.path.exists(path)]
+    # get target class paths, from the poms only: reporting never builds the project
+    module_poms = parse_root_pom(put_path)
+    target_class_paths = find_target_class_paths(module_poms, build_dir)
     if len(target_class_paths) == 0:
         logging.error(f"Found no target dirs!")
 
@@ -71,6 +90,14 @@ def single_method_report(method_experiment_root, collection: Collection, put_pat
     if target_src_root is None:
         logging.warning(f"Found no target src root for {method_experiment_root}")
 
+    # merge in python first, jacococli then reads a single file
+    merged_exec = os.path.join(output_root, "merged.exec")
+    try:
+        merge_exec_files(exec_paths, merged_exec)
+        exec_paths = [merged_exec]
+    except (OSError, ExecFormatError) as e:
+        logging.warning(f"Failed to merge exec files of {method_experiment_root}: {e}")
+
     report_order = ["java", "-jar", jacoco_cli_path, "report"] + exec_paths
     for path in target_class_paths:
         report_order += ['--classfiles', path]
@@ -81,6 +108,38 @@ def single_method_report(method_experiment_root, collection: Collection, put_pat
     return report.stderr.decode().strip() == ""
 
 
+def single_method_coverage(method_experiment_root, collection: Collection, put_path) -> Optional[Dict]:
+    """
+    Same result as single_method_report + single_method_analyse, but computed by the resident coverage analyzer
+    (see utils/daemon.py) without writing the html report. Use single_method_report if the missing lines are needed
+    :param method_experiment_root:
+    :param collection
+    :param put_path: root dir for the target PUT
+    :return: None if the analyzer is not available
+    """
+    raw_info = collection.find_one({"table_name": "raw_data"})
+    assert raw_info is not None
+    signature = raw_info['parameters']
+    package = raw_info['package'].replace("package ", "").replace(";", "")
+    class_name = raw_info['class_name']
+
+    exec_paths = collect_exec_paths(method_experiment_root)
+    coverage_result = None
+    if len(exec_paths) > 0:
+        try:
+            build_dir = ':'.join(find_target_class_paths(parse_root_pom(put_path)))
+            coverage_result = method_coverage_in_server(build_dir, exec_paths, package, class_name, signature,
+                                                        timeout=TIMEOUT)
+        except (DaemonError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Coverage server failed for {method_experiment_root}: {e}")
+            return None
+
+    if coverage_result is None:
+        return {".".join([package, class_name, signature]): {'inst_cov': '0%', 'bran_cov': '0%'}}
+    else:
+        return {".".join([package, class_name, signature]): coverage_result}
+
+
 def single_method_analyse(log_dir, collection: Collection) -> Optional[Dict]:
     # analyse the report
     assert os.path.exists(log_dir)
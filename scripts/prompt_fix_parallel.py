@@ -9,7 +9,7 @@ from pymongo import MongoClient
 from tqdm import tqdm
 
 from generator import open_generator
-from generator.openlimit import ChatRateLimiter
+from generator.openlimit import KeyPool
 from procedures import fix_code
 from utils.config import *
 
@@ -23,6 +23,10 @@ def main():
     parser.add_argument("--perform_cleaning", action='store_true')
     parser.add_argument("--fixing", action='store_true')
     parser.add_argument("--wo_slice", action='store_true')
+    parser.add_argument("--speculative_k", type=int, default=SPECULATIVE_REPAIR_K,
+                        help="repair candidates tested concurrently per trial")
+    parser.add_argument("--repair_budget", type=int, default=REPAIR_BUDGET,
+                        help="the maximal repair candidates tested per failing test")
     args = parser.parse_args()
     project_name = args.project_name
 
@@ -72,6 +76,7 @@ def main():
             return _code_fixer.init_test(_log_dir, meta_info['put_path'], db.get_collection(_method_to_test),
                                          fixing=args.fixing)
 
+        # methods are set up and compiled here, their test cases run on the project-wide test pool
         with ThreadPoolExecutor(max_workers=8) as pool:
             init_test_records: Dict[str, Future] = {}
             for method_to_test in meta_info['method_name_to_idx']:
@@ -95,7 +100,7 @@ def main():
                 tasks.append((method_to_test, log_dir, failed_case))
             fixed_result[method_to_test] = {'to_fix': len(failed_test_list), "fixed": 0}
 
-        monitor = ChatRateLimiter(9000, 900000, 60)
+        monitor = KeyPool(api_keys, 9000, 900000, 60)  # limits of each key
 
         def slice_concurrent_fix(_method_to_test, _log_dir, _failed_case):
             if not args.fixing:
@@ -104,13 +109,16 @@ def main():
                 _code_fixer = fix_code.TestFixer(prompt_root, "system_repair.jinja2", "repair_patch.jinja2")
             _chatter = open_generator.OpenGenerator(key=api_keys,
                                                     request_url=model_url,
-                                                    model='gpt-3.5-turbo-0125', monitor=monitor)
+                                                    model='gpt-3.5-turbo-0125', monitor=monitor,
+                                                    tag=_method_to_test)
             try:
                 _fix_result = _code_fixer.single_unitest_fix(_log_dir,
                                                              db.get_collection(_method_to_test),
                                                              _failed_case,
                                                              meta_info['put_path'],
-                                                             _chatter)
+                                                             _chatter,
+                                                             speculative_k=args.speculative_k,
+                                                             repair_budget=args.repair_budget)
             except RuntimeError as e:
                 print(e, "error catch")
                 _fix_result = False
@@ -7,7 +7,7 @@ from pymongo import MongoClient
 from concurrent.futures import Future
 from typing import List
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from generator.openlimit import ChatRateLimiter
+from generator.openlimit import KeyPool
 from tqdm import tqdm
 
 from procedures import get_code
@@ -42,7 +42,7 @@ def main():
     print(f"Counting {len(meta_info['idx_to_method_name'])} methods to test")
 
     # define thread
-    monitor = ChatRateLimiter(10000, 900000, 60)
+    monitor = KeyPool(api_keys, 10000, 900000, 60)  # limits of each key
     if args.wo_slice:
         prompt_root = 'prompts/no_slice'
         method_workspaces_prefix = 'methods_no_slice'
@@ -60,7 +60,7 @@ def main():
                                                          "system_gen.jinja2",
                                                          "gen_code.jinja2")
         _chatter = open_generator.OpenGenerator(key=api_keys, request_url=model_url,
-            model='gpt-3.5-turbo-0125', monitor=monitor)
+            model='gpt-3.5-turbo-0125', monitor=monitor, tag=_method_to_test)
         _log_dir = os.path.join(playground_dir, project_name, method_workspaces_prefix,
                                 meta_info['method_name_to_idx'][_method_to_test])
         if args.fixing and not os.path.exists(os.path.join(_log_dir.__str__(), 'slice_fixing', 'slice_result.jsonl')):
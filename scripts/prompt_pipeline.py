@@ -0,0 +1,214 @@
+import argparse
+import glob
+import json
+import queue
+import threading
+import traceback
+from collections import Counter
+from typing import Callable, Iterable, Optional
+
+from pymongo import MongoClient
+from tqdm import tqdm
+
+from generator import open_generator
+from generator.openlimit import KeyPool
+from procedures import fix_code, get_code, get_slices
+from utils.config import *
+
+print(f"Please check the working dir {os.getcwd()}. For stability, sys.path will not be modified")
+
+_STOP = object()
+
+
+class Stage:
+    """
+    A pool of worker threads consuming a bounded queue. Each item is passed to work, which returns the items for
+    the next stage. Putting into a full queue blocks, so a slow stage holds back the stages before it.
+    """
+
+    def __init__(self, name, work: Callable[[object], Iterable], workers, queue_size, next_stage: Optional["Stage"]):
+        self.name = name
+        self.work = work
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_stage = next_stage
+        self.counter = Counter()
+        self._counter_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                outputs = list(self.work(item))
+            except Exception:
+                print(f"[{self.name}] failed on {item}")
+                traceback.print_exc()
+                with self._counter_lock:
+                    self.counter['error'] += 1
+                continue
+            with self._counter_lock:
+                self.counter['done'] += 1
+            if self.next_stage is not None:
+                for output in outputs:
+                    self.next_stage.put(output)
+
+    def join(self):
+        """
+        Wait for all queued items, then stop the workers. Call it only after the previous stage has been joined
+        """
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run slice -> init generation -> init test -> fix for every method "
+                                                 "of a project, each method moving on as soon as its step is done")
+    parser.add_argument("--project_name", required=True)
+    parser.add_argument("--fixing", action='store_true',
+                        help="generate and fix tests for the missing lines in slice_fixing, no slicing")
+    parser.add_argument("--wo_slice", action='store_true',
+                        help="generate as many tests as the sliced run without slices, no slicing")
+    parser.add_argument("--model", default='gpt-3.5-turbo-0125')
+    parser.add_argument("--slice_workers", type=int, default=8)
+    parser.add_argument("--gen_workers", type=int, default=16)
+    parser.add_argument("--test_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--fix_workers", type=int, default=12)
+    parser.add_argument("--queue_size", type=int, default=32, help="capacity of the queue in front of each stage")
+    parser.add_argument("--speculative_k", type=int, default=SPECULATIVE_REPAIR_K,
+                        help="repair candidates tested concurrently per trial")
+    parser.add_argument("--repair_budget", type=int, default=REPAIR_BUDGET,
+                        help="the maximal repair candidates tested per failing test")
+    args = parser.parse_args()
+    project_name = args.project_name
+
+    # setup db
+    client = MongoClient(mongo_url, mongo_port)
+    db = client[project_name]
+    print(f"Mongo url: {mongo_url}:{mongo_port}")
+    print(f"Playground dir: {os.path.join(playground_dir, project_name)}")
+    print(f"fixing? {args.fixing}")
+    print(f"wo_slice? {args.wo_slice}")
+
+    # load meta info
+    with open(os.path.join(playground_dir, project_name, "meta.json"), "r") as file:
+        meta_info = json.load(file)
+    print(f"Counting {len(meta_info['idx_to_method_name'])} methods to test")
+
+    if args.wo_slice:
+        prompt_root = 'prompts/no_slice'
+        method_workspaces_prefix = 'methods_no_slice'
+    else:
+        prompt_root = 'prompts/no_mock'
+        method_workspaces_prefix = 'methods'
+    # the slices are made for the sliced run only, the other runs start from its workspaces
+    slicing = not args.fixing and not args.wo_slice
+    gen_template = "gen_patch.jinja2" if args.fixing else "gen_code.jinja2"
+    repair_template = "repair_patch.jinja2" if args.fixing else "repair.jinja2"
+    monitor = KeyPool(api_keys, 9000, 900000, 60)  # shared by all stages, limits of each key
+    fixed_result = dict({})
+    fixed_lock = threading.Lock()
+
+    def _log_dir(_method_to_test, _prefix=None):
+        return os.path.join(playground_dir, project_name, method_workspaces_prefix if _prefix is None else _prefix,
+                            meta_info['method_name_to_idx'][_method_to_test])
+
+    def _chatter(_method_to_test):
+        return open_generator.OpenGenerator(key=api_keys, request_url=model_url, model=args.model,
+                                            monitor=monitor, tag=_method_to_test)
+
+    def slice_generation(_method_to_test):
+        _slicer = get_slices.SliceInfoGenerator(prompt_root, "system_gen.jinja2", "gen_slice.jinja2")
+        os.makedirs(_log_dir(_method_to_test), exist_ok=True)
+        _result = _slicer.work(_log_dir(_method_to_test), db.get_collection(_method_to_test), _chatter(_method_to_test))
+        if _result is None:
+            return []
+        return [_method_to_test]
+
+    def init_generation(_method_to_test):
+        _code_getter = get_code.InitialCodeGenerator(prompt_root, "system_gen.jinja2", gen_template)
+        if args.fixing:
+            if not os.path.exists(os.path.join(_log_dir(_method_to_test), 'slice_fixing', 'slice_result.jsonl')):
+                return []
+            _code_getter.work(db.get_collection(_method_to_test), _chatter(_method_to_test),
+                              _log_dir(_method_to_test), fixing=True)
+            _code_dir = 'slice_fixing'
+        elif args.wo_slice:
+            # as many test cases as the sliced run generated
+            _test_case_cnt = len(glob.glob(os.path.join(_log_dir(_method_to_test, 'methods'), 'steps', "*.java")))
+            if _test_case_cnt == 0:
+                return []
+            _code_getter.work(db.get_collection(_method_to_test), _chatter(_method_to_test),
+                              _log_dir(_method_to_test), fix_num=_test_case_cnt)
+            _code_dir = 'steps'
+        else:
+            _code_getter.work(db.get_collection(_method_to_test), _chatter(_method_to_test), _log_dir(_method_to_test))
+            _code_dir = 'steps'
+        if not os.path.exists(os.path.join(_log_dir(_method_to_test), _code_dir)):
+            return []
+        return [_method_to_test]
+
+    def init_test(_method_to_test):
+        _code_fixer = fix_code.TestFixer(prompt_root, "system_repair.jinja2", repair_template)
+        _failed_cases = _code_fixer.init_test(_log_dir(_method_to_test), meta_info['put_path'],
+                                              db.get_collection(_method_to_test), fixing=args.fixing)
+        if args.fixing:
+            _failed_cases = [_failed_case for _failed_case in _failed_cases if 'Fix' in _failed_case]
+        with fixed_lock:
+            fixed_result[_method_to_test] = {'to_fix': len(_failed_cases), "fixed": 0}
+        return [(_method_to_test, _failed_case) for _failed_case in _failed_cases]
+
+    def single_fix(_task):
+        _method_to_test, _failed_case = _task
+        _code_fixer = fix_code.TestFixer(prompt_root, "system_repair.jinja2", repair_template)
+        try:
+            _fix_result = _code_fixer.single_unitest_fix(_log_dir(_method_to_test), db.get_collection(_method_to_test),
+                                                         _failed_case, meta_info['put_path'], _chatter(_method_to_test),
+                                                         speculative_k=args.speculative_k,
+                                                         repair_budget=args.repair_budget)
+        except RuntimeError as e:
+            print(e, "error catch")
+            _fix_result = False
+        with fixed_lock:
+            fixed_result[_method_to_test]['fixed'] += _fix_result
+        return []
+
+    fix_stage = Stage("fix", single_fix, args.fix_workers, args.queue_size, None)
+    test_stage = Stage("init_test", init_test, args.test_workers, args.queue_size, fix_stage)
+    gen_stage = Stage("init_gen", init_generation, args.gen_workers, args.queue_size, test_stage)
+    stages = [gen_stage, test_stage, fix_stage]
+    if slicing:
+        stages.insert(0, Stage("slice", slice_generation, args.slice_workers, args.queue_size, gen_stage))
+    for stage in stages:
+        stage.start()
+
+    for method_to_test in tqdm(meta_info['method_name_to_idx'], desc="submitted"):
+        stages[0].put(method_to_test)
+    # upstream first, so no stage is stopped while its predecessor can still feed it
+    for stage in stages:
+        stage.join()
+        print(f"Stage {stage.name} finished: {dict(stage.counter)}")
+
+    for method_to_test in fixed_result:
+        print(f"For {method_to_test}: {fixed_result[method_to_test]['fixed']}/{fixed_result[method_to_test]['to_fix']}")
+    usage = monitor.ledger.summary()
+    print(f"Token usage: {sum(entry['prompt_tokens'] + entry['completion_tokens'] for entry in usage.values())}")
+    with open(os.path.join(playground_dir, project_name, "token_usage.json"), "w") as file:
+        json.dump({str(tag): entry for tag, entry in usage.items()}, file, indent=2)
+    # starvation shows up as a large max_wait of a class
+    for priority, metrics in monitor.gate.metrics().items():
+        print(f"Queue wait of {priority}: {metrics}")
+
+
+if __name__ == "__main__":
+    main()
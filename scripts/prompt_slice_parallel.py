@@ -4,7 +4,7 @@ from pymongo import MongoClient
 from concurrent.futures import Future
 from typing import List
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from generator.openlimit import ChatRateLimiter
+from generator.openlimit import KeyPool
 from tqdm import tqdm
 
 from procedures import get_slices
@@ -32,7 +32,7 @@ def main():
     print(f"Counting {len(meta_info['idx_to_method_name'])} methods to test")
 
     # define thread
-    monitor = ChatRateLimiter(request_limit=9000, token_limit=900000, bucket_size_in_seconds=60)
+    monitor = KeyPool(api_keys, request_limit=9000, token_limit=900000, bucket_size_in_seconds=60)
 
     def thread_slice_generation(_method_to_test):
         _slicer = get_slices.SliceInfoGenerator("prompts/no_mock",
@@ -40,7 +40,8 @@ def main():
                                                 "gen_slice.jinja2")
         _chatter = open_generator.OpenGenerator(key=api_keys, request_url=model_url,
                                                 model='gpt-3.5-turbo-0125',
-                                                monitor=monitor)  # share the monitor. Since multi-thread has GIL lock
+                                                monitor=monitor,  # share the monitor. Since multi-thread has GIL lock
+                                                tag=_method_to_test)
         _log_dir = os.path.join(playground_dir, project_name, "methods",
                                 meta_info['method_name_to_idx'][_method_to_test])
         os.makedirs(_log_dir, exist_ok=True)
@@ -0,0 +1,328 @@
+"""
+A local stand-in for the OpenAI chat completions API, to measure the throughput of the scripts without quota or
+network. Point model_url in config.ini to http://127.0.0.1:{port}/v1/chat/completions.
+
+Responses are, in order of preference:
+1. replayed: the recorded response of the same prompt in a playground (fixing/**/temp/generate_prompt.txt +
+   response.txt, steps/*.prompt.txt + *.response.txt)
+2. replayed: a recorded response of the same kind of request (slice, init generation or repair)
+3. synthesized: a slice JSON or a trivial JUnit 5 test of the expected class
+
+Latency, throttling and x-ratelimit-* headers are simulated, see the arguments.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+SLICE = "slice"
+INIT_GEN = "init_gen"
+REPAIR = "repair"
+
+
+def prompt_hash(prompt: str):
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()
+
+
+def request_kind(prompt: str):
+    if '"invoked_outside_vars"' in prompt:
+        return SLICE
+    if "# Unit Test to Fix" in prompt:
+        return REPAIR
+    return INIT_GEN
+
+
+def format_duration(seconds: float):
+    """
+    In the style of OpenAI's reset headers, e.g. '20ms', '1.5s', '6m0s'
+    """
+    if seconds < 1:
+        return f"{int(seconds * 1000)}ms"
+    if seconds < 60:
+        return f"{seconds:.3g}s"
+    return f"{int(seconds // 60)}m{int(seconds % 60)}s"
+
+
+class ReplayIndex:
+    """
+    Recorded responses of a playground, by prompt and by kind of request
+    """
+
+    def __init__(self):
+        self.by_prompt: Dict[str, str] = dict({})
+        self.by_kind: Dict[str, List[str]] = {SLICE: [], INIT_GEN: [], REPAIR: []}
+
+    def _read(self, path) -> Optional[str]:
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return file.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def load(self, playground):
+        for path in glob.glob(os.path.join(playground, "**", "slice_response.txt"), recursive=True):
+            response = self._read(path)
+            if response:
+                self.by_kind[SLICE].append(response)
+        for path in glob.glob(os.path.join(playground, "**", "fixing", "*", "*", "temp", "response.txt"),
+                              recursive=True):
+            response = self._read(path)
+            prompt = self._read(os.path.join(os.path.dirname(path), "generate_prompt.txt"))
+            if response and "```" in response:
+                self.by_kind[REPAIR].append(response)
+                if prompt:
+                    self.by_prompt[prompt_hash(prompt)] = response
+        for path in glob.glob(os.path.join(playground, "**", "*.prompt.txt"), recursive=True):
+            # {class}_{step}_{condition}_Test.prompt.txt belongs to {class}_{step}.response.txt
+            name = os.path.basename(path)[:-len(".prompt.txt")]
+            match = re.match(r"(.+)_[^_]+_Test$", name)
+            if match is None:
+                continue
+            response = self._read(os.path.join(os.path.dirname(path), f"{match.group(1)}.response.txt"))
+            prompt = self._read(path)
+            if response and prompt:
+                self.by_prompt[prompt_hash(prompt)] = response
+        for path in glob.glob(os.path.join(playground, "**", "*.response.txt"), recursive=True):
+            response = self._read(path)
+            if response:
+                self.by_kind[INIT_GEN].append(response)
+
+    def __len__(self):
+        return len(self.by_prompt) + sum(len(responses) for responses in self.by_kind.values())
+
+
+def synthesize(kind, prompt, slices, test_methods):
+    if kind == SLICE:
+        steps = [{"desp": f"Slice {i}: a branch of the focal method", "code": ""} for i in range(slices)]
+        return "```json\n" + json.dumps({"summarization": "A stub summarization.",
+                                         "invoked_outside_vars": [],
+                                         "invoked_outside_methods": [],
+                                         "steps": steps}, indent=4) + "\n```"
+    package = re.search(r"^\s*(?:\d+:\s*)?package\s+([\w.]+)\s*;", prompt, re.MULTILINE)
+    if kind == REPAIR:
+        # the fixed test must keep the name of the test to fix
+        cls_name = re.search(r"public\s+class\s+(\w+)", prompt)
+        cls_name = cls_name.group(1) if cls_name is not None else "StubTest"
+    else:
+        focal_class = re.search(r"focal class `(\w+)`", prompt)
+        cls_name = f"{focal_class.group(1)}_Test" if focal_class is not None else "StubTest"
+    methods = "\n".join(f"    @Test\n    public void test{i}() {{\n        assertTrue(true);\n    }}\n"
+                        for i in range(test_methods))
+    code = (f"package {package.group(1)};\n\n" if package is not None else "") + \
+        "import org.junit.jupiter.api.Test;\n" \
+        "import static org.junit.jupiter.api.Assertions.*;\n\n" \
+        f"public class {cls_name} {{\n{methods}}}\n"
+    return f"```java\n{code}```"
+
+
+class SlidingWindow:
+    """
+    Amounts used in the last 60 seconds
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.events = deque()
+        self.used = 0
+
+    def _expire(self, now):
+        while self.events and self.events[0][0] <= now - 60:
+            self.used -= self.events.popleft()[1]
+
+    def remaining(self, now):
+        self._expire(now)
+        return max(0, self.limit - self.used)
+
+    def reset(self, now):
+        """
+        Seconds until the window is empty again
+        """
+        self._expire(now)
+        return max(0.0, self.events[-1][0] + 60 - now) if self.events else 0.0
+
+    def retry_after(self, now, amount):
+        """
+        Seconds until amount fits in the window
+        """
+        self._expire(now)
+        free = self.limit - self.used
+        if free >= amount:
+            return 0.0
+        for timestamp, used in self.events:
+            free += used
+            if free >= amount:
+                return max(0.0, timestamp + 60 - now)
+        return 60.0
+
+    def add(self, now, amount):
+        self.events.append((now, amount))
+        self.used += amount
+
+
+class StubState:
+    def __init__(self, args, index: ReplayIndex):
+        self.args = args
+        self.index = index
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.requests = SlidingWindow(args.rpm)
+        self.tokens = SlidingWindow(args.tpm)
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "replayed": 0, "synthesized": 0}
+
+    def respond(self, body: Dict):
+        """
+        :return: status code, headers, json body and the latency to simulate
+        """
+        messages = body.get("messages", [])
+        prompt = messages[-1]["content"] if len(messages) > 0 else ""
+        n = body.get("n", 1) or 1
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4 + 1
+        kind = request_kind(prompt)
+
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.time()
+            # reserve like the server does, n * max_tokens on top of the prompt
+            reserved = prompt_tokens + n * body.get("max_tokens", 1024)
+            throttled = self.requests.remaining(now) < 1 or self.tokens.remaining(now) < reserved
+            if throttled or self.random.random() < self.args.rate_429:
+                self.stats["throttled"] += 1
+                retry_after = max(self.requests.retry_after(now, 1), self.tokens.retry_after(now, reserved))
+                if not throttled:
+                    retry_after = self.random.uniform(0.5, 2)
+                headers = self._headers(now)
+                headers["retry-after"] = f"{max(1, math.ceil(retry_after))}"
+                headers["retry-after-ms"] = f"{int(retry_after * 1000)}"
+                return 429, headers, {"error": {"message": "Rate limit reached for requests (stub)",
+                                                "type": "requests", "code": "rate_limit_exceeded"}}, 0.0
+            if self.random.random() < self.args.error_rate:
+                self.stats["errors"] += 1
+                return 500, self._headers(now), {"error": {"message": "The server had an error (stub)",
+                                                           "type": "server_error"}}, 0.0
+
+            contents = list([])
+            for i in range(n):
+                content = self.index.by_prompt.get(prompt_hash(prompt))
+                if content is None and kind != REPAIR and len(self.index.by_kind[kind]) > 0:
+                    # the same prompt gets the same answer, like at temperature 0
+                    pool = self.index.by_kind[kind]
+                    content = pool[(int(prompt_hash(prompt), 16) + i) % len(pool)]
+                if content is None:
+                    content = synthesize(kind, prompt, self.args.slices, self.args.test_methods)
+                    self.stats["synthesized"] += 1
+                else:
+                    self.stats["replayed"] += 1
+                contents.append(content)
+            completion_tokens = sum(len(content) for content in contents) // 4 + 1
+            self.requests.add(now, 1)
+            self.tokens.add(now, prompt_tokens + completion_tokens)
+            headers = self._headers(now)
+            latency = self.random.lognormvariate(math.log(self.args.latency_median), self.args.latency_sigma) + \
+                completion_tokens * self.args.ms_per_token / 1000
+
+        return 200, headers, {
+            "id": f"chatcmpl-stub-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                        for i, content in enumerate(contents)],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, latency
+
+    def _headers(self, now):
+        return {
+            "x-ratelimit-limit-requests": str(self.requests.limit),
+            "x-ratelimit-limit-tokens": str(self.tokens.limit),
+            "x-ratelimit-remaining-requests": str(self.requests.remaining(now)),
+            "x-ratelimit-remaining-tokens": str(self.tokens.remaining(now)),
+            "x-ratelimit-reset-requests": format_duration(self.requests.reset(now)),
+            "x-ratelimit-reset-tokens": format_duration(self.tokens.reset(now)),
+        }
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                self._send(400, {}, {"error": {"message": "Invalid json", "type": "invalid_request_error"}})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {}, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request"}})
+                return
+            status, headers, payload, latency = state.respond(body)
+            time.sleep(latency)
+            self._send(status, headers, payload)
+
+        def _send(self, status, headers, payload):
+            content = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            if state.args.verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--replay", action="append", default=[],
+                        help="playground dir with recorded responses to replay. Repeatable")
+    parser.add_argument("--latency_median", type=float, default=2.0, help="median latency in seconds")
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="sigma of the log-normal latency")
+    parser.add_argument("--ms_per_token", type=float, default=0.0, help="extra latency per completion token")
+    parser.add_argument("--rpm", type=int, default=5000, help="simulated requests per minute")
+    parser.add_argument("--tpm", type=int, default=160000, help="simulated tokens per minute")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="probability of a spurious 429")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="probability of a 500")
+    parser.add_argument("--slices", type=int, default=2, help="steps of a synthesized slice")
+    parser.add_argument("--test_methods", type=int, default=2, help="test methods of a synthesized test")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    index = ReplayIndex()
+    for playground in args.replay:
+        index.load(playground)
+    print(f"Loaded {len(index.by_prompt)} prompts and "
+          f"{ {kind: len(responses) for kind, responses in index.by_kind.items()} } responses to replay")
+
+    state = StubState(args, index)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Serving on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stats: {state.stats}")
+
+
+if __name__ == "__main__":
+    main()
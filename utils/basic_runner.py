@@ -1,8 +1,14 @@
 import glob
 import logging
-import subprocess
+import threading
+from typing import Dict, Tuple
 
 from utils.config import *
+from utils.project_context import has_made, make_project
+
+_layouts: Dict[str, Tuple[str, str]] = dict({})
+_layouts_lock = threading.Lock()
+_build_locks: Dict[str, threading.Lock] = dict({})
 
 
 class BasicRunner:
@@ -15,25 +21,25 @@ class BasicRunner:
         :param output_path: dir of all output resources. Used only in test all
         """
         self.target_path = target_path
-
-        # Preprocess
-        self.dependencies = self.make_dependency()  # paths of dependent jars of the project-under-test: 'a.jar:b.jar'
         self.build_dir_name = "target/classes"
-        self.build_dir = self.process_single_repo()  # {target_dir}/target/classes
 
-        self.logger = logging.getLogger('slice_runner')
+        # Preprocess, once per project in the process. Unlike TestRunner's ProjectContext, the slicer sees the root
+        # dependencies and the direct submodules only, and the project is installed. The build only blocks the
+        # runners of the same project
+        with _layouts_lock:
+            layout = _layouts.get(target_path)
+            build_lock = _build_locks.setdefault(target_path, threading.Lock())
+        if layout is None:
+            with build_lock:
+                layout = _layouts.get(target_path)
+                if layout is None:
+                    layout = (self.make_dependency(), self.process_single_repo())
+                    with _layouts_lock:
+                        _layouts[target_path] = layout
+        # paths of dependent jars of the project-under-test: 'a.jar:b.jar', and {target_dir}/target/classes
+        self.dependencies, self.build_dir = layout
 
-    def process_single_repo(self):
-        """
-        Return the all build directories of target repository
-        """
-        if self.has_submodule(self.target_path):
-            modules = self.get_submodule(self.target_path)
-            postfixed_modules = [f'{self.target_path}/{module}/{self.build_dir_name}' for module in modules]
-            build_dir = ':'.join(postfixed_modules)
-        else:
-            build_dir = os.path.join(self.target_path, self.build_dir_name)
-        return build_dir
+        self.logger = logging.getLogger('slice_runner')
 
     @staticmethod
     def get_package(test_file):
@@ -85,34 +91,24 @@ class BasicRunner:
         else:
             return test_case
 
-    def make_dependency(self):
+    def process_single_repo(self):
         """
-        Generate runtime dependencies of a given project
+        Return the all build directories of target repository
         """
-        mvn_dependency_dir = 'target/dependency'
-        deps = []
-        if not self.has_made():
-            # Run mvn command to generate dependencies
-            # print("Making dependency for project", self.target_path)
-            subprocess.run(
-                f"mvn dependency:copy-dependencies -DoutputDirectory={mvn_dependency_dir} -f {self.target_path}/pom.xml",
-                shell=True,
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            subprocess.run(f"mvn install -DskipTests -f {self.target_path}/pom.xml", shell=True,
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        dep_jars = glob.glob(self.target_path + "/target/dependency/**/*.jar", recursive=True)
-        deps.extend(dep_jars)
-        deps = list(set(deps))
-        return ':'.join(deps)
+        if self.has_submodule(self.target_path):
+            modules = self.get_submodule(self.target_path)
+            postfixed_modules = [f'{self.target_path}/{module}/{self.build_dir_name}' for module in modules]
+            build_dir = ':'.join(postfixed_modules)
+        else:
+            build_dir = os.path.join(self.target_path, self.build_dir_name)
+        return build_dir
 
-    def has_made(self):
+    def make_dependency(self):
         """
-        If the project has made before
+        Generate runtime dependencies of a given project
         """
-        for dirpath, dirnames, filenames in os.walk(self.target_path):
-            if 'pom.xml' in filenames and 'target' in dirnames:
-                target = os.path.join(dirpath, 'target')
-                if 'dependency' in os.listdir(target):
-                    return True
-        return False
+        if not has_made(self.target_path):
+            # install, sibling modules are resolved from the local repository
+            make_project(self.target_path, goal="install")
+        dep_jars = glob.glob(self.target_path + "/target/dependency/**/*.jar", recursive=True)
+        return ':'.join(set(dep_jars))
@@ -102,6 +102,10 @@ def remove_assertion(source_code: str) -> str:
     return "\n".join(lines)
 
 
+TYPE_DECLARATIONS = ('class_declaration', 'interface_declaration', 'enum_declaration', 'record_declaration',
+                     'annotation_type_declaration')
+
+
 class CodeEditor:
     def __init__(self):
         self.parser = Parser()
@@ -211,3 +215,21 @@ class CodeEditor:
                         bias += end_idx - start_idx
                 refactored_code.append(new_bytes_content.decode('utf8'))
             return refactored_code
+
+    def top_level_types(self, content: str) -> List[str]:
+        """
+        Find the names of the types declared at the top level of a CU, i.e., the public class and the helper
+        classes next to it, each compiled to a class file of its own
+        :param content:
+        :return:
+        """
+        bytes_content = bytes(content, "utf8")
+        tree = self.parser.parse(bytes_content)
+        names = list([])
+        for node in tree.root_node.children:
+            if node.type not in TYPE_DECLARATIONS:
+                continue
+            identifier_node = node.child_by_field_name('name')
+            if identifier_node is not None:
+                names.append(bytes_content[identifier_node.start_byte:identifier_node.end_byte].decode('utf8'))
+        return names
@@ -42,8 +42,21 @@ MOCKITO_JAR = transform_path(config.get("DEFAULT", "MOCKITO_JAR"))
 LOG4J_JAR = transform_path(config.get("DEFAULT", "LOG4J_JAR"))
 JACOCO_AGENT = transform_path(config.get("DEFAULT", "JACOCO_AGENT"))
 JACOCO_CLI = transform_path(config.get("DEFAULT", "JACOCO_CLI"))
+JACOCO_ANT = transform_path(config.get("DEFAULT", "JACOCO_ANT", fallback="./dependencies/lib/jacocoant.jar"))
 FORMATTER_PATH = transform_path(config.get("DEFAULT", "FORMATTER"))
 REPORT_FORMAT = config.get("DEFAULT", "REPORT_FORMAT")
+HELPER_DIR = transform_path(config.get("DEFAULT", "HELPER_DIR", fallback="./dependencies/helpers"))
+USE_TEST_DAEMON = eval(config.get("DEFAULT", "USE_TEST_DAEMON", fallback="False"))
+USE_COMPILE_SERVER = eval(config.get("DEFAULT", "USE_COMPILE_SERVER", fallback="False"))
+COMPILE_TIMEOUT = eval(config.get("DEFAULT", "COMPILE_TIMEOUT", fallback="120"))
+USE_COVERAGE_SERVER = eval(config.get("DEFAULT", "USE_COVERAGE_SERVER", fallback="False"))
+USE_BATCH_LAUNCH = eval(config.get("DEFAULT", "USE_BATCH_LAUNCH", fallback="False"))
+SPECULATIVE_REPAIR_K = eval(config.get("DEFAULT", "SPECULATIVE_REPAIR_K", fallback="1"))  # candidates per repair round
+REPAIR_BUDGET = eval(config.get("DEFAULT", "REPAIR_BUDGET", fallback="10"))  # candidates tested per failing test
+# concurrent processes of AsyncTestRunner, 0 for bounds by the core count and JVM_MEMORY_MB
+MAX_JVMS = eval(config.get("DEFAULT", "MAX_JVMS", fallback="0"))
+MAX_JAVACS = eval(config.get("DEFAULT", "MAX_JAVACS", fallback="0"))
+JVM_MEMORY_MB = eval(config.get("DEFAULT", "JVM_MEMORY_MB", fallback="1024"))  # memory assumed per JVM or javac
 
 playground_dir = transform_path(config.get("DEFAULT", "playground"))
 
@@ -54,6 +67,16 @@ temperature = eval(config.get("openai", "temperature"))
 top_p = eval(config.get("openai", "top_p"))
 frequency_penalty = eval(config.get("openai", "frequency_penalty"))
 presence_penalty = eval(config.get("openai", "presence_penalty"))
+http_pool_size = eval(config.get("openai", "http_pool_size", fallback="32"))
+http_max_retries = eval(config.get("openai", "http_max_retries", fallback="3"))
+http_connect_timeout = eval(config.get("openai", "http_connect_timeout", fallback="10"))
+response_cache_mode = config.get("openai", "response_cache_mode", fallback="bypass")  # read_through/write_only/bypass
+response_cache_dir = transform_path(config.get("openai", "response_cache_dir", fallback="./response_cache"))
+response_cache_max_mb = eval(config.get("openai", "response_cache_max_mb", fallback="1024"))
+result_flush_every = eval(config.get("openai", "result_flush_every", fallback="64"))
+result_flush_interval = eval(config.get("openai", "result_flush_interval", fallback="1.0"))
+result_fsync = eval(config.get("openai", "result_fsync", fallback="False"))
+generation_candidates = eval(config.get("openai", "generation_candidates", fallback="1"))  # choices per request
 
 mongo_url = config.get("mongo", "mongo_url")
 mongo_port = eval(config.get("mongo", "mongo_port"))
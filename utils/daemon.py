@@ -0,0 +1,309 @@
+import glob
+import hashlib
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.config import *
+from utils.report import MethodCoverageIndex, format_ratio
+
+READY_TIMEOUT = 60  # seconds a helper JVM may take to start up
+_build_lock = threading.Lock()
+_pools_lock = threading.Lock()
+_pools: Dict[str, "WorkerPool"] = dict({})
+
+
+class DaemonError(RuntimeError):
+    """
+    A helper JVM died or answered with an error. Callers should fall back to one JVM per call
+    """
+    pass
+
+
+def build_helpers():
+    """
+    Compile the java helpers in HELPER_DIR. The classes are put in a dir named by the hash of the sources, so the
+    helpers are compiled once and concurrent processes never see a half-compiled build
+    :return: the dir of the compiled helper classes
+    """
+    sources = sorted(glob.glob(os.path.join(HELPER_DIR, "*.java")))
+    digest = hashlib.sha1()
+    for source in sources:
+        with open(source, "rb") as file:
+            digest.update(file.read())
+    classes_dir = os.path.join(HELPER_DIR, "classes", digest.hexdigest()[:16])
+    with _build_lock:
+        if os.path.exists(classes_dir):
+            return classes_dir
+        os.makedirs(os.path.dirname(classes_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(classes_dir))
+        classpath = f"{JUNIT_JAR}:{JACOCO_AGENT}:{JACOCO_ANT}"
+        result = subprocess.run(["javac", "-d", tmp_dir, "-cp", classpath] + sources,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise DaemonError(f"Failed to compile helpers in {HELPER_DIR}:\n{result.stderr}")
+        try:
+            os.rename(tmp_dir, classes_dir)
+        except OSError:  # another process won the race
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return classes_dir
+
+
+class JavaWorker:
+    """
+    A helper JVM speaking a tab-separated line protocol over its stdin/stdout. It announces itself with 'READY',
+    answers every command with one line and replies 'ERROR\t<message>' on failure. One request at a time.
+    """
+
+    def __init__(self, cmd: List[str]):
+        self.cmd = cmd
+        self.version = None  # what the worker has loaded, e.g. the version of the class files, if it matters
+        try:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        except OSError as e:
+            raise DaemonError(f"Failed to start helper: {e}")
+        self._lines = queue.Queue()
+        threading.Thread(target=self._pump, daemon=True).start()
+        try:
+            reply = self._read(READY_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise DaemonError(f"Helper did not start in {READY_TIMEOUT}s")
+        if reply != "READY":
+            self.close()
+            raise DaemonError(f"Helper did not start: {reply}")
+
+    def _pump(self):
+        for line in self.process.stdout:
+            self._lines.put(line.rstrip("\n"))
+        self._lines.put(None)  # EOF, the process is gone
+
+    def _read(self, timeout):
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise subprocess.TimeoutExpired(self.cmd, timeout)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def request(self, fields: List[str], timeout=None) -> List[str]:
+        """
+        Send one command and wait for its answer.
+        :raise subprocess.TimeoutExpired: no answer within timeout. The worker is killed
+        :raise DaemonError: the worker is gone or reports an error
+        """
+        if not self.alive():
+            raise DaemonError("Helper is not running")
+        try:
+            self.process.stdin.write("\t".join(fields) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            self.close()
+            raise DaemonError(f"Failed to talk to helper: {e}")
+        return self.receive(timeout)
+
+    def receive(self, timeout=None) -> List[str]:
+        """
+        Wait for the next line of the worker, e.g. of a command answered with several lines.
+        :raise subprocess.TimeoutExpired: no line within timeout. The worker is killed
+        :raise DaemonError: the worker is gone or reports an error
+        """
+        line = self._read(timeout)
+        if line is None:
+            self.close()
+            raise DaemonError("Helper exited unexpectedly")
+        reply = line.split("\t")
+        if reply[0] == "ERROR":
+            raise DaemonError(reply[1] if len(reply) > 1 else "unknown error")
+        return reply
+
+    def close(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class WorkerPool:
+    """
+    Idle workers started by the same factory, shared by all threads of the process.
+    A worker is started whenever no idle one is available; at most max_idle are kept alive afterwards.
+    """
+
+    def __init__(self, factory: Callable[[], JavaWorker], max_idle=None):
+        self.factory = factory
+        self.max_idle = max_idle if max_idle is not None else os.cpu_count()
+        self._idle: List[JavaWorker] = list([])
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            worker = self._idle.pop() if len(self._idle) > 0 else None
+        if worker is None or not worker.alive():
+            worker = self.factory()
+        try:
+            yield worker
+        finally:
+            with self._lock:
+                keep = worker.alive() and len(self._idle) < self.max_idle
+                if keep:
+                    self._idle.append(worker)
+            if not keep:
+                worker.close()
+
+    def close(self):
+        with self._lock:
+            workers, self._idle = self._idle, list([])
+        for worker in workers:
+            worker.close()
+
+
+def get_pool(key: str, factory: Callable[[], JavaWorker]) -> WorkerPool:
+    """
+    Return the process-wide pool for key, creating it with factory on first use
+    """
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = WorkerPool(factory)
+        return _pools[key]
+
+
+def test_daemon_cmd():
+    classpath = f"{build_helpers()}:{JUNIT_JAR}:{MOCKITO_JAR}:{LOG4J_JAR}:{JACOCO_AGENT}"
+    return ["java", f"-javaagent:{JACOCO_AGENT}=output=none", "-cp", classpath, "TestDaemon"]
+
+
+def run_test_in_daemon(project_classpath, full_test_name, test_classpath, exec_file, output_file, timeout) -> int:
+    """
+    Run a test class in a warm JVM serving the project classpath. JaCoCo data is appended to exec_file,
+    stdout/stderr and the failure summary of the test go to output_file.
+    :param project_classpath: build dirs and dependencies of the project-under-test. One pool per value
+    :param full_test_name: e.g. org.example.Foo_0_0_Test
+    :param test_classpath: the classpath loaded for this test only
+    :return: the ConsoleLauncher-like exit code
+    """
+    pool = get_pool(f"test:{project_classpath}", lambda: JavaWorker(test_daemon_cmd()))
+    with pool.acquire() as worker:
+        reply = worker.request(["RUN", full_test_name, test_classpath, exec_file, output_file], timeout)
+    logging.debug(f"Daemon ran {full_test_name}: {reply}")
+    return int(reply[1])
+
+
+def multi_test_launcher_cmd(manifest_file):
+    classpath = f"{build_helpers()}:{JUNIT_JAR}:{MOCKITO_JAR}:{LOG4J_JAR}:{JACOCO_AGENT}"
+    return ["java", f"-javaagent:{JACOCO_AGENT}=output=none", "-cp", classpath, "MultiTestLauncher", manifest_file]
+
+
+def run_tests_in_one_launch(tests: List[Tuple[str, str, str, str]], manifest_file, timeout) \
+        -> Iterator[Tuple[int, Optional[int]]]:
+    """
+    Run test classes in one JVM and one JUnit launch. Like in run_test_in_daemon, every test class gets its own
+    class loader, its JaCoCo data appended to its exec file and its output in its output file.
+    :param tests: (full test name, test classpath, exec file, output file) of every test class
+    :param manifest_file: where the list of tests is put down for the launcher
+    :param timeout: seconds a test class may take
+    :return: yields (index in tests, None) when a test class starts and (index in tests, exit code) when it ends,
+    see run_test_in_daemon for the exit codes. The classes run in the order of JUnit
+    :raise subprocess.TimeoutExpired: a test class took longer than timeout. The JVM is killed
+    :raise DaemonError: the JVM failed
+    """
+    with open(manifest_file, "w") as file:
+        for test in tests:
+            file.write("\t".join(test) + "\n")
+    worker = JavaWorker(multi_test_launcher_cmd(manifest_file))
+    try:
+        while True:
+            reply = worker.receive(timeout)
+            if reply[0] == "END":
+                return
+            elif reply[0] == "START":
+                yield int(reply[1]), None
+            elif reply[0] == "DONE":
+                yield int(reply[1]), int(reply[2])
+            else:
+                raise DaemonError(f"Unexpected reply of the launcher: {reply[0]}")
+    finally:
+        worker.close()
+
+
+def compile_server_cmd():
+    return ["java", "-cp", build_helpers(), "CompileServer"]
+
+
+def compile_in_server(classpath, output_dir, diagnostics_file, source_files: List[str], timeout=None) -> int:
+    """
+    Compile source files with a resident javac. The diagnostics, in javac's command line format, go to
+    diagnostics_file.
+    :param classpath: the compile classpath. One pool per value, so the workers keep their opened jars
+    :return: the javac exit code
+    """
+    pool = get_pool(f"compile:{classpath}", lambda: JavaWorker(compile_server_cmd()))
+    with pool.acquire() as worker:
+        reply = worker.request(["COMPILE", classpath, output_dir, diagnostics_file] + list(source_files), timeout)
+    return int(reply[1])
+
+
+def coverage_server_cmd(build_dir):
+    return ["java", "-cp", f"{build_helpers()}:{JACOCO_ANT}", "CoverageServer"] + \
+        [path for path in build_dir.split(":") if path != ""]
+
+
+def class_files_version(build_dir) -> Tuple[int, int]:
+    """
+    Version of the class files in the build dirs: the newest mtime and the number of the class files. A class file
+    compiled in place does not change the mtime of the build dir, so every file is looked at
+    :param build_dir: 'a/target/classes:b/target/classes'
+    """
+    newest, count = -1, 0
+    for path in build_dir.split(":"):
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                if filename.endswith(".class"):
+                    newest = max(newest, os.stat(os.path.join(dirpath, filename)).st_mtime_ns)
+                    count += 1
+    return newest, count
+
+
+def method_coverage_in_server(build_dir, exec_files: List[str], package, class_name, signature,
+                              timeout=None) -> Optional[Dict[str, str]]:
+    """
+    Coverage of a method according to the merged exec files, computed by a resident analyzer that keeps the class
+    files of the project in memory. Same result as jacoco_analysis on a report of the exec files.
+    :param build_dir: the build dirs of the project-under-test, 'a/target/classes:b/target/classes'. One pool per value
+    :param exec_files: jacoco.exec files to merge
+    :param package: e.g. org.example
+    :param class_name: simple name of the class of the method
+    :param signature: the method signature, e.g. append(Object, int)
+    :param timeout: seconds the analyzer may take per command
+    :return: {"inst_cov": str, "bran_cov": str}, None if the method is not found
+    :raise subprocess.TimeoutExpired: the analyzer did not answer in time. It is killed
+    """
+    vm_name = f"{package.replace('.', '/')}/{class_name}" if package != "" else class_name
+    # a worker that loaded older class files, e.g. before the project was rebuilt, reloads them first
+    version = class_files_version(build_dir)
+    pool = get_pool(f"coverage:{build_dir}", lambda: JavaWorker(coverage_server_cmd(build_dir)))
+    with pool.acquire() as worker:
+        if worker.version is None:  # just started, it loaded the current class files
+            worker.version = version
+        elif worker.version != version:
+            worker.request(["RELOAD"], timeout)
+            worker.version = version
+        reply = worker.request(["COVER", ":".join(exec_files), vm_name], timeout)
+    index = MethodCoverageIndex(class_name)
+    for idx in range(1, len(reply) - 5, 6):
+        name, desc, inst_missed, inst_covered, bran_missed, bran_covered = reply[idx:idx + 6]
+        index.add(name, desc, {"inst_cov": format_ratio(int(inst_covered), int(inst_missed)),
+                               "bran_cov": format_ratio(int(bran_covered), int(bran_missed))})
+    coverage = index.find(signature)
+    if coverage is None:
+        logging.error(f"Failed to find cov information for {signature} in {vm_name}")
+    return coverage
@@ -0,0 +1,262 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+# block types and constants of the JaCoCo exec format, see org.jacoco.core.data.ExecutionDataWriter
+BLOCK_HEADER = 0x01
+BLOCK_SESSIONINFO = 0x10
+BLOCK_EXECUTIONDATA = 0x11
+MAGIC_NUMBER = 0xC0C0
+FORMAT_VERSION = 0x1007
+
+
+class ExecFormatError(ValueError):
+    """
+    The file is not a jacoco.exec file of a supported version
+    """
+    pass
+
+
+class SessionInfo(NamedTuple):
+    id: str
+    start: int  # epoch millis
+    dump: int
+
+
+class ClassProbes:
+    """
+    The probe array of one class. JaCoCo identifies a class by the CRC64 of its class file, so two versions of a
+    class have different ids
+    """
+
+    def __init__(self, class_id: int, name: str, probes: np.ndarray):
+        """
+        :param class_id: CRC64 of the class file
+        :param name: vm name of the class, e.g. org/example/Foo
+        :param probes: bool vector, one item per probe
+        """
+        self.id = class_id
+        self.name = name
+        self.probes = probes
+
+    def merge(self, other: "ClassProbes"):
+        if other.name != self.name or len(other.probes) != len(self.probes):
+            raise ExecFormatError(f"Incompatible execution data for class {self.name} with id {self.id:016x}")
+        np.logical_or(self.probes, other.probes, out=self.probes)
+
+    def covered(self):
+        return int(np.count_nonzero(self.probes))
+
+
+class _Reader:
+    """
+    Sequential reader over a buffer with the encodings of java.io.DataInput and JaCoCo's CompactDataInput
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos = 0
+
+    def byte(self):
+        value = self.buffer[self.pos]
+        self.pos += 1
+        return value
+
+    def char(self):
+        value, = struct.unpack_from(">H", self.buffer, self.pos)
+        self.pos += 2
+        return value
+
+    def long(self):
+        value, = struct.unpack_from(">q", self.buffer, self.pos)
+        self.pos += 8
+        return value
+
+    def utf(self):
+        length = self.char()
+        value = bytes(self.buffer[self.pos:self.pos + length])
+        self.pos += length
+        # class names never contain the characters where modified UTF-8 differs from UTF-8
+        return value.decode("utf-8", errors="surrogateescape")
+
+    def varint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if byte & 0x80 == 0:
+                return value
+            shift += 7
+
+    def booleans(self):
+        length = self.varint()
+        nbytes = (length + 7) // 8
+        # slicing copies, so no view of the mmap outlives it
+        packed = self.buffer[self.pos:self.pos + nbytes]
+        if len(packed) < nbytes:
+            raise IndexError("probe array out of range")
+        self.pos += nbytes
+        # bits are packed least significant first
+        return np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=length, bitorder="little").astype(bool)
+
+
+class ExecData:
+    """
+    The content of one or more jacoco.exec files: session infos and the merged probe arrays of all classes
+    """
+
+    def __init__(self):
+        self.sessions: List[SessionInfo] = list([])
+        self.classes: Dict[int, ClassProbes] = dict({})
+
+    @classmethod
+    def load(cls, *exec_paths) -> "ExecData":
+        data = cls()
+        for exec_path in exec_paths:
+            data.read(exec_path)
+        return data
+
+    def read(self, exec_path):
+        """
+        Read exec_path and merge it into this. Appended exec files, i.e. with several headers, are supported
+        """
+        if os.path.getsize(exec_path) == 0:
+            return
+        with open(exec_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            reader = _Reader(buffer)
+            try:
+                while reader.pos < len(buffer):
+                    block = reader.byte()
+                    if block == BLOCK_HEADER:
+                        if reader.char() != MAGIC_NUMBER:
+                            raise ExecFormatError(f"{exec_path} is not an exec file")
+                        version = reader.char()
+                        if version != FORMAT_VERSION:
+                            raise ExecFormatError(f"Unsupported exec format version {version:#x} in {exec_path}")
+                    elif block == BLOCK_SESSIONINFO:
+                        self.sessions.append(SessionInfo(reader.utf(), reader.long(), reader.long()))
+                    elif block == BLOCK_EXECUTIONDATA:
+                        self.add(ClassProbes(reader.long(), reader.utf(), reader.booleans()))
+                    else:
+                        raise ExecFormatError(f"Unknown block type {block:#x} in {exec_path}")
+            except (IndexError, struct.error):
+                raise ExecFormatError(f"Truncated exec file {exec_path}")
+
+    def add(self, class_probes: ClassProbes) -> int:
+        """
+        Merge the probes of a class into this
+        :return: the number of probes covered by class_probes only
+        """
+        current = self.classes.get(class_probes.id)
+        if current is None:
+            self.classes[class_probes.id] = ClassProbes(class_probes.id, class_probes.name, class_probes.probes.copy())
+            return class_probes.covered()
+        before = current.covered()
+        current.merge(class_probes)
+        return current.covered() - before
+
+    def merge(self, other: "ExecData") -> int:
+        """
+        :return: the number of probes covered by other only
+        """
+        self.sessions += other.sessions
+        return sum(self.add(class_probes) for class_probes in other.classes.values())
+
+    def find(self, vm_name) -> List[ClassProbes]:
+        """
+        All versions of a class, e.g. org/example/Foo
+        """
+        return [class_probes for class_probes in self.classes.values() if class_probes.name == vm_name]
+
+    def coverage(self, vm_names: Optional[Iterable[str]] = None):
+        """
+        Covered and total probes, of the given classes or of everything
+        """
+        names = set(vm_names) if vm_names is not None else None
+        covered, total = 0, 0
+        for class_probes in self.classes.values():
+            if names is None or class_probes.name in names:
+                covered += class_probes.covered()
+                total += len(class_probes.probes)
+        return covered, total
+
+    def write(self, exec_path):
+        """
+        Write the merged data as a single exec file, atomically
+        """
+        chunks = [struct.pack(">BHH", BLOCK_HEADER, MAGIC_NUMBER, FORMAT_VERSION)]
+        for session in self.sessions:
+            chunks += [struct.pack(">B", BLOCK_SESSIONINFO), _utf(session.id), struct.pack(">qq", session.start,
+                                                                                          session.dump)]
+        for class_probes in self.classes.values():
+            chunks += [struct.pack(">Bq", BLOCK_EXECUTIONDATA, class_probes.id), _utf(class_probes.name),
+                       _varint(len(class_probes.probes)), np.packbits(class_probes.probes, bitorder="little").tobytes()]
+        tmp_path = f"{exec_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as file:
+            file.write(b"".join(chunks))
+        os.replace(tmp_path, exec_path)
+
+
+def _utf(value: str):
+    encoded = value.encode("utf-8", errors="surrogateescape")
+    return struct.pack(">H", len(encoded)) + encoded
+
+
+def _varint(value: int):
+    encoded = bytearray()
+    while value & ~0x7F:
+        encoded.append(0x80 | (value & 0x7F))
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def merge_exec_files(exec_paths: List[str], output_path) -> ExecData:
+    """
+    Same as 'jacococli merge', without a JVM
+    """
+    data = ExecData.load(*exec_paths)
+    data.write(output_path)
+    return data
+
+
+class CoverageAccumulator:
+    """
+    Cumulative execution data of a method or a project, updated as tests pass and persisted as an exec file,
+    so a report of the total coverage only needs to read one file.
+    """
+
+    def __init__(self, exec_path):
+        """
+        :param exec_path: where the merged data is kept. Loaded if it exists
+        """
+        self.exec_path = exec_path
+        self._lock = threading.Lock()
+        self.data = ExecData.load(exec_path) if os.path.exists(exec_path) else ExecData()
+
+    def add(self, exec_path) -> int:
+        """
+        Merge the exec file of a passing test
+        :return: the number of newly covered probes
+        """
+        try:
+            new_data = ExecData.load(exec_path)
+        except (OSError, ExecFormatError) as e:
+            logging.warning(f"Skip exec file {exec_path}: {e}")
+            return 0
+        with self._lock:
+            return self.data.merge(new_data)
+
+    def coverage(self, vm_names: Optional[Iterable[str]] = None):
+        with self._lock:
+            return self.data.coverage(vm_names)
+
+    def save(self):
+        with self._lock:
+            self.data.write(self.exec_path)
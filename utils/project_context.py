@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, List
+
+from bs4 import BeautifulSoup
+
+BUILD_DIR_NAME = "target/classes"  # the build class dir for each submodule in the project
+DEPENDENCY_DIR_NAME = "target/dependency"
+CACHE_FILE = "target/hits_context.json"
+
+_contexts: Dict[str, "ProjectContext"] = dict({})
+_contexts_lock = threading.Lock()
+_build_locks: Dict[str, threading.Lock] = dict({})
+
+
+def parse_root_pom(pom_dir):
+    """
+    parse pom in 'pom_dir'. Return all modules(.pom) in this project
+    """
+    pom_file = os.path.join(pom_dir, 'pom.xml')
+    if not os.path.exists(pom_file):
+        return None
+    poms = [pom_file]
+    with open(pom_file, 'r') as file:
+        pom_soup = BeautifulSoup(file, 'lxml-xml')
+        modules_tags = pom_soup.select("project > modules")
+        for modules_tag in modules_tags:
+            modules = modules_tag.find_all('module', recursive=False)
+            for module in modules:
+                if module.string != "":
+                    sub_modules = parse_root_pom(os.path.join(pom_dir, module.string))
+                    if sub_modules is not None:
+                        poms += sub_modules
+    return poms
+
+
+def has_made(target_path):
+    """
+    If the project has made before
+    """
+    for dirpath, dirnames, filenames in os.walk(target_path):
+        if 'pom.xml' in filenames and 'target' in dirnames:
+            target = os.path.join(dirpath, 'target')
+            if 'dependency' in os.listdir(target):
+                return True
+    return False
+
+
+def make_project(target_path, goal="package"):
+    """
+    Run mvn to copy the runtime dependencies of a given project and build it
+    :param goal: the build goal, 'install' also puts the modules in the local repository
+    """
+    subprocess.run(
+        f"mvn dependency:copy-dependencies -DoutputDirectory={DEPENDENCY_DIR_NAME} -f {target_path}/pom.xml",
+        shell=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    subprocess.run(f"mvn {goal} -DskipTests -f {target_path}/pom.xml", shell=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def fingerprint(modules: List[str]):
+    """
+    Hash of the content of the module poms and the mtimes of their build and dependency dirs.
+    The module list is derived from the poms only, so it is valid as long as the poms do not change
+    """
+    digest = hashlib.sha1()
+    for module in modules:
+        digest.update(module.encode())
+        if not os.path.exists(module):
+            return None
+        with open(module, "rb") as file:
+            digest.update(file.read())
+        for dir_name in (BUILD_DIR_NAME, DEPENDENCY_DIR_NAME):
+            path = os.path.join(os.path.dirname(module), dir_name)
+            mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else -1
+            digest.update(f"{dir_name}:{mtime}".encode())
+    return digest.hexdigest()
+
+
+class ProjectContext:
+    """
+    The maven layout of a project-under-test: its modules, dependent jars and build dirs.
+    Computing it parses every pom and walks the whole project, so use ProjectContext.get() to share one instance
+    per project in the process. It is also cached in {target_path}/target/hits_context.json and reused across
+    processes until a pom or a build dir changes.
+    """
+
+    def __init__(self, target_path, modules: List[str], dependencies: List[str], build_dirs: List[str], key=None):
+        """
+        :param target_path: target project path
+        :param modules: paths of all pom.xml of the project
+        :param dependencies: paths of the dependent jars
+        :param build_dirs: existing {module}/target/classes dirs
+        :param key: the fingerprint the context is computed for
+        """
+        self.target_path = target_path
+        self.modules = modules
+        self.dependencies = ':'.join(dependencies)  # 'a.jar:b.jar'
+        self.build_dirs = build_dirs
+        self.build_dir = ':'.join(build_dirs)  # {module_a}/target/classes:{module_b}/target/classes
+        self.key = key
+
+    @classmethod
+    def get(cls, target_path) -> "ProjectContext":
+        """
+        Return the context of target_path, from memory, the disk cache or computed
+        """
+        target_path = os.path.abspath(target_path)
+        with _contexts_lock:
+            context = _contexts.get(target_path)
+            build_lock = _build_locks.setdefault(target_path, threading.Lock())
+        if context is not None and context.key == fingerprint(context.modules):
+            return context
+        with build_lock:
+            context = cls.load(target_path)
+            if context is None:
+                context = cls.build(target_path)
+                context.save()
+        with _contexts_lock:
+            _contexts[target_path] = context
+        return context
+
+    @classmethod
+    def build(cls, target_path) -> "ProjectContext":
+        modules = parse_root_pom(target_path)
+        if modules is None:
+            raise ValueError(f"No valid maven modules found in {target_path}")
+        modules_str = '\n'.join(modules)
+        logging.debug(f"Found the following .pom files:\n{modules_str}\n")
+
+        if not has_made(target_path):
+            make_project(target_path)
+
+        dep_jars = list([])
+        build_dirs = list([])
+        for module in modules:
+            module_dir = os.path.dirname(module)
+            logging.debug(f"Looking for dependencies in {module_dir}")
+            dep_jars += [os.path.join(os.path.abspath(module_dir), dep)
+                         for dep in glob.glob(f"{DEPENDENCY_DIR_NAME}/**/*.jar", root_dir=module_dir, recursive=True)]
+            classes_dir = os.path.join(module_dir, BUILD_DIR_NAME)
+            if os.path.exists(classes_dir):
+                build_dirs.append(classes_dir)
+        return cls(target_path, modules, sorted(set(dep_jars)), build_dirs, fingerprint(modules))
+
+    @classmethod
+    def load(cls, target_path) -> "ProjectContext":
+        """
+        Load the context from the disk cache. None if there is none or it is outdated
+        """
+        cache_file = os.path.join(target_path, CACHE_FILE)
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file, "r") as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if cached.get("key") is None or cached["key"] != fingerprint(cached["modules"]):
+            return None
+        return cls(target_path, cached["modules"], [dep for dep in cached["dependencies"].split(':') if dep != ""],
+                   cached["build_dirs"], cached["key"])
+
+    def save(self):
+        cache_file = os.path.join(self.target_path, CACHE_FILE)
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            return
+        tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_file, "w") as file:
+            json.dump({"key": self.key, "modules": self.modules, "dependencies": self.dependencies,
+                       "build_dirs": self.build_dirs}, file)
+        os.replace(tmp_file, cache_file)
@@ -2,16 +2,38 @@ import logging
 import os
 import re
 import subprocess
+from collections import defaultdict
 from typing import Optional, List, Dict, Tuple
 
 from bs4 import BeautifulSoup
+from lxml import etree
+
+PRIMITIVE_DESCRIPTORS = {'Z': 'boolean', 'B': 'byte', 'C': 'char', 'S': 'short', 'I': 'int', 'J': 'long',
+                         'F': 'float', 'D': 'double', 'V': 'void'}
+
+
+def erase_generics(signature):
+    """
+    Remove all type arguments, e.g. 'put(Map<K, List<V>> m)' -> 'put(Map m)'. Unbalanced '>' are kept
+    """
+    depth = 0
+    erased = list([])
+    for char in signature:
+        if char == '<':
+            depth += 1
+        elif char == '>' and depth > 0:
+            depth -= 1
+        elif depth == 0:
+            erased.append(char)
+    return ''.join(erased)
 
 
 def sig_split(signature):
     """
-    given a signature: xxxx(aaa, bbb, cccc), split it into xxxx, aaa, bbb, cccc
+    given a signature: xxxx(aaa, bbb, cccc), split it into xxxx, aaa, bbb, cccc. Varargs are given as arrays
     """
-    signature = signature.strip()
+    # before splitting at '.', which would leave nothing of 'String...'
+    signature = signature.strip().replace('...', '[]')
     # first, find base name and param group
     first_split = re.match(r"([^()]+)\((.*)\)", signature)
     if first_split is None:
@@ -69,19 +91,7 @@ def jacoco_analysis(report_root, package, class_name, signature) -> Optional[Dic
         coverage[method_name] = {"inst_cov": instruction_cov, "bran_cov": branch_cov}
 
     # wash signature
-    def _iter_replace(_str):
-        _cnt = 0
-        while True:
-            _new_str = re.sub(r"<[^<>]*>", "", _str)
-            if _new_str == _str:
-                return _str
-            else:
-                _cnt += 1
-                _str = _new_str
-                if _cnt == 100000:
-                    return _str
-
-    simplified_sig = _iter_replace(signature)
+    simplified_sig = erase_generics(signature)
     # find match sig
     simplified_sig = sig_split(simplified_sig)
     match_jacoco_key = None
@@ -106,6 +116,118 @@ def jacoco_analysis(report_root, package, class_name, signature) -> Optional[Dic
         return coverage[match_jacoco_key]
 
 
+def descriptor_params(desc):
+    """
+    Simple names of the parameter types in a method descriptor, as JaCoCo's html shows them.
+    e.g. '(Ljava/lang/String;[ILjava/util/Map$Entry;)V' -> ['String', 'int[]', 'Entry']
+    """
+    params = list([])
+    idx = 1  # skip '('
+    while desc[idx] != ')':
+        dims = 0
+        while desc[idx] == '[':
+            dims += 1
+            idx += 1
+        if desc[idx] == 'L':
+            end = desc.index(';', idx)
+            name = re.split(r"[/$]", desc[idx + 1:end])[-1]
+            idx = end + 1
+        else:
+            name = PRIMITIVE_DESCRIPTORS[desc[idx]]
+            idx += 1
+        params.append(name + "[]" * dims)
+    return params
+
+
+def format_ratio(covered, missed):
+    """
+    Format a counter like JaCoCo's html: percentage rounded down, 'n/a' if there is nothing to count
+    """
+    total = covered + missed
+    if total == 0:
+        return "n/a"
+    return f"{covered * 100 // total}%"
+
+
+class MethodCoverageIndex:
+    """
+    Method coverage of one class, indexed by (name, erased simple parameter types).
+    Signatures are matched in O(1); only when type variables were erased to Object by javac the methods of the same
+    name and arity are compared one by one, like sig_compare
+    """
+
+    def __init__(self, class_name):
+        self.class_name = class_name
+        self.exact: Dict[Tuple, Dict[str, str]] = dict({})
+        self.by_arity: Dict[Tuple[str, int], List[Tuple[List[str], Dict[str, str]]]] = defaultdict(list)
+
+    def add(self, name, desc, coverage: Dict[str, str]):
+        if name == '<clinit>':
+            return
+        if name == '<init>':
+            name = self.class_name.split('$')[-1]
+        params = descriptor_params(desc)
+        self.exact.setdefault((name, tuple(params)), coverage)
+        self.by_arity[(name, len(params))].append(([name] + params, coverage))
+
+    def __len__(self):
+        return len(self.exact)
+
+    def find(self, signature) -> Optional[Dict[str, str]]:
+        split_sig = sig_split(erase_generics(signature))
+        if split_sig is None:
+            logging.error(f"Failed to parse original signature: {signature}")
+            return None
+        split_sig = [split_sig[0]] + [param.replace('final ', '') for param in split_sig[1:]]
+        coverage = self.exact.get((split_sig[0], tuple(split_sig[1:])))
+        if coverage is not None:
+            return coverage
+        for jacoco_sig, coverage in self.by_arity.get((split_sig[0], len(split_sig) - 1), []):
+            if sig_compare(split_sig, jacoco_sig):
+                return coverage
+        return None
+
+
+def load_xml_class_coverage(xml_path, package, class_name) -> Optional[MethodCoverageIndex]:
+    """
+    Stream a JaCoCo xml report and index the method counters of package.class_name. Other classes are skipped
+    :return: None if the class is not in the report
+    """
+    vm_name = f"{package.replace('.', '/')}/{class_name}" if package != "" else class_name
+    context = etree.iterparse(xml_path, events=("end",), tag="class",
+                              load_dtd=False, no_network=True, resolve_entities=False)
+    index = None
+    for _, element in context:
+        if element.get("name") == vm_name:
+            index = MethodCoverageIndex(class_name)
+            for method in element.iterfind("method"):
+                counters = {counter.get("type"): (int(counter.get("covered")), int(counter.get("missed")))
+                            for counter in method.iterfind("counter")}
+                index.add(method.get("name"), method.get("desc"),
+                          {"inst_cov": format_ratio(*counters.get("INSTRUCTION", (0, 0))),
+                           "bran_cov": format_ratio(*counters.get("BRANCH", (0, 0)))})
+            break
+        element.clear()
+    del context
+    return index
+
+
+def jacoco_xml_analysis(xml_path, package, class_name, signature) -> Optional[Dict[str, str]]:
+    """
+    Same as jacoco_analysis, but reads the counters of a JaCoCo xml report instead of scraping the html report
+    :param xml_path: the xml report, e.g. cov_check_dir/coverage.xml
+    :return: {"inst_cov": str, "bran_cov": str}
+    """
+    index = load_xml_class_coverage(xml_path, package, class_name)
+    if index is None or len(index) == 0:
+        logging.error(f"Failed to find any content for {package}.{class_name} in {xml_path}")
+        return None
+    coverage = index.find(signature)
+    if coverage is None:
+        logging.error(f"Failed to find cov information for {signature}")
+    return coverage
+
+
 def jacoco_missing_lines(report_root, package, class_name) -> Tuple[List[Tuple[int, str]], List[Tuple[int, str]]]:
     html_path = os.path.join(report_root, package, f"{class_name}.java.html")
     with open(html_path, "r") as file:
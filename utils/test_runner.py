@@ -1,39 +1,185 @@
+import asyncio
 import glob
 import logging
+import multiprocessing
 import os.path
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
-from bs4 import BeautifulSoup
-
+from typing import Dict, List, Optional, Tuple
 from utils.config import *
+from utils.code_editor import CodeEditor
+from utils.daemon import DaemonError, compile_in_server, run_test_in_daemon, run_tests_in_one_launch
+from utils.jacoco_exec import CoverageAccumulator
+from utils.project_context import ProjectContext, parse_root_pom
+
+
+JAVAC_DIAGNOSTIC = re.compile(r"^(?P<path>.+\.java):\d+: (?P<kind>error|warning): ")
+JAVAC_SUMMARY = re.compile(r"^\d+ (errors?|warnings?)$")
+CANCEL_POLL_INTERVAL = 0.2  # seconds between checks of the cancel event of a running process
 
+_test_executor = None
+_test_executor_lock = threading.Lock()
 
-def parse_root_pom(pom_dir):
+
+class TestCancelled(RuntimeError):
+    """
+    The cancel event of the TestRunner was set, e.g. another candidate already passed
+    """
+    pass
+
+
+def run_process(cmd, timeout=None, cancel: Optional[threading.Event] = None) -> subprocess.CompletedProcess:
+    """
+    subprocess.run capturing the text output, killing the process once cancel is set
+    :raise subprocess.TimeoutExpired: the process did not finish in timeout seconds. It is killed
+    :raise TestCancelled: cancel was set while the process was running
     """
-    parse pom in 'pom_dir'. Return all modules(.pom) in this project
+    if cancel is None:
+        return subprocess.run(cmd, timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if cancel.is_set():
+        raise TestCancelled(f"Cancelled before {cmd[0]} started")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=CANCEL_POLL_INTERVAL)
+                return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                if cancel.is_set():
+                    process.kill()
+                    process.communicate()
+                    raise TestCancelled(f"Cancelled {cmd[0]}")
+                if deadline is not None and time.monotonic() > deadline:
+                    process.kill()
+                    process.communicate()
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+
+
+async def run_process_async(cmd, timeout=None) -> subprocess.CompletedProcess:
+    """
+    run_process on an asyncio subprocess. The process is killed if the awaiting task is cancelled
+    :raise subprocess.TimeoutExpired: the process did not finish in timeout seconds. It is killed
+    """
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout.decode(errors="replace"),
+                                       stderr.decode(errors="replace"))
+
+
+def default_process_limits() -> Tuple[int, int]:
+    """
+    (JVMs, javac processes) to run at once: a JVM per core and a javac per two cores, as far as the memory holds
+    JVM_MEMORY_MB for each of them. The memory is split 2:1 between the JVMs and javac
+    """
+    cpus = os.cpu_count() or 1
+    max_jvms, max_javacs = cpus, max(1, cpus // 2)
+    try:
+        memory_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2 ** 20
+    except (AttributeError, ValueError, OSError):  # no sysconf, e.g. on Windows
+        return max_jvms, max_javacs
+    slots = memory_mb // JVM_MEMORY_MB
+    max_jvms = max(1, min(max_jvms, slots * 2 // 3))
+    max_javacs = max(1, min(max_javacs, slots - max_jvms))
+    return max_jvms, max_javacs
+
+
+def test_executor() -> ThreadPoolExecutor:
     """
-    pom_file = os.path.join(pom_dir, 'pom.xml')
-    if not os.path.exists(pom_file):
-        return None
-    poms = [pom_file]
-    with open(pom_file, 'r') as file:
-        pom_soup = BeautifulSoup(file, 'lxml-xml')
-        modules_tags = pom_soup.select("project > modules")
-        for modules_tag in modules_tags:
-            modules = modules_tag.find_all('module', recursive=False)
-            for module in modules:
-                if module.string != "":
-                    sub_modules = parse_root_pom(os.path.join(pom_dir, module.string))
-                    if sub_modules is not None:
-                        poms += sub_modules
-    return poms
+    The process-wide pool running the test cases of all methods, a JVM per worker. It has MAX_JVMS workers, or
+    those of default_process_limits, so a method with many test cases spreads over the cores another method leaves
+    idle. Do not run tests that wait for this pool on it
+    """
+    global _test_executor
+    if _test_executor is None:
+        with _test_executor_lock:
+            if _test_executor is None:
+                workers = MAX_JVMS if MAX_JVMS > 0 else default_process_limits()[0]
+                _test_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="test")
+    return _test_executor
+
+
+class ProcessLimits:
+    """
+    Bounds of the concurrent JVMs (tests and coverage reports) and javac processes of the AsyncTestRunners on an
+    event loop, one semaphore each
+    """
+    _shared = weakref.WeakKeyDictionary()
+
+    def __init__(self, max_jvms=MAX_JVMS, max_javacs=MAX_JAVACS):
+        """
+        :param max_jvms: 0 for the default of default_process_limits, MAX_JVMS in config.ini by default
+        :param max_javacs: 0 for the default of default_process_limits, MAX_JAVACS in config.ini by default
+        """
+        default_jvms, default_javacs = default_process_limits()
+        self.max_jvms = max_jvms if max_jvms > 0 else default_jvms
+        self.max_javacs = max_javacs if max_javacs > 0 else default_javacs
+        self.jvm = asyncio.Semaphore(self.max_jvms)
+        self.javac = asyncio.Semaphore(self.max_javacs)
+
+    @classmethod
+    def shared(cls) -> "ProcessLimits":
+        """
+        The limits shared by all runners on the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        limits = cls._shared.get(loop)
+        if limits is None:
+            limits = cls._shared[loop] = cls()
+        return limits
+
+
+def split_javac_output(output, test_files) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Attribute javac's output to the source files it is about.
+    :param output: stdout + stderr of a javac call
+    :param test_files: absolute paths of the compiled source files
+    :return: {test_file: diagnostics}, where a diagnostic is the header line plus its context lines, and the error
+    diagnostics that belong to none of test_files. Warnings and javac's own summary lines are dropped
+    """
+    errors = {test_file: [] for test_file in test_files}
+    unattributed = list([])
+    current = None
+    for line in output.split('\n'):
+        match = JAVAC_DIAGNOSTIC.match(line)
+        if match is not None:
+            path = os.path.abspath(match.group('path'))
+            current = [line]
+            if match.group('kind') == 'warning':
+                pass
+            elif path in errors:
+                errors[path].append(current)
+            else:
+                unattributed.append(current)
+        elif JAVAC_SUMMARY.match(line) or line.startswith("Note: "):
+            current = None
+        elif current is not None:
+            current.append(line)
+        elif line.strip() != "":
+            unattributed.append([line])
+    errors = {path: ['\n'.join(diagnostic) for diagnostic in diagnostics] for path, diagnostics in errors.items()}
+    return errors, ['\n'.join(diagnostic) for diagnostic in unattributed]
 
 
 class TestRunner:
 
-    def __init__(self, test_path, target_path, output_path, tool="jacoco", debug=False):
+    def __init__(self, test_path, target_path, output_path, tool="jacoco", debug=False, use_daemon=USE_TEST_DAEMON,
+                 use_compile_server=USE_COMPILE_SERVER, lean_report=False,
+                 use_coverage_server=USE_COVERAGE_SERVER, cancel: Optional[threading.Event] = None):
         """
         :param tool: coverage tool (Only support cobertura or jacoco)
         :param test_path: test cases directory path e.g.:
@@ -42,37 +188,48 @@ class TestRunner:
         :param target_path: target project path
         :param output_path: dir of all output resources. Used only in test all
         :param debug: switch for debug mode. If on, output the error message and the java command
+        :param use_daemon: run jacoco tests in a warm JVM (see utils/daemon.py) instead of one JVM per test.
+        Falls back to one JVM per test if the daemon fails
+        :param use_compile_server: compile tests with a resident javac (see utils/daemon.py) instead of one javac
+        per test. Falls back to the javac command if the server fails
+        :param lean_report: jacoco only. report() writes the xml counters (coverage.xml) instead of the html and csv
+        reports. Read it with utils.report.jacoco_xml_analysis
+        :param use_coverage_server: jacoco only. start_single_test does not report; the coverage is read from the
+        exec file by the resident analyzer instead, see procedures.fix_code.coverage_check
+        :param cancel: once set, the running javac or java process is killed and start_single_test returns False
         """
         self.coverage_tool = tool
         self.test_path = test_path
         self.target_path = target_path
         self.output_path = output_path
         self.debug = debug
+        self.use_daemon = use_daemon
+        self.use_compile_server = use_compile_server
+        self.lean_report = lean_report
+        self.use_coverage_server = use_coverage_server
+        self.cancel = cancel
 
         if not os.path.exists(output_path):
             os.makedirs(output_path)
 
-        self.modules = parse_root_pom(target_path)
-        if self.modules is None:
-            raise ValueError(f"No valid maven modules found in {target_path}")
-        modules = '\n'.join(self.modules)
-        logging.debug(f"Found the following .pom files:\n{modules}\n")
-
-        # Preprocess
-        self.dependencies = self.make_dependency()  # paths of dependent jars of the project-under-test: 'a.jar:b.jar'
-        self.build_dir_name = "target/classes"  # the build class dir for each submodule in the project
-        self.build_dir = self.process_single_repo()  # {target_dir}/target/classes
+        # Preprocess. Shared by all runners of the project, see utils/project_context.py
+        self.context = ProjectContext.get(target_path)
+        self.modules = self.context.modules
+        self.dependencies = self.context.dependencies  # paths of dependent jars of the project-under-test: 'a.jar:b.jar'
+        self.build_dir = self.context.build_dir  # {module}/target/classes of all modules
 
         self.COMPILE_ERROR = 0
         self.TEST_RUN_ERROR = 0
 
         self.logger = logging.getLogger('test_runner')
 
-    def start_single_test(self):
+    def start_single_test(self, precompiled=False, executed=False):
         """
         Run a single method test case with a thread.
         tests directory path, e.g.:
         /data/share/TestGPT_ASE/result/scope_test%20230414210243%d3_1/1460%lang_1_f%ToStringBuilder%append%d3/5
+        :param precompiled: the test is already compiled to runtemp by compile_batch. Skip compiling
+        :param executed: the test has already run, e.g. by run_batch. Only report its coverage. Implies precompiled
         """
         temp_dir = os.path.join(self.test_path, "temp")
         compiled_test_dir = os.path.join(self.test_path, "runtemp")
@@ -82,21 +239,33 @@ class TestRunner:
             test_file = os.path.abspath(glob.glob(temp_dir + '/*.java')[0])
             compiler_output = os.path.join(temp_dir, 'compile_error')
             test_output = os.path.join(temp_dir, 'runtime_error')
-            if not self.run_single_test(test_file, compiled_test_dir, compiler_output, test_output):
+            if (precompiled or executed) and os.path.exists(f"{compiler_output}.txt"):
+                return False
+            if executed:
+                if os.path.exists(f"{test_output}.txt"):
+                    return False
+            elif not self.run_single_test(test_file, compiled_test_dir, compiler_output, test_output,
+                                          compile=not precompiled):
                 return False
+            if self.cancel is not None and self.cancel.is_set():
+                raise TestCancelled(f"Cancelled before the coverage report of {os.path.basename(test_file)}")
+            cov_check_dir = os.path.join(self.test_path, "cov_check_dir")
+            if self.use_coverage_server and self.coverage_tool == "jacoco":
+                os.makedirs(cov_check_dir, exist_ok=True)
             else:
-                self.report(compiled_test_dir, os.path.join(self.test_path, "cov_check_dir"))
+                self.report(compiled_test_dir, cov_check_dir)
         except Exception as e:
             print(e)
             return False
         return True
 
-    def start_all_test(self):
+    def start_all_test(self, shards=1):
         """
         Initialize configurations and run all tests. The procedures are as follows:
         1. create test root dir in self.output_dir named by time
         2. copy all test files (PUT) to self.output_dir
         3. perform test
+        :param shards: worker processes running the tests, see run_all_tests
         return: tests_dir, the root of the test output files
         """
         date = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -112,23 +281,30 @@ class TestRunner:
         compiled_test_dir = os.path.join(tests_dir, "tests_ChatGPT")
 
         self.copy_tests(tests_dir)
-        self.run_all_tests(tests_dir, compiled_test_dir, compiler_output, test_output, report_dir)
+        self.run_all_tests(tests_dir, compiled_test_dir, compiler_output, test_output, report_dir, shards=shards)
         return tests_dir
 
-    def run_all_tests(self, tests_dir, compiled_test_dir, compiler_output, test_output, report_dir):
+    def run_all_tests(self, tests_dir, compiled_test_dir, compiler_output, test_output, report_dir, shards=1):
         """
         Run all test cases in a project.
+        :param shards: jacoco only. Split the test cases over this many worker processes. Shard i compiles and runs
+        its test cases in {compiled_test_dir}/shard_{i} with a jacoco.exec of its own, and the exec files are merged
+        into {compiled_test_dir}/jacoco.exec for the report. The workers are spawned, so the main script needs the
+        `if __name__ == "__main__"` guard
         """
         tests = os.path.join(tests_dir, "test_cases")
-        self.instrument(compiled_test_dir, compiled_test_dir)
-        total_compile = 0
-        for test_case_file in os.listdir(tests):
-            total_compile += 1
-            try:
-                test_file = os.path.join(tests, test_case_file)
-                self.run_single_test(test_file, compiled_test_dir, compiler_output, test_output)
-            except Exception as e:
-                print(e)
+        test_files = [os.path.join(tests, test_case_file) for test_case_file in os.listdir(tests)]
+        if shards > 1 and self.coverage_tool == "jacoco" and len(test_files) > 1:
+            total_compile = self.run_shards(test_files, compiled_test_dir, compiler_output, test_output, shards)
+        else:
+            self.instrument(compiled_test_dir, compiled_test_dir)
+            total_compile = 0
+            for test_file in test_files:
+                total_compile += 1
+                try:
+                    self.run_single_test(test_file, compiled_test_dir, compiler_output, test_output)
+                except Exception as e:
+                    print(e)
         self.report(compiled_test_dir, report_dir)
         total_test_run = total_compile - self.COMPILE_ERROR
         print("COMPILE TOTAL COUNT:", total_compile)
@@ -138,23 +314,59 @@ class TestRunner:
         print("\n")
         return total_compile, total_test_run
 
-    def run_single_test(self, test_file, compiled_test_dir, compiler_output, test_output):
+    def run_shards(self, test_files, compiled_test_dir, compiler_output, test_output, shards) -> int:
+        """
+        Run test_files over worker processes, see run_all_tests. The error counts of the shards are added to this
+        runner's
+        :return: the number of test cases
+        """
+        shards = min(shards, len(test_files))
+        shard_dirs = [os.path.join(compiled_test_dir, f"shard_{idx}") for idx in range(shards)]
+        runner_args = dict(test_path=self.test_path, target_path=self.target_path, output_path=self.output_path,
+                           tool=self.coverage_tool, debug=self.debug, use_daemon=self.use_daemon,
+                           use_compile_server=self.use_compile_server, lean_report=self.lean_report,
+                           use_coverage_server=self.use_coverage_server)
+        os.makedirs(compiled_test_dir, exist_ok=True)
+        merged_exec = os.path.join(compiled_test_dir, "jacoco.exec")
+        if os.path.exists(merged_exec):
+            os.remove(merged_exec)
+        accumulator = CoverageAccumulator(merged_exec)
+        # spawn, the parent may have threads running, e.g. those of test_executor()
+        with ProcessPoolExecutor(max_workers=shards, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(run_shard, runner_args, test_files[idx::shards], shard_dirs[idx],
+                                   compiler_output, test_output): shard_dirs[idx] for idx in range(shards)}
+            # merge the coverage of each shard as soon as it is done, while the others still run
+            for future in as_completed(futures):
+                compile_errors, test_run_errors = future.result()
+                self.COMPILE_ERROR += compile_errors
+                self.TEST_RUN_ERROR += test_run_errors
+                shard_exec = os.path.join(futures[future], "jacoco.exec")
+                if os.path.exists(shard_exec):
+                    accumulator.add(shard_exec)
+        accumulator.save()
+        return len(test_files)
+
+    def run_single_test(self, test_file, compiled_test_dir, compiler_output, test_output, compile=True):
         """
         Run a test case.
+        :param compile: compile the test case first. Turn off if it is already compiled to compiled_test_dir
         :return: Whether it is successful or no.
         """
-        if not self.compile(test_file, compiled_test_dir, compiler_output):
+        if self.cancel is not None and self.cancel.is_set():
+            raise TestCancelled(f"Cancelled before running {os.path.basename(test_file)}")
+        if compile and not self.compile(test_file, compiled_test_dir, compiler_output):
             return False
-        if os.path.basename(test_output) == 'runtime_error':
-            test_output_file = f"{test_output}.txt"
-        else:
-            test_output_file = f"{test_output}-{os.path.basename(test_file)}.txt"
-        cmd = self.java_cmd(compiled_test_dir, test_file)
-        if self.debug:
-            logging.error(f'Java command:\n{" ".join(cmd)}')
+        test_output_file = self.test_output_file(test_output, test_file)
         try:
-            result = subprocess.run(cmd, timeout=TIMEOUT,
-                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            result = None
+            # a test in the daemon can not be stopped, a cancellable one gets a JVM of its own
+            if self.use_daemon and self.coverage_tool == "jacoco" and self.cancel is None:
+                result = self.run_in_daemon(compiled_test_dir, test_file)
+            if result is None:
+                cmd = self.java_cmd(compiled_test_dir, test_file)
+                if self.debug:
+                    logging.error(f'Java command:\n{" ".join(cmd)}')
+                result = run_process(cmd, TIMEOUT, self.cancel)
             if result.returncode != 0:
                 self.TEST_RUN_ERROR += 1
                 self.export_runtime_output(result, test_output_file)
@@ -166,6 +378,85 @@ class TestRunner:
             return False
         return True
 
+    def run_batch(self, tasks: List[Tuple[str, str, str]]) -> List[bool]:
+        """
+        Run many compiled test cases in one JVM and one JUnit launch, see MultiTestLauncher in HELPER_DIR. Each test
+        case gets its JaCoCo data in {compiled_test_dir}/jacoco.exec and, if it fails, its own test output, as if it
+        was run by run_single_test(compile=False). If a test case times out, it fails like in run_single_test and the
+        test cases that did not run yet get a JVM each, as do all of them if the launcher fails. jacoco only
+        :param tasks: list of (test_file, compiled_test_dir, test_output), see run_single_test
+        :return: whether each test case passed, aligned with tasks
+        """
+        tasks = [(os.path.abspath(test_file), compiled_test_dir, test_output)
+                 for test_file, compiled_test_dir, test_output in tasks]
+        results: Dict[int, bool] = dict({})
+        if self.coverage_tool == "jacoco" and len(tasks) > 1:
+            tests = [(self.get_full_name(test_file), f"{compiled_test_dir}:{self.build_dir}:{self.dependencies}:.",
+                      os.path.join(compiled_test_dir, "jacoco.exec"),
+                      os.path.join(compiled_test_dir, "launcher_output.txt"))
+                     for test_file, compiled_test_dir, _ in tasks]
+            manifest_dir = tempfile.mkdtemp(prefix="launch_")
+            running = None
+            try:
+                for idx, returncode in run_tests_in_one_launch(tests, os.path.join(manifest_dir, "manifest.txt"),
+                                                               TIMEOUT):
+                    if returncode is None:
+                        running = idx
+                        continue
+                    running = None
+                    test_file, _, test_output = tasks[idx]
+                    with open(tests[idx][3], "r", errors="replace") as file:
+                        output = file.read()
+                    results[idx] = returncode == 0
+                    if returncode != 0:
+                        self.TEST_RUN_ERROR += 1
+                        self.export_runtime_output(subprocess.CompletedProcess(tests[idx][0], returncode, output, ""),
+                                                   self.test_output_file(test_output, test_file))
+            except subprocess.TimeoutExpired:
+                if running is not None:
+                    self.logger.error("Time Out!")
+                    test_file, _, test_output = tasks[running]
+                    self.export_timeout_error(self.test_output_file(test_output, test_file))
+                    results[running] = False
+            except DaemonError as e:
+                self.logger.warning(f"Test launcher failed: {e}. Run the remaining tests in a JVM each")
+            finally:
+                shutil.rmtree(manifest_dir, ignore_errors=True)
+        for idx, (test_file, compiled_test_dir, test_output) in enumerate(tasks):
+            if idx not in results:
+                try:
+                    results[idx] = self.run_single_test(test_file, compiled_test_dir, None, test_output,
+                                                        compile=False)
+                except Exception as e:
+                    print(e)
+                    results[idx] = False
+        return [results[idx] for idx in range(len(tasks))]
+
+    @staticmethod
+    def test_output_file(test_output, test_file):
+        if os.path.basename(test_output) == 'runtime_error':
+            return f"{test_output}.txt"
+        else:
+            return f"{test_output}-{os.path.basename(test_file)}.txt"
+
+    def run_in_daemon(self, compiled_test_dir, test_file):
+        """
+        Run a test case in the warm JVM of this project.
+        :return: a CompletedProcess like subprocess.run, or None if the daemon failed
+        """
+        full_test_name = self.get_full_name(test_file)
+        output_file = os.path.join(compiled_test_dir, "daemon_output.txt")
+        test_classpath = f"{compiled_test_dir}:{self.build_dir}:{self.dependencies}:."
+        try:
+            returncode = run_test_in_daemon(f"{self.build_dir}:{self.dependencies}", full_test_name, test_classpath,
+                                            os.path.join(compiled_test_dir, "jacoco.exec"), output_file, TIMEOUT)
+        except DaemonError as e:
+            self.logger.warning(f"Test daemon failed on {full_test_name}: {e}. Fall back to a dedicated JVM")
+            return None
+        with open(output_file, "r", errors="replace") as file:
+            output = file.read()
+        return subprocess.CompletedProcess(full_test_name, returncode, output, "")
+
     @staticmethod
     def export_timeout_error(test_output_file):
         with open(test_output_file, 'w') as file:
@@ -189,40 +480,141 @@ class TestRunner:
         :param compiler_output:
         """
         os.makedirs(compiled_test_dir, exist_ok=True)
-        cmd = self.javac_cmd(compiled_test_dir, test_file)
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        result = None
+        if self.use_compile_server:
+            result = self.compile_in_server(compiled_test_dir, test_file)
+        if result is None:
+            cmd = self.javac_cmd(compiled_test_dir, test_file)
+            result = run_process(cmd, cancel=self.cancel)
         if result.returncode != 0:
-            self.COMPILE_ERROR += 1
-            if os.path.basename(compiler_output) == 'compile_error':
-                compiler_output_file = f"{compiler_output}.txt"
-            else:
-                compiler_output_file = f"{compiler_output}-{os.path.basename(test_file)}.txt"
-            with open(compiler_output_file, "w") as f:
-                f.write(result.stdout)
-                f.write(result.stderr)
+            self.export_compiler_output(result, compiler_output, test_file)
             return False
         return True
 
-    def process_single_repo(self):
+    def export_compiler_output(self, result, compiler_output, test_file):
+        self.COMPILE_ERROR += 1
+        with open(self.compiler_output_file(compiler_output, test_file), "w") as f:
+            f.write(result.stdout)
+            f.write(result.stderr)
+
+    @staticmethod
+    def compiler_output_file(compiler_output, test_file):
+        if os.path.basename(compiler_output) == 'compile_error':
+            return f"{compiler_output}.txt"
+        else:
+            return f"{compiler_output}-{os.path.basename(test_file)}.txt"
+
+    def compile_batch(self, tasks: List[Tuple[str, str, str]]) -> List[bool]:
         """
-        Return the all build directories of target repository (including all submodules)
+        Compile many test cases with as few javac calls as possible. Each test case gets its classes in its own
+        compiled_test_dir and, if it fails, its own compiler output, as if it was compiled by compile().
+        javac's output is attributed to the files by their paths. Files with errors are removed and the rest is
+        recompiled, since javac stops before reporting the later errors of the others, e.g. after a syntax error.
+        If an error can not be attributed, the batch is bisected until the file causing it is isolated.
+        :param tasks: list of (test_file, compiled_test_dir, compiler_output), see compile()
+        :return: whether each test case compiled, aligned with tasks
         """
+        tasks = [(os.path.abspath(test_file), compiled_test_dir, compiler_output)
+                 for test_file, compiled_test_dir, compiler_output in tasks]
+        results = dict({})
+        code_editor = CodeEditor()
+        top_level_types = {task[0]: self.get_top_level_types(task[0], code_editor) for task in tasks}
+        # files declaring a type of the same name can not share a javac call, e.g. the test cases split from one
+        # CU share its test class and its helper classes
+        rounds: List[Tuple[set, List[Tuple[str, str, str]]]] = list([])
+        for task in tasks:
+            types = set(top_level_types[task[0]])
+            for declared, _round in rounds:
+                if declared.isdisjoint(types):
+                    declared.update(types)
+                    _round.append(task)
+                    break
+            else:
+                rounds.append((types, [task]))
+        for _, _round in rounds:
+            self._compile_batch(_round, results, top_level_types)
+        return [results[task[0]] for task in tasks]
+
+    def _compile_batch(self, tasks: List[Tuple[str, str, str]], results: Dict[str, bool],
+                       top_level_types: Dict[str, List[str]]):
+        if len(tasks) == 0:
+            return
+        if len(tasks) == 1:
+            test_file, compiled_test_dir, compiler_output = tasks[0]
+            results[test_file] = self.compile(test_file, compiled_test_dir, compiler_output)
+            return
 
-        # if self.has_submodule(self.target_path):
-        #     modules = self.get_submodule(self.target_path)
-        #     postfixed_modules = [f'{self.target_path}/{module}/{self.build_dir_name}' for module in modules]
-        #     build_dir = ':'.join(postfixed_modules)
-        # else:
-        #     build_dir = os.path.join(self.target_path, self.build_dir_name)
-        # return build_dir
-        build_dir = []
-        for submodule in self.modules:
-            module_dir = os.path.dirname(submodule)
-            classes_dir = os.path.join(module_dir, self.build_dir_name)
-            # print(classes_dir)
-            if os.path.exists(classes_dir):
-                build_dir.append(classes_dir)
-        return ':'.join(build_dir)
+        batch_dir = tempfile.mkdtemp(prefix="javac_batch_")
+        try:
+            classpath_file = os.path.join(batch_dir, 'classpath.txt')
+            self.export_classpath(classpath_file, self.compile_classpath())
+            cmd = ["javac", "-d", batch_dir, "-Xmaxerrs", "100000", f"@{classpath_file}"] + [t[0] for t in tasks]
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if result.returncode == 0:
+                for test_file, compiled_test_dir, _ in tasks:
+                    self.copy_compiled_classes(batch_dir, compiled_test_dir, top_level_types[test_file])
+                    results[test_file] = True
+                return
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+        errors, unattributed = split_javac_output(result.stdout + result.stderr, [t[0] for t in tasks])
+        failed = [task for task in tasks if len(errors[task[0]]) > 0]
+        if len(failed) == 0 or len(unattributed) > 0:
+            self.logger.debug(f"Can not attribute javac errors in a batch of {len(tasks)}. Bisecting")
+            self._compile_batch(tasks[:len(tasks) // 2], results, top_level_types)
+            self._compile_batch(tasks[len(tasks) // 2:], results, top_level_types)
+            return
+        for test_file, _, compiler_output in failed:
+            self.COMPILE_ERROR += 1
+            error_count = len(errors[test_file])
+            with open(self.compiler_output_file(compiler_output, test_file), "w") as f:
+                f.write('\n'.join(errors[test_file]) + '\n')
+                f.write(f"{error_count} error{'s' if error_count > 1 else ''}\n")
+            results[test_file] = False
+        self._compile_batch([task for task in tasks if task not in failed], results, top_level_types)
+
+    def get_top_level_types(self, test_file, code_editor: CodeEditor) -> List[str]:
+        """
+        Full names of the top level types declared in test_file, the test class if the file can not be parsed
+        """
+        package = self.get_package(test_file)
+        with open(test_file, "r") as f:
+            names = code_editor.top_level_types(f.read())
+        if len(names) == 0:
+            return [self.get_full_name(test_file)]
+        return [f"{package}.{name}" if package != '' else name for name in names]
+
+    @staticmethod
+    def copy_compiled_classes(batch_dir, compiled_test_dir, top_level_types):
+        """
+        Copy the classes of a test file, i.e., its top level classes and their nested classes, from batch_dir
+        :param top_level_types: full names of the top level types of the file, see get_top_level_types
+        """
+        for full_name in top_level_types:
+            package_dir = os.path.dirname(full_name.replace('.', '/'))
+            name = os.path.basename(full_name.replace('.', '/'))
+            target_dir = os.path.join(compiled_test_dir, package_dir)
+            os.makedirs(target_dir, exist_ok=True)
+            for class_file in glob.glob(os.path.join(batch_dir, package_dir, f"{glob.escape(name)}.class")) + \
+                    glob.glob(os.path.join(batch_dir, package_dir, f"{glob.escape(name)}$*.class")):
+                shutil.copy(class_file, target_dir)
+
+    def compile_in_server(self, compiled_test_dir, test_file):
+        """
+        Compile a test case with the resident javac of this project.
+        :return: a CompletedProcess like subprocess.run, or None if the server failed
+        """
+        diagnostics_file = os.path.join(compiled_test_dir, "compile_output.txt")
+        try:
+            returncode = compile_in_server(self.compile_classpath(), compiled_test_dir, diagnostics_file,
+                                           [test_file], COMPILE_TIMEOUT)
+        except (DaemonError, subprocess.TimeoutExpired) as e:
+            self.logger.warning(f"Compile server failed on {test_file}: {e}. Fall back to javac")
+            return None
+        with open(diagnostics_file, "r", errors="replace") as file:
+            diagnostics = file.read()
+        return subprocess.CompletedProcess(test_file, returncode, diagnostics, "")
 
     @staticmethod
     def get_package(test_file):
@@ -259,10 +651,12 @@ class TestRunner:
                 return True
         return False
 
+    def compile_classpath(self):
+        return f"{JUNIT_JAR}:{MOCKITO_JAR}:{LOG4J_JAR}:{self.build_dir}:{self.dependencies}:."
+
     def javac_cmd(self, compiled_test_dir, test_file):
-        classpath = f"{JUNIT_JAR}:{MOCKITO_JAR}:{LOG4J_JAR}:{self.build_dir}:{self.dependencies}:."
         classpath_file = os.path.join(compiled_test_dir, 'classpath.txt')
-        self.export_classpath(classpath_file, classpath)
+        self.export_classpath(classpath_file, self.compile_classpath())
         return ["javac", "-d", compiled_test_dir, f"@{classpath_file}", test_file]
 
     def java_cmd(self, compiled_test_dir, test_file):
@@ -324,63 +718,26 @@ class TestRunner:
     def report(self, datafile_dir, report_dir):
         """
         Generate coverage report by given coverage tool.
+        :raise TestCancelled: the cancel event was set, the report process is killed
         """
         os.makedirs(report_dir, exist_ok=True)
+        return run_process(self.report_cmd(datafile_dir, report_dir), cancel=self.cancel)
+
+    def report_cmd(self, datafile_dir, report_dir):
         if self.coverage_tool == "cobertura":
-            result = subprocess.run(["bash", os.path.join(COBERTURA_DIR, "cobertura-report.sh"),
-                                     "--format", REPORT_FORMAT, "--datafile", f"{datafile_dir}/cobertura.ser",
-                                     "--destination",
-                                     report_dir], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return ["bash", os.path.join(COBERTURA_DIR, "cobertura-report.sh"),
+                    "--format", REPORT_FORMAT, "--datafile", f"{datafile_dir}/cobertura.ser",
+                    "--destination", report_dir]
+        build_list = self.build_dir.split(":")
+        order = ["java", "-jar", JACOCO_CLI, "report", f"{datafile_dir}/jacoco.exec"]
+        for build in build_list:
+            order.append("--classfiles")
+            order.append(build)
+        if self.lean_report:
+            order += ["--xml", os.path.join(report_dir, "coverage.xml")]
         else:
-            build_list = self.build_dir.split(":")
-            order = ["java", "-jar", JACOCO_CLI, "report", f"{datafile_dir}/jacoco.exec"]
-            for build in build_list:
-                order.append("--classfiles")
-                order.append(build)
             order += ["--csv", os.path.join(report_dir, "coverage.csv"), '--html', report_dir]
-            # print(" ".join(order))
-            result = subprocess.run(
-                order, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
-
-        return result
-
-    def make_dependency(self):
-        """
-        Generate runtime dependencies of a given project
-        """
-        mvn_dependency_dir = 'target/dependency'
-        if not self.has_made():
-            # Run mvn command to generate dependencies
-            # print("Making dependency for project", self.target_path)
-            subprocess.run(
-                f"mvn dependency:copy-dependencies -DoutputDirectory={mvn_dependency_dir} -f {self.target_path}/pom.xml",
-                shell=True,
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            subprocess.run(f"mvn package -DskipTests -f {self.target_path}/pom.xml", shell=True,
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        dep_jars = list([])
-        for module in self.modules:
-            module_dir = os.path.dirname(module)
-            logging.debug(f"Looking for dependencies in {module_dir}")
-            dep_jars += [os.path.join(os.path.abspath(module_dir), dep)
-                         for dep in glob.glob("target/dependency/**/*.jar", root_dir=module_dir, recursive=True)]
-            # dep_jars += [glob.glob(os.path.join(module_dir, "target/dependency/**/*.jar"), recursive=True)]
-        # dep_jars = glob.glob(self.target_path + "/target/dependency/**/*.jar", recursive=True)
-
-        return ':'.join(list(set(dep_jars)))
-
-    def has_made(self):
-        """
-        If the project has made before
-        """
-        for dirpath, dirnames, filenames in os.walk(self.target_path):
-            if 'pom.xml' in filenames and 'target' in dirnames:
-                target = os.path.join(dirpath, 'target')
-                if 'dependency' in os.listdir(target):
-                    return True
-        return False
+        return order
 
     def copy_tests(self, target_dir):
         """
@@ -403,3 +760,125 @@ class TestRunner:
                 continue
             shutil.copyfile(tc, os.path.join(target_dir, 'test_cases', os.path.basename(tc)))
             # os.system(f'cp "{tc}" "{os.path.join(target_dir, 'test_cases')}"')
+
+
+def run_shard(runner_args, test_files, compiled_test_dir, compiler_output, test_output) -> Tuple[int, int]:
+    """
+    Compile and run test_files in sequence in a worker process of TestRunner.run_shards
+    :param runner_args: the keyword arguments of the TestRunner
+    :return: (compile errors, test run errors)
+    """
+    runner = TestRunner(**runner_args)
+    for test_file in test_files:
+        try:
+            runner.run_single_test(test_file, compiled_test_dir, compiler_output, test_output)
+        except Exception as e:
+            print(e)
+    return runner.COMPILE_ERROR, runner.TEST_RUN_ERROR
+
+
+class AsyncTestRunner(TestRunner):
+    """
+    TestRunner on asyncio subprocesses, so that thousands of tests can be in flight on one event loop without a
+    thread each. The processes are bounded by ProcessLimits. A test is stopped by cancelling its task, which kills
+    its process. The test daemon and the compile server are called in the default executor.
+
+    results = await asyncio.gather(*[AsyncTestRunner(workspace, put_path, workspace).start_single_test_async()
+                                     for workspace in workspaces])
+    """
+
+    def __init__(self, *args, limits: Optional[ProcessLimits] = None, **kwargs):
+        """
+        :param limits: the process bounds, ProcessLimits.shared() of the running event loop by default.
+        See TestRunner for the other parameters
+        """
+        super().__init__(*args, **kwargs)
+        self.limits = limits
+
+    def process_limits(self) -> ProcessLimits:
+        if self.limits is None:
+            self.limits = ProcessLimits.shared()
+        return self.limits
+
+    async def start_single_test_async(self, precompiled=False):
+        """
+        See start_single_test
+        """
+        temp_dir = os.path.join(self.test_path, "temp")
+        compiled_test_dir = os.path.join(self.test_path, "runtemp")
+        os.makedirs(compiled_test_dir, exist_ok=True)
+        try:
+            if self.coverage_tool != "jacoco":
+                await asyncio.to_thread(self.instrument, compiled_test_dir, compiled_test_dir)
+            test_file = os.path.abspath(glob.glob(temp_dir + '/*.java')[0])
+            compiler_output = os.path.join(temp_dir, 'compile_error')
+            test_output = os.path.join(temp_dir, 'runtime_error')
+            if precompiled and os.path.exists(f"{compiler_output}.txt"):
+                return False
+            if not await self.run_single_test_async(test_file, compiled_test_dir, compiler_output, test_output,
+                                                    compile=not precompiled):
+                return False
+            else:
+                cov_check_dir = os.path.join(self.test_path, "cov_check_dir")
+                if self.use_coverage_server and self.coverage_tool == "jacoco":
+                    os.makedirs(cov_check_dir, exist_ok=True)
+                else:
+                    await self.report_async(compiled_test_dir, cov_check_dir)
+        except Exception as e:
+            print(e)
+            return False
+        return True
+
+    async def run_single_test_async(self, test_file, compiled_test_dir, compiler_output, test_output, compile=True):
+        """
+        See run_single_test
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise TestCancelled(f"Cancelled before running {os.path.basename(test_file)}")
+        if compile and not await self.compile_async(test_file, compiled_test_dir, compiler_output):
+            return False
+        test_output_file = self.test_output_file(test_output, test_file)
+        try:
+            result = None
+            if self.use_daemon and self.coverage_tool == "jacoco":
+                result = await asyncio.to_thread(self.run_in_daemon, compiled_test_dir, test_file)
+            if result is None:
+                cmd = self.java_cmd(compiled_test_dir, test_file)
+                if self.debug:
+                    logging.error(f'Java command:\n{" ".join(cmd)}')
+                async with self.process_limits().jvm:
+                    result = await run_process_async(cmd, TIMEOUT)
+            if result.returncode != 0:
+                self.TEST_RUN_ERROR += 1
+                self.export_runtime_output(result, test_output_file)
+                return False
+        except subprocess.TimeoutExpired:
+            self.logger.error("Time Out!")
+            self.export_timeout_error(test_output_file)
+            return False
+        return True
+
+    async def compile_async(self, test_file, compiled_test_dir, compiler_output):
+        """
+        See compile
+        """
+        os.makedirs(compiled_test_dir, exist_ok=True)
+        result = None
+        if self.use_compile_server:
+            result = await asyncio.to_thread(self.compile_in_server, compiled_test_dir, test_file)
+        if result is None:
+            cmd = self.javac_cmd(compiled_test_dir, test_file)
+            async with self.process_limits().javac:
+                result = await run_process_async(cmd)
+        if result.returncode != 0:
+            self.export_compiler_output(result, compiler_output, test_file)
+            return False
+        return True
+
+    async def report_async(self, datafile_dir, report_dir):
+        """
+        See report
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        async with self.process_limits().jvm:
+            return await run_process_async(self.report_cmd(datafile_dir, report_dir))